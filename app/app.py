@@ -1,12 +1,38 @@
-from fastapi import FastAPI, Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, Response, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 from datetime import date, time, datetime
-from pymongo.results import InsertOneResult
-from pymongo.errors import PyMongoError
-from app.controlador.PatientCrud import PatientCrud  # ✅ ahora sí existe y se puede importar
+import asyncio
+import gzip
+from contextlib import asynccontextmanager
+from app.controlador.PatientCrud import PatientCrud, BULK_CHUNK_SIZE  # ✅ ahora sí existe y se puede importar
+from app.controlador.PatientCache import etag_matches, etag_version, weak_etag
+from app.controlador.PatientValidator import preload_models
+from app.controlador.PatientSearch import (
+    SearchParameterError, build_projection, build_query, is_search, parse_identifier_token,
+)
+from app.controlador.AppointmentCrud import AppointmentCrud
+from app.controlador.AsyncCrud import AsyncCrud, shutdown_executor
+from app.controlador.BulkExport import BulkExporter, shutdown_executor as shutdown_export_executor
+from app.controlador.fechas import http_date, not_modified_since, parse_instant
+from app.controlador.WriteQueue import WRITE_QUEUE_ENABLED, WriteQueue, WriteQueueFull
+from app.controlador import bundles
+from app.controlador.serializacion import FHIRJSONResponse
+from app.controlador import metricas
+from app.controlador.compresion import CompressionMiddleware
+from app.controlador.admision import AdmissionMiddleware, admission
+from app.controlador.HL7Ingest import HL7Ingest
+from app.controlador.MLLPServer import HL7_BATCH_DELAY_MS, HL7_BATCH_SIZE, MLLP_PORT, MLLPServer
+from app.controlador.EventBus import RESYNC, EventBus, EventBusFull
+from app.controlador.PatientMatch import MPI_POSSIBLE_SCORE
+from app.controlador.DashboardStats import STATS_AGE_BANDS
+from pymongo import monitoring
+from app.controlador import sqlite_store
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from connection import close_client, pool_stats
 
 
 # --- Definición de Modelos Pydantic ---
@@ -25,12 +51,35 @@ class AppointmentCreate(BaseModel):
     examenesSolicitados: List[str] = Field(default_factory=list)
     notasPaciente: Optional[str] = None
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # En segundo plano: el worker empieza a aceptar peticiones sin esperar a
+    # MongoDB ni a cargar el modelo Patient (si no vino ya cargado del maestro
+    # de gunicorn con preload_app, ver app/wsgi.py).
+    app.state.index_bootstrap = asyncio.create_task(bootstrap_indexes())
+    app.state.model_preload = asyncio.create_task(asyncio.to_thread(preload_models))
+    if MLLP_PORT:
+        await mllp_server.start()
+    yield
+    await mllp_server.close()
+    await asyncio.to_thread(event_bus.close)
+    # Lo que quede en las colas de escritura se escribe antes de cerrar el pool de hilos
+    await hl7_queue.close()
+    await patient_write_queue.close()
+    await appointment_write_queue.close()
+    shutdown_export_executor()
+    shutdown_executor()
+    patient_crud.sync.validation_pool.shutdown()
+    close_client()
+
 # --- Configuración de la Aplicación FastAPI ---
 
 app = FastAPI(
     title="Backend LIS - Agendamiento de Citas y Gestión de Pacientes",
     description="API para gestionar el agendamiento de citas de laboratorio y los datos de pacientes en el sistema LIS.",
     version="1.0.0",
+    default_response_class=FHIRJSONResponse,
+    lifespan=lifespan,
 )
 
 origins = [
@@ -42,6 +91,21 @@ origins = [
     "https://hl7-fhir-ehr-brayan-123456.onrender.com"
 ]
 
+# Compresión negociada (zstd, br, gzip) de las respuestas JSON/NDJSON. Es el
+# middleware más interno: su tiempo cuenta en la fase "compression" de /metrics.
+app.add_middleware(CompressionMiddleware)
+# Control de admisión de /api: límites de concurrencia por grupo de rutas y
+# cubetas de tokens por cliente. Queda dentro de las métricas para que los
+# rechazos (429/503) aparezcan en /metrics, y fuera de la compresión.
+app.add_middleware(AdmissionMiddleware)
+# Métricas por petición (/metrics). Se añade antes que CORS para quedar por
+# dentro y medir solo el trabajo de la ruta.
+app.add_middleware(metricas.MetricsMiddleware)
+# Los clientes de MongoDB creados después (uno por worker) reportan sus comandos
+monitoring.register(metricas.command_listener)
+# ...y también los del almacenamiento SQLite (STORAGE_BACKEND=sqlite)
+sqlite_store.register(metricas.command_listener)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -51,7 +115,97 @@ app.add_middleware(
 )
 
 # --- Instancias y Configuración ---
-patient_crud = PatientCrud()
+# Los CRUD son síncronos (pymongo); AsyncCrud los ejecuta en un pool de hilos
+# acotado para que las rutas async no bloqueen el event loop del worker.
+# El cliente de MongoDB se crea de forma perezosa, una vez por worker (connection.py).
+patient_crud = AsyncCrud(PatientCrud())
+appointment_crud = AsyncCrud(AppointmentCrud())
+# Colas de escritura (WRITE_QUEUE_ENABLED=1): las altas individuales se agrupan en lotes
+patient_write_queue = WriteQueue(patient_crud.bulk_create_patients)
+appointment_write_queue = WriteQueue(appointment_crud.insert_appointments)
+# Exportaciones $export: leen las colecciones sin ordenar para usar el índice de meta.lastUpdated
+bulk_exporter = BulkExporter({
+    "Patient": lambda batch_size, query: patient_crud.sync.iter_patients(batch_size, query, ordered=False),
+    "Appointment": lambda batch_size, query: appointment_crud.sync.iter_appointments(batch_size, query, ordered=False),
+})
+# Mensajes HL7 v2 (ADT^A04/A08, ORM^O01) por MLLP cuando MLLP_PORT está definido:
+# los de todas las conexiones del worker se escriben juntos, en lotes
+hl7_ingest = AsyncCrud(HL7Ingest(patient_crud.sync, appointment_crud.sync))
+hl7_queue = WriteQueue(hl7_ingest.ingest_messages, HL7_BATCH_SIZE, HL7_BATCH_DELAY_MS)
+mllp_server = MLLPServer(hl7_queue.submit)
+# Índice maestro de pacientes: Patient/$match y los posibles duplicados por revisar
+patient_matcher = AsyncCrud(patient_crud.sync.matcher)
+# Notificaciones de cambios (/api/events): un único vigilante de la base de datos
+# por worker reparte cada cambio a todos sus clientes SSE/WebSocket
+event_bus = EventBus({
+    "Patient": (lambda: patient_crud.sync.collection, lambda doc: PatientCrud._to_fhir(dict(doc))),
+    "Appointment": (lambda: appointment_crud.sync.collection, lambda doc: doc),
+})
+
+async def bootstrap_indexes():
+    try:
+        await patient_crud.ensure_indexes()
+        await appointment_crud.ensure_indexes()
+    except Exception as e:
+        print(f"No se pudieron crear los índices: {e}")
+
+MAX_SLOT_RANGE_DAYS = 31
+
+# --- Listados: paginación por cursor y streaming ---
+
+async def list_response(request: Request, count, after, stream, crud, page_method, iter_method, all_method):
+    """
+    Resuelve un listado según los parámetros recibidos:
+    - `_stream=ndjson|bundle`: exporta toda la colección leyendo el cursor por lotes.
+    - `_count`/`after`: devuelve una página como Bundle searchset con enlace `next`.
+    - sin parámetros: la lista completa, como hasta ahora.
+    """
+    if stream is not None:
+        resources = getattr(crud.sync, iter_method)(bundles.STREAM_BATCH_SIZE)
+        if stream == "ndjson":
+            return StreamingResponse(bundles.stream_ndjson(resources), media_type="application/fhir+ndjson")
+        return StreamingResponse(bundles.stream_bundle(resources), media_type="application/fhir+json")
+
+    if count is None and after is None:
+        return FHIRJSONResponse(await getattr(crud, all_method)())
+
+    try:
+        resources, next_cursor = await getattr(crud, page_method)(count or bundles.DEFAULT_PAGE_SIZE, after)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Cursor 'after' inválido.")
+    next_url = str(request.url.include_query_params(after=next_cursor)) if next_cursor else None
+    return FHIRJSONResponse(bundles.searchset_bundle(resources, str(request.url), next_url))
+
+async def cached_list(request: Request, crud, build):
+    """
+    Añade a un listado Cache-Control, Last-Modified y ETag a partir del
+    meta.lastUpdated más reciente de la colección, y responde 304 sin
+    construirlo si el cliente ya tiene esa versión. `build` es la corrutina
+    que construye la respuesta.
+
+    El validador se lee antes que el listado: si entre medias llega una
+    escritura, la respuesta lleva un validador más antiguo que su contenido y
+    la siguiente revalidación simplemente la vuelve a descargar.
+    """
+    headers = {"Cache-Control": bundles.LIST_CACHE_CONTROL}
+    newest = await crud.last_modified()
+    if newest is not None:
+        etag = weak_etag("l" + "".join(c for c in newest if c.isdigit()))
+        headers["ETag"] = etag
+        headers["Last-Modified"] = http_date(newest)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = etag_matches(if_none_match, etag)
+        else:
+            if_modified_since = request.headers.get("if-modified-since")
+            not_modified = if_modified_since is not None and not_modified_since(newest, if_modified_since)
+        if not_modified:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response = await build()
+    if not isinstance(response, Response):
+        response = FHIRJSONResponse(response)
+    response.headers.update(headers)
+    return response
 
 # --- Rutas (Endpoints) de la API ---
 
@@ -59,6 +213,117 @@ patient_crud = PatientCrud()
 async def read_root():
     return {"message": "Backend del Sistema LIS funcionando con FastAPI. ¡Hola!"}
 
+@app.get("/internal/pool", include_in_schema=False)
+async def get_pool_stats():
+    return pool_stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Métricas de todos los workers en formato de texto de Prometheus."""
+    content = await asyncio.to_thread(metricas.render_prometheus)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/internal/cache", include_in_schema=False)
+async def get_cache_stats():
+    return {
+        "patients": patient_crud.sync.cache.stats(),
+        "validation": patient_crud.sync.validator.stats(),
+        "validationPool": patient_crud.sync.validation_pool.stats(),
+    }
+
+@app.get("/internal/write-queue", include_in_schema=False)
+async def get_write_queue_stats():
+    return {
+        "enabled": WRITE_QUEUE_ENABLED,
+        "patients": patient_write_queue.stats(),
+        "appointments": appointment_write_queue.stats(),
+    }
+
+@app.get("/internal/hl7", include_in_schema=False)
+async def get_hl7_stats():
+    return {"server": mllp_server.stats(), "queue": hl7_queue.stats()}
+
+@app.get("/internal/admission", include_in_schema=False)
+async def get_admission_stats():
+    return admission.stats()
+
+@app.get("/internal/events", include_in_schema=False)
+async def get_event_stats():
+    return event_bus.stats()
+
+# --- Notificaciones de cambios ---
+
+def event_topics(topic):
+    """Temas pedidos (Patient, Appointment, separados por comas); todos si no se indica."""
+    if not topic:
+        return set(event_bus.topics)
+    topics = {t.strip() for t in topic.split(",") if t.strip()}
+    unknown = topics - set(event_bus.topics)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Tema desconocido: {', '.join(sorted(unknown))}")
+    return topics
+
+RESYNC_EVENT = b"event: resync\ndata: {}\n\n"
+
+@app.get("/api/events")
+async def stream_events(request: Request, topic: Optional[str] = None, resume: Optional[str] = None):
+    """
+    Server-Sent Events con un Bundle subscription-notification por cada alta o
+    cambio. El campo id de cada evento es su token de reanudación: al
+    reconectar, EventSource lo envía en Last-Event-ID. Un evento "resync"
+    indica que se perdieron notificaciones y hay que volver a leer el listado.
+    """
+    topics = event_topics(topic)
+    try:
+        subscription = event_bus.subscribe(topics, request.headers.get("last-event-id") or resume)
+    except EventBusFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    async def send():
+        try:
+            async for event in subscription.events():
+                if event is RESYNC:
+                    yield RESYNC_EVENT
+                elif event is None:
+                    yield b": keep-alive\n\n"
+                else:
+                    yield event.sse
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(send(), media_type="text/event-stream", headers={
+        # no-transform: sin comprimir (CompressionMiddleware ni proxies), que
+        # retendría o vaciaría el compresor en cada evento de cada conexión
+        "Cache-Control": "no-cache, no-transform",
+        # Sin búfer en nginx/Render: cada evento se entrega al momento
+        "X-Accel-Buffering": "no",
+    })
+
+@app.websocket("/api/events/ws")
+async def websocket_events(websocket: WebSocket, topic: Optional[str] = None, resume: Optional[str] = None):
+    """Las mismas notificaciones que /api/events, como mensajes JSON por WebSocket."""
+    try:
+        topics = event_topics(topic)
+        subscription = event_bus.subscribe(topics, resume)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    except EventBusFull as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+    await websocket.accept()
+    try:
+        async for event in subscription.events():
+            if event is RESYNC:
+                await websocket.send_text('{"type":"resync"}')
+                await websocket.close(code=1013)
+                return
+            await websocket.send_text('{"type":"heartbeat"}' if event is None else event.text)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_bus.unsubscribe(subscription)
+
 @app.post("/api/appointments", response_model=dict, status_code=status.HTTP_201_CREATED)
 async def create_appointment(appointment: AppointmentCreate):
     try:
@@ -67,53 +332,518 @@ async def create_appointment(appointment: AppointmentCreate):
         appointment_data["fechaCita"] = fecha_hora_cita
         appointment_data["createdAt"] = datetime.utcnow()
         appointment_data["estadoCita"] = "Pendiente"
-        
-        result: InsertOneResult = appointments_collection.insert_one(appointment_data)
+        appointment_data["horaCita"] = appointment.horaCita.isoformat()  # BSON no admite datetime.time
+
+        if WRITE_QUEUE_ENABLED:
+            # La reserva de la franja es individual (atómica); solo el insert se agrupa
+            status_code, result = await appointment_crud.reserve_appointment_slot(appointment_data)
+            if status_code == "success":
+                try:
+                    status_code, result = await appointment_write_queue.submit(appointment_data)
+                except WriteQueueFull as e:
+                    await appointment_crud.release_appointment_slot(appointment_data)
+                    raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        else:
+            status_code, result = await appointment_crud.create_appointment(appointment_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
 
+    if status_code == "success":
         return {
             "message": "Cita creada exitosamente",
-            "appointmentId": str(result.inserted_id),
+            "appointmentId": result,
             "data": appointment_data
         }
+    elif status_code == "conflict":
+        raise HTTPException(status_code=409, detail=result)
+    elif status_code == "invalid":
+        raise HTTPException(status_code=422, detail=result)
+    raise HTTPException(status_code=500, detail=f"Error de base de datos: {result}")
 
-    except PyMongoError as e:
-        raise HTTPException(status_code=500, detail=f"Error de base de datos: {str(e)}")
+@app.get("/api/appointments/slots")
+async def get_free_appointment_slots(tipoServicio: str, desde: date, hasta: Optional[date] = None):
+    """Franjas libres de un servicio entre dos fechas (máximo MAX_SLOT_RANGE_DAYS días)."""
+    hasta = hasta or desde
+    if hasta < desde or (hasta - desde).days >= MAX_SLOT_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"El rango debe ser de 1 a {MAX_SLOT_RANGE_DAYS} días.")
+    try:
+        return {
+            "tipoServicio": tipoServicio,
+            "dias": await appointment_crud.get_free_slots(tipoServicio, desde, hasta),
+        }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/appointments/$stats")
+async def get_appointment_stats(desde: Optional[date] = None, hasta: Optional[date] = None):
+    """
+    Citas por tipoServicio, por estadoCita y por día (de `desde` a `hasta`, todos
+    por defecto), leídas de los contadores del panel sin recorrer las citas.
+    """
+    if desde and hasta and hasta < desde:
+        raise HTTPException(status_code=400, detail="'hasta' no puede ser anterior a 'desde'.")
+    try:
+        return await appointment_crud.get_stats(desde, hasta)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/appointments")
-async def get_all_appointments():
+async def get_all_appointments(
+    request: Request,
+    count: Optional[int] = Query(None, alias="_count", ge=1, le=bundles.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: Optional[str] = Query(None, alias="_stream", pattern="^(ndjson|bundle)$"),
+):
     try:
-        appointments = []
-        for doc in appointments_collection.find():
-            doc["_id"] = str(doc["_id"])
-            appointments.append(doc)
-        return appointments
+        return await cached_list(request, appointment_crud, lambda: list_response(
+            request, count, after, stream, appointment_crud,
+            "get_appointments_page", "iter_appointments", "get_all_appointments",
+        ))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/patients", response_model=dict, status_code=status.HTTP_201_CREATED)
 async def create_or_update_patient_in_lis(patient_data: dict):
-    status_code, result = patient_crud.create_or_update_patient_fhir_resource(patient_data)
+    if WRITE_QUEUE_ENABLED:
+        try:
+            status_code, result = await patient_write_queue.submit(patient_data)
+        except WriteQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    else:
+        status_code, result = await patient_crud.create_or_update_patient_fhir_resource(patient_data)
     if status_code == "success":
         return {"message": "Paciente FHIR procesado exitosamente", "patientId": result}
+    elif status_code in ("conflict", "duplicate"):
+        raise HTTPException(status_code=409, detail=result)
+    elif status_code == "invalid":
+        raise HTTPException(status_code=422, detail=f"Paciente FHIR inválido: {result}")
     else:
         raise HTTPException(status_code=500, detail=f"Error al procesar paciente: {result}")
 
-@app.get("/api/patients/{object_id}", response_model=dict)
-async def get_patient_by_mongodb_id(object_id: str):
-    status_code, patient = patient_crud.get_patient_by_object_id(object_id)
-    if status_code == "success":
-        return patient.dict()
+@app.put("/api/patients", response_model=dict)
+async def conditional_update_patient(patient_data: dict, identifier: str, response: Response):
+    """Actualización condicional FHIR: PUT /api/patients?identifier=system|value."""
+    system, value = parse_identifier_token(identifier)
+    if not system or not value:
+        raise HTTPException(status_code=400, detail="El parámetro identifier debe tener la forma system|value.")
+    status_code, result = await patient_crud.upsert_patient(patient_data, (system, value))
+    if status_code in ("created", "updated"):
+        response.status_code = status.HTTP_201_CREATED if status_code == "created" else status.HTTP_200_OK
+        return {"message": "Paciente FHIR procesado exitosamente", "patientId": result}
+    elif status_code == "conflict":
+        raise HTTPException(status_code=412, detail=result)
+    elif status_code == "duplicate":
+        raise HTTPException(status_code=409, detail=result)
+    elif status_code == "invalid":
+        raise HTTPException(status_code=422, detail=f"Paciente FHIR inválido: {result}")
+    else:
+        raise HTTPException(status_code=500, detail=f"Error al procesar paciente: {result}")
+
+# --- Bulk Data $export: kick-off, estado y descarga ---
+
+EXPORT_OUTPUT_FORMATS = {"application/fhir+ndjson", "application/ndjson", "ndjson"}
+EXPORT_FILE_CHUNK_BYTES = 1024 * 1024
+
+def kick_off_export(request: Request, types):
+    """Valida la petición de kick-off y crea el trabajo. Responde 202 con la URL de estado."""
+    if "respond-async" not in request.headers.get("prefer", ""):
+        raise HTTPException(status_code=400, detail="$export requiere la cabecera 'Prefer: respond-async'.")
+    output_format = request.query_params.get("_outputFormat")
+    if output_format is not None and output_format not in EXPORT_OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"_outputFormat no soportado: {output_format}")
+    since = request.query_params.get("_since")
+    try:
+        since = parse_instant(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"_since inválido: {since!r}")
+
+    job_id = bulk_exporter.kick_off(types, since, str(request.url))
+    status_url = str(request.url_for("get_export_status", job_id=job_id))
+    return Response(status_code=status.HTTP_202_ACCEPTED, headers={"Content-Location": status_url})
+
+@app.get("/api/$export")
+async def export_all(request: Request, _type: Optional[str] = None):
+    """Exporta pacientes y citas (o los tipos de `_type`) en NDJSON, de forma asíncrona."""
+    types = [t.strip() for t in _type.split(",") if t.strip()] if _type else list(bulk_exporter.sources)
+    unknown = [t for t in types if t not in bulk_exporter.sources]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Tipos no soportados en _type: {unknown}")
+    return await asyncio.to_thread(kick_off_export, request, types)
+
+@app.get("/api/patients/$export")
+async def export_patients(request: Request):
+    return await asyncio.to_thread(kick_off_export, request, ["Patient"])
+
+@app.get("/api/$export-status/{job_id}")
+async def get_export_status(job_id: str, request: Request):
+    job = await asyncio.to_thread(bulk_exporter.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada.")
+    if job["status"] == "in-progress":
+        done = sum(job["progress"].values())
+        return Response(status_code=status.HTTP_202_ACCEPTED, headers={
+            "X-Progress": f"{done} recursos exportados",
+            "Retry-After": "5",
+        })
+    if job["status"] == "error":
+        return FHIRJSONResponse(bundles.operation_outcome(job["error"], code="exception"), status_code=500)
+    return {
+        "transactionTime": job["transactionTime"],
+        "request": job["request"],
+        "requiresAccessToken": False,
+        "output": [
+            {
+                "type": output["type"],
+                "url": str(request.url_for("download_export_file", job_id=job_id, file_name=output["file"])),
+                "count": output["count"],
+            }
+            for output in job["output"]
+        ],
+        "error": [],
+    }
+
+@app.delete("/api/$export-status/{job_id}", status_code=status.HTTP_202_ACCEPTED)
+async def cancel_export(job_id: str):
+    if not await asyncio.to_thread(bulk_exporter.cancel, job_id):
+        raise HTTPException(status_code=404, detail="Exportación no encontrada.")
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+@app.get("/api/$export-files/{job_id}/{file_name}")
+async def download_export_file(job_id: str, file_name: str, request: Request):
+    path = await asyncio.to_thread(bulk_exporter.file_path, job_id, file_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Fichero de exportación no encontrado.")
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        # El fichero ya está comprimido: se envía tal cual
+        return FileResponse(path, media_type="application/fhir+ndjson", headers={"Content-Encoding": "gzip"})
+
+    def decompressed():
+        with gzip.open(path, "rb") as f:
+            while chunk := f.read(EXPORT_FILE_CHUNK_BYTES):
+                yield chunk
+    return StreamingResponse(decompressed(), media_type="application/fhir+ndjson")
+
+@app.get("/api/patients/summary")
+async def get_patient_summaries(
+    request: Request,
+    count: int = Query(bundles.DEFAULT_PAGE_SIZE, alias="_count", ge=1, le=bundles.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    """
+    Listado resumido para el portal: id, nombre, identificador, fecha de
+    nacimiento y género de cada paciente, paginado con `after`.
+    """
+    async def page():
+        try:
+            summaries, next_cursor = await patient_crud.get_patient_summaries(count, after)
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Cursor 'after' inválido.")
+        next_url = str(request.url.include_query_params(after=next_cursor)) if next_cursor else None
+        return FHIRJSONResponse({"patients": summaries, "next": next_url})
+    return await cached_list(request, patient_crud, page)
+
+# --- Índice maestro de pacientes: $match y posibles duplicados ---
+
+MATCH_LINK_STATES = {"pendiente", "confirmado", "descartado"}
+
+def match_parameters(body):
+    """(Patient, count, onlyCertainMatches) de un Patient o de un Parameters de $match."""
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Se esperaba un Patient o un Parameters.")
+    if body.get("resourceType") == "Patient":
+        return body, None, False
+    if body.get("resourceType") != "Parameters":
+        raise HTTPException(status_code=400, detail="Se esperaba un Patient o un Parameters.")
+    patient, count, only_certain = None, None, False
+    for parameter in body.get("parameter") or []:
+        name = parameter.get("name")
+        if name == "resource":
+            patient = parameter.get("resource")
+        elif name == "count":
+            count = parameter.get("valueInteger")
+        elif name == "onlyCertainMatches":
+            only_certain = bool(parameter.get("valueBoolean"))
+    if not isinstance(patient, dict) or patient.get("resourceType") != "Patient":
+        raise HTTPException(status_code=400, detail="El parámetro resource debe ser un Patient.")
+    return patient, count, only_certain
+
+@app.post("/api/patients/$match")
+async def match_patients(request: Request, body: dict):
+    """
+    Operación Patient/$match: pacientes que pueden ser el mismo que el recibido,
+    con su puntuación y grado de coincidencia, de mayor a menor.
+    """
+    patient, count, only_certain = match_parameters(body)
+    try:
+        matches = await patient_matcher.find_matches(patient, threshold=MPI_POSSIBLE_SCORE)
+    except (AttributeError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Patient no válido para $match: {e}")
+    if only_certain:
+        matches = [match for match in matches if match[2] == "certain"]
+    matches = matches[:count or bundles.DEFAULT_PAGE_SIZE]
+    resources = {}
+    if matches:
+        query = {"_id": {"$in": [ObjectId(match_id) for match_id, _, _ in matches]}}
+        found, _ = await patient_crud.search_patients(query, len(matches))
+        resources = {resource["id"]: resource for resource in found}
+    return FHIRJSONResponse(bundles.match_bundle(
+        [(resources[match_id], score, grade) for match_id, score, grade in matches if match_id in resources],
+        str(request.url),
+    ))
+
+@app.get("/api/patients/$stats")
+async def get_patient_stats(bandas: Optional[str] = None):
+    """
+    Pacientes por género y por banda de edad, leídos de los contadores del
+    panel. `bandas` son los límites inferiores de cada banda (p. ej. 0,18,65).
+    """
+    bands = STATS_AGE_BANDS
+    if bandas:
+        try:
+            bands = [int(age) for age in bandas.split(",")]
+        except ValueError:
+            bands = []
+        if not bands or bands[0] < 0 or any(low >= high for low, high in zip(bands, bands[1:])):
+            raise HTTPException(status_code=400, detail="'bandas' debe ser una lista creciente de edades.")
+    try:
+        return await patient_crud.get_stats(bands)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/patients/$duplicates")
+async def get_patient_duplicates(
+    request: Request,
+    count: int = Query(bundles.DEFAULT_PAGE_SIZE, alias="_count", ge=1, le=bundles.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    estado: Optional[str] = "pendiente",
+    patient: Optional[str] = None,
+):
+    """
+    Pares de posibles duplicados (de las altas y de PatientDedup) para revisar,
+    por estado (`pendiente`, `confirmado`, `descartado`) o de un paciente.
+    """
+    if estado and estado not in MATCH_LINK_STATES:
+        raise HTTPException(status_code=400, detail=f"Estado desconocido: {estado}")
+    links, next_cursor = await patient_matcher.get_links(count, after, estado, patient)
+    next_url = str(request.url.include_query_params(after=next_cursor)) if next_cursor else None
+    return FHIRJSONResponse({"duplicates": links, "next": next_url})
+
+@app.put("/api/patients/$duplicates/{link_id}")
+async def review_patient_duplicate(link_id: str, body: dict):
+    """Resultado de la revisión de un par: {"estado": "confirmado" | "descartado" | "pendiente"}."""
+    estado = body.get("estado")
+    if estado not in MATCH_LINK_STATES:
+        raise HTTPException(status_code=400, detail=f"Estado desconocido: {estado}")
+    if not await patient_matcher.set_link_state(link_id, estado):
+        raise HTTPException(status_code=404, detail="Par de pacientes no encontrado.")
+    return {"id": link_id, "estado": estado}
+
+@app.get("/api/patients/{object_id}")
+async def get_patient_by_mongodb_id(object_id: str, request: Request):
+    # Caché de lectura: un acierto responde sin consultar MongoDB, y si el
+    # cliente ya tiene esa versión (If-None-Match) se responde 304.
+    cache = patient_crud.sync.cache
+    entry = cache.get(object_id)
+    if entry is None:
+        status_code, patient = await patient_crud.get_patient_by_object_id(object_id)
+        if status_code == "notFound":
+            raise HTTPException(status_code=404, detail="Paciente no encontrado.")
+        elif status_code != "success":
+            raise HTTPException(status_code=500, detail=patient)
+        entry = cache.put(object_id, patient)
+
+    headers = {"ETag": entry.etag}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.put("/api/patients/{object_id}", response_model=dict)
+async def update_patient_by_id(object_id: str, patient_data: dict, request: Request, response: Response):
+    """Actualización FHIR por id. Con If-Match: W/"<versión>" falla con 412 si el paciente ya cambió."""
+    if patient_data.get("id") not in (None, object_id):
+        raise HTTPException(status_code=400, detail="El id del recurso no coincide con el de la URL.")
+    if_match = request.headers.get("if-match")
+    version = etag_version(if_match) if if_match else None
+    if if_match and version is None:
+        raise HTTPException(status_code=400, detail="If-Match debe tener la forma W/\"<versión>\".")
+    status_code, result = await patient_crud.update_patient(object_id, patient_data, version)
+    if status_code == "updated":
+        response.headers["ETag"] = weak_etag(result)
+        return {"message": "Paciente FHIR actualizado exitosamente", "patientId": object_id, "versionId": result}
     elif status_code == "notFound":
         raise HTTPException(status_code=404, detail="Paciente no encontrado.")
+    elif status_code == "preconditionFailed":
+        raise HTTPException(status_code=412, detail=result)
+    elif status_code == "conflict":
+        raise HTTPException(status_code=409, detail=result)
+    elif status_code == "invalid":
+        raise HTTPException(status_code=422, detail=f"Paciente FHIR inválido: {result}")
     else:
+        raise HTTPException(status_code=500, detail=f"Error al procesar paciente: {result}")
+
+@app.get("/api/patients/{object_id}/_history")
+async def get_patient_history(
+    object_id: str,
+    request: Request,
+    _count: int = Query(bundles.DEFAULT_PAGE_SIZE, ge=1, le=bundles.MAX_PAGE_SIZE),
+    before: Optional[int] = Query(None, ge=2),
+):
+    """Historial del paciente como Bundle history, de la versión más reciente a la más antigua."""
+    status_code, result = await patient_crud.get_patient_history(object_id, _count, before)
+    if status_code == "notFound":
+        raise HTTPException(status_code=404, detail="Paciente no encontrado.")
+    elif status_code != "success":
+        raise HTTPException(status_code=500, detail=result)
+    versions, next_before = result
+    next_url = str(request.url.include_query_params(before=next_before)) if next_before else None
+    return bundles.history_bundle(versions, str(request.url), next_url)
+
+@app.get("/api/patients/{object_id}/_history/{version_id}")
+async def read_patient_version(object_id: str, version_id: str):
+    status_code, patient = await patient_crud.get_patient_version(object_id, version_id)
+    if status_code == "notFound":
+        raise HTTPException(status_code=404, detail="Versión del paciente no encontrada.")
+    elif status_code != "success":
         raise HTTPException(status_code=500, detail=patient)
+    meta = patient.get("meta") or {}
+    headers = {"ETag": weak_etag(meta.get("versionId", version_id))}
+    if meta.get("lastUpdated"):
+        headers["Last-Modified"] = http_date(meta["lastUpdated"])
+    return FHIRJSONResponse(patient, headers=headers)
+
+@app.post("/api")
+async def process_fhir_bundle(bundle: dict):
+    """Procesa un Bundle FHIR de tipo batch o transaction con entradas POST de Patient."""
+    bundle_type = bundle.get("type")
+    if bundle.get("resourceType") != "Bundle" or bundle_type not in ("batch", "transaction"):
+        raise HTTPException(status_code=400, detail="Se espera un Bundle de tipo 'batch' o 'transaction'.")
+
+    entries = bundle.get("entry") or []
+    outcomes = [None] * len(entries)
+    positions, payloads = [], []
+    for position, entry in enumerate(entries):
+        method = (entry.get("request") or {}).get("method", "POST").upper()
+        resource = entry.get("resource") or {}
+        if method != "POST" or resource.get("resourceType") != "Patient":
+            outcomes[position] = ("unsupported", "Solo se admiten entradas POST de recursos Patient.")
+        else:
+            positions.append(position)
+            payloads.append(resource)
+
+    if bundle_type == "transaction":
+        if len(payloads) != len(entries):
+            raise HTTPException(status_code=400, detail="La transacción contiene entradas no soportadas.")
+        status_code, result = await patient_crud.create_patients_transaction(payloads)
+        if status_code == "invalid":
+            raise HTTPException(status_code=400, detail=[{"entry": i, "error": e} for i, e in result])
+        if status_code == "conflict":
+            raise HTTPException(status_code=409, detail=[{"entry": i, "error": e} for i, e in result])
+        if status_code == "error":
+            raise HTTPException(status_code=500, detail=f"Error en la transacción: {result}")
+        results = [("success", patient_id) for patient_id in result]
+    else:
+        results = await patient_crud.bulk_create_patients(payloads)
+
+    for position, outcome in zip(positions, results):
+        outcomes[position] = outcome
+    return {
+        "resourceType": "Bundle",
+        "type": f"{bundle_type}-response",
+        "entry": [bundles.response_entry(*outcome) for outcome in outcomes],
+    }
+
+@app.post("/api/patients/$import")
+async def import_patients_ndjson(request: Request):
+    """
+    Carga masiva de pacientes en NDJSON (un Patient por línea). El cuerpo se lee
+    en streaming y se escribe por bloques de BULK_CHUNK_SIZE.
+    """
+    summary = {"total": 0, "created": 0, "errors": []}
+    chunk, chunk_lines = [], []
+
+    async def flush():
+        results = await patient_crud.bulk_create_patients(chunk)
+        for line_number, (status_code, value) in zip(chunk_lines, results):
+            if status_code == "success":
+                summary["created"] += 1
+            else:
+                summary["errors"].append({"line": line_number, "status": status_code, "error": value})
+        chunk.clear()
+        chunk_lines.clear()
+
+    async def add_line(raw, line_number):
+        if not raw.strip():
+            return
+        summary["total"] += 1
+        # La línea se pasa sin decodificar: la decodifica y valida el pool de validación
+        chunk.append(raw)
+        chunk_lines.append(line_number)
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            await flush()
+
+    buffer, line_number = b"", 0
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for raw in lines:
+            line_number += 1
+            await add_line(raw, line_number)
+    if buffer:
+        await add_line(buffer, line_number + 1)
+    if chunk:
+        await flush()
+    return summary
 
 @app.get("/api/patients")
-async def get_all_patients_from_lis():
+async def get_all_patients_from_lis(
+    request: Request,
+    count: Optional[int] = Query(None, alias="_count", ge=1, le=bundles.MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: Optional[str] = Query(None, alias="_stream", pattern="^(ndjson|bundle)$"),
+    summary: Optional[str] = Query(None, alias="_summary"),
+    elements: Optional[str] = Query(None, alias="_elements"),
+):
+    """
+    Listado y búsqueda de pacientes. Admite los parámetros de búsqueda FHIR
+    name, family, given, birthdate, gender, telecom, address-city, identifier,
+    _id y _lastUpdated, además de _summary y _elements.
+    """
+    return await cached_list(request, patient_crud,
+                             lambda: patient_listing(request, count, after, stream, summary, elements))
+
+async def patient_listing(request: Request, count, after, stream, summary, elements):
+    params = list(request.query_params.multi_items())
     try:
-        return patient_crud.get_all_patients()
+        if not is_search(params) and summary is None and elements is None:
+            return await list_response(request, count, after, stream, patient_crud,
+                                       "get_patients_page", "iter_patients", "get_all_patients")
+
+        query = build_query(params)
+        if summary == "count":
+            return {"resourceType": "Bundle", "type": "searchset", "total": await patient_crud.count_patients(query)}
+        projection = build_projection(summary, elements)
+
+        if stream is not None:
+            resources = patient_crud.sync.iter_patients(bundles.STREAM_BATCH_SIZE, query, projection)
+            if stream == "ndjson":
+                return StreamingResponse(bundles.stream_ndjson(resources), media_type="application/fhir+ndjson")
+            return StreamingResponse(bundles.stream_bundle(resources), media_type="application/fhir+json")
+
+        patients, next_cursor = await patient_crud.search_patients(
+            query, count or bundles.DEFAULT_PAGE_SIZE, after, projection
+        )
+        next_url = str(request.url.include_query_params(after=next_cursor)) if next_cursor else None
+        return FHIRJSONResponse(bundles.searchset_bundle(patients, str(request.url), next_url))
+    except SearchParameterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Cursor 'after' inválido.")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
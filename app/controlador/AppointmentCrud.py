@@ -0,0 +1,259 @@
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from connection import get_collection
+from app.controlador.DashboardStats import appointment_stats
+from app.controlador.fechas import now_instant
+from app.controlador.SlotCalendar import SlotCalendar, slot_id, slot_minute, slot_start
+
+COLLECTION_NAME = "appointments"
+# Una franja por (servicio, fecha y hora) con el contador de citas reservadas
+SLOTS_COLLECTION_NAME = "appointment_slots"
+
+INDEXES = [
+    ([("fechaCita", ASCENDING), ("tipoServicio", ASCENDING), ("estadoCita", ASCENDING)],
+     {"name": "fecha_servicio_estado"}),
+    # Exportaciones incrementales ($export con _since)
+    ([("meta.lastUpdated", ASCENDING)], {"name": "last_updated"}),
+    # Citas de órdenes HL7 (ORM^O01): una por número de orden
+    ([("numeroOrden", ASCENDING)],
+     {"name": "numero_orden", "unique": True, "partialFilterExpression": {"numeroOrden": {"$exists": True}}}),
+]
+# Campos de una cita que cuentan en las estadísticas del panel (DashboardStats)
+_STATS_PROJECTION = {"_id": 0, "numeroOrden": 1, "tipoServicio": 1, "estadoCita": 1, "fechaCita": 1}
+SLOT_INDEXES = [
+    ([("tipoServicio", ASCENDING), ("fecha", ASCENDING)], {"name": "servicio_fecha"}),
+]
+
+class AppointmentCrud:
+    def __init__(self, collection=None, slots_collection=None):
+        self._collection = collection
+        self._slots = slots_collection
+        self.calendar = SlotCalendar(self._load_day)
+        self.stats = appointment_stats(source_collection=collection)
+
+    # Como en PatientCrud, las colecciones se resuelven con el cliente del proceso actual
+    @property
+    def collection(self):
+        return self._collection if self._collection is not None else get_collection(COLLECTION_NAME)
+
+    @property
+    def slots(self):
+        return self._slots if self._slots is not None else get_collection(SLOTS_COLLECTION_NAME)
+
+    def ensure_indexes(self):
+        for keys, options in INDEXES:
+            self.collection.create_index(keys, **options)
+        for keys, options in SLOT_INDEXES:
+            self.slots.create_index(keys, **options)
+        self.stats.ensure_indexes()
+
+    def create_appointment(self, appointment_data):
+        """
+        Reserva la franja de la cita y la guarda. Retorna ("success", id),
+        ("conflict", msg) si la franja está llena, ("invalid", msg) si la hora no
+        corresponde a una franja de la agenda, o ("error", msg).
+        """
+        status, result = self.reserve_appointment_slot(appointment_data)
+        if status != "success":
+            return status, result
+        return self.insert_appointments([appointment_data])[0]
+
+    def reserve_appointment_slot(self, appointment_data):
+        """Primera mitad de create_appointment: solo la reserva de la franja. Retorna ("success", None) o el error."""
+        service = appointment_data["tipoServicio"]
+        moment = appointment_data["fechaCita"]
+        minute = slot_minute(moment)
+        if minute is None:
+            return "invalid", "La hora de la cita no corresponde a una franja disponible de la agenda."
+        day = moment.date()
+
+        if self.calendar.is_full(service, day, minute):
+            return "conflict", "La franja solicitada ya no tiene cupos."
+        try:
+            occupied = self.reserve_slot(service, day, minute)
+        except PyMongoError as e:
+            print(f"Error reservando franja: {e}")
+            return "error", str(e)
+        if occupied is None:
+            self.calendar.record(service, day, minute, self.calendar.capacity)
+            return "conflict", "La franja solicitada ya no tiene cupos."
+        self.calendar.record(service, day, minute, occupied)
+        return "success", None
+
+    def insert_appointments(self, appointments):
+        """
+        Segunda mitad de create_appointment, para citas con la franja ya reservada:
+        las guarda con un único insert_many y libera la franja de las que fallen.
+        Retorna un resultado ("success", id) o ("error", msg) por cita, en orden.
+        """
+        # Se insertan copias para no mezclar el ObjectId en los datos de respuesta
+        now = now_instant()
+        docs = [dict(appointment_data, _id=ObjectId(), meta={"lastUpdated": now}) for appointment_data in appointments]
+        try:
+            self.collection.insert_many(docs, ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "Error de escritura") for err in e.details.get("writeErrors", [])}
+        except PyMongoError as e:
+            print(f"Error creando citas: {e}")
+            failed = {index: str(e) for index in range(len(docs))}
+
+        outcomes = []
+        for index, doc in enumerate(docs):
+            if index in failed:
+                self.release_appointment_slot(doc)
+                outcomes.append(("error", failed[index]))
+            else:
+                outcomes.append(("success", str(doc["_id"])))
+        self._record_stats([doc for index, doc in enumerate(docs) if index not in failed])
+        return outcomes
+
+    def upsert_orders(self, orders):
+        """
+        Crea o actualiza las citas de órdenes HL7 por numeroOrden, con un único
+        bulk_write no ordenado. No reservan franja: la fecha la decide el
+        sistema que envía la orden, no la agenda del portal.
+        Retorna un resultado ("success", numeroOrden) o ("error", msg) por orden, en orden.
+        """
+        now = now_instant()
+        operations = [
+            UpdateOne(
+                {"numeroOrden": order["numeroOrden"]},
+                {"$set": dict(order, meta={"lastUpdated": now}), "$setOnInsert": {"createdAt": datetime.utcnow()}},
+                upsert=True,
+            )
+            for order in orders
+        ]
+        existing = {}
+        try:
+            # Para los contadores del panel: las órdenes que ya existían se restan
+            for doc in self.collection.find({"numeroOrden": {"$in": [order["numeroOrden"] for order in orders]}},
+                                            _STATS_PROJECTION):
+                existing[doc["numeroOrden"]] = doc
+            self.collection.bulk_write(operations, ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "Error de escritura") for err in e.details.get("writeErrors", [])}
+        except PyMongoError as e:
+            print(f"Error guardando órdenes HL7: {e}")
+            failed = {index: str(e) for index in range(len(orders))}
+        added, removed = [], []
+        for index, order in enumerate(orders):
+            if index not in failed:
+                previous = existing.get(order["numeroOrden"])
+                if previous is not None:
+                    removed.append(previous)
+                # Una orden repetida en el lote actualiza la escrita antes
+                existing[order["numeroOrden"]] = dict(previous or {}, **order)
+                added.append(existing[order["numeroOrden"]])
+        self._record_stats(added, removed)
+        return [
+            ("error", failed[index]) if index in failed else ("success", order["numeroOrden"])
+            for index, order in enumerate(orders)
+        ]
+
+    def _record_stats(self, added, removed=()):
+        """Ajusta los contadores del panel. Si falla la cita sigue guardada: los corrige DashboardStats.rebuild."""
+        try:
+            self.stats.record(added, removed)
+        except Exception as e:
+            print(f"Error actualizando las estadísticas de citas: {e}")
+
+    def get_stats(self, start_day=None, end_day=None):
+        """Citas por tipoServicio, por estadoCita y por día (entre `start_day` y `end_day`), de los contadores."""
+        states = self.stats.counts("estadoCita")
+        return {
+            "total": sum(states.values()),
+            "tipoServicio": self.stats.counts("tipoServicio"),
+            "estadoCita": states,
+            "dias": self.stats.counts(
+                "dia", start_day and start_day.isoformat(), end_day and end_day.isoformat(),
+            ),
+        }
+
+    def reserve_slot(self, service, day, minute):
+        """
+        Ocupa un cupo de la franja con una única actualización condicional: solo
+        incrementa si quedan cupos. Si la franja está llena el filtro no coincide,
+        el upsert intenta crear un _id que ya existe y MongoDB lo rechaza, así que
+        dos reservas concurrentes nunca superan la capacidad.
+        Retorna los cupos ocupados tras la reserva, o None si no había cupo.
+        """
+        try:
+            slot = self.slots.find_one_and_update(
+                {"_id": slot_id(service, day, minute), "ocupados": {"$lt": self.calendar.capacity}},
+                {
+                    "$inc": {"ocupados": 1},
+                    "$setOnInsert": {
+                        "tipoServicio": service,
+                        "fecha": day.isoformat(),
+                        "minuto": minute,
+                        "inicio": slot_start(day, minute),
+                    },
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection={"ocupados": 1},
+            )
+        except DuplicateKeyError:
+            return None
+        return slot["ocupados"]
+
+    def release_appointment_slot(self, appointment_data):
+        moment = appointment_data["fechaCita"]
+        self.release_slot(appointment_data["tipoServicio"], moment.date(), slot_minute(moment))
+
+    def release_slot(self, service, day, minute):
+        try:
+            result = self.slots.update_one(
+                {"_id": slot_id(service, day, minute), "ocupados": {"$gt": 0}}, {"$inc": {"ocupados": -1}},
+            )
+        except PyMongoError as e:
+            print(f"Error liberando franja: {e}")
+            return
+        if result.modified_count:
+            self.calendar.release(service, day, minute)
+
+    def get_free_slots(self, service, start_day, end_day):
+        return self.calendar.free_slots(service, start_day, end_day)
+
+    def _load_day(self, service, day):
+        cursor = self.slots.find({"tipoServicio": service, "fecha": day.isoformat()}, {"minuto": 1, "ocupados": 1})
+        return [(doc["minuto"], doc["ocupados"]) for doc in cursor]
+
+    def get_all_appointments(self):
+        try:
+            # El ObjectId de _id lo convierte a texto el serializador (serializacion.py)
+            return list(self.collection.find())
+        except Exception as e:
+            print(f"Error obteniendo citas: {e}")
+            raise
+
+    def get_appointments_page(self, count, after=None):
+        query = {}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        try:
+            docs = list(self.collection.find(query).sort("_id", 1).limit(count + 1))
+        except Exception as e:
+            print(f"Error paginando citas: {e}")
+            raise
+        next_cursor = str(docs[count - 1]["_id"]) if len(docs) > count else None
+        return docs[:count], next_cursor
+
+    def last_modified(self):
+        """meta.lastUpdated más reciente de las citas (índice last_updated), o None."""
+        doc = self.collection.find_one({}, {"_id": 0, "meta.lastUpdated": 1}, sort=[("meta.lastUpdated", -1)])
+        return ((doc or {}).get("meta") or {}).get("lastUpdated")
+
+    def iter_appointments(self, batch_size, query=None, ordered=True):
+        cursor = self.collection.find(query or {}).batch_size(batch_size)
+        if ordered:
+            cursor = cursor.sort("_id", 1)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from connection import MAX_POOL_SIZE
+
+# Número máximo de llamadas a MongoDB en vuelo por worker. Por defecto igual al
+# tamaño del pool de conexiones del cliente para no encolar hilos de más.
+DB_THREADS = int(os.getenv("DB_THREADS", str(MAX_POOL_SIZE)))
+
+_executor = None
+
+
+def get_executor():
+    """
+    Devuelve el pool de hilos compartido para las operaciones de base de datos,
+    creándolo la primera vez que se usa (después del fork del worker).
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="mongo")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+class AsyncCrud:
+    """
+    Envuelve un CRUD síncrono (PatientCrud, AppointmentCrud) para que sus métodos
+    se puedan usar con `await` desde las rutas async sin bloquear el event loop.
+
+    Cada llamada se ejecuta en un pool de hilos acotado, copiando el contexto
+    (contextvars) de la petición que la origina.
+    """
+
+    def __init__(self, crud, executor=None):
+        self._crud = crud
+        self._executor = executor
+
+    @property
+    def sync(self):
+        return self._crud
+
+    def __getattr__(self, name):
+        attr = getattr(self._crud, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            ctx = contextvars.copy_context()
+            executor = self._executor or get_executor()
+            return await loop.run_in_executor(executor, functools.partial(ctx.run, attr, *args, **kwargs))
+
+        call.__name__ = name
+        return call
@@ -0,0 +1,246 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.controlador.bundles import STREAM_BATCH_SIZE, stream_ndjson
+from app.controlador.fechas import format_instant, now_instant
+from app.controlador.serializacion import dumps, loads
+
+# Directorio de los trabajos de exportación: uno por trabajo, con su estado
+# (status.json) y los ficheros NDJSON comprimidos. Es compartido por los workers
+# de gunicorn, así que cualquiera puede responder al sondeo de estado.
+EXPORT_DIR = os.getenv("EXPORT_DIR") or os.path.join(tempfile.gettempdir(), "lis-export")
+# Recursos por fichero: cada tipo se parte en ficheros de como mucho este tamaño
+EXPORT_PART_RESOURCES = int(os.getenv("EXPORT_PART_RESOURCES", "50000"))
+# Exportaciones simultáneas por worker
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_COMPRESSLEVEL = int(os.getenv("EXPORT_COMPRESSLEVEL", "6"))
+# Horas que se conservan los ficheros de una exportación terminada
+EXPORT_RETENTION_HOURS = float(os.getenv("EXPORT_RETENTION_HOURS", "24"))
+# Segundos entre actualizaciones del progreso en status.json
+EXPORT_PROGRESS_INTERVAL = 2.0
+
+STATUS_FILE = "status.json"
+CANCEL_FILE = "cancelado"
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_FILE_NAME_RE = re.compile(r"^[A-Za-z]+-\d+\.ndjson\.gz$")
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool de hilos de exportación de este proceso, creado en el primer uso (después del fork)."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            # Los trabajos aún en cola se descartan; status() los dará por fallidos
+            # cuando este proceso ya no exista.
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class BulkExporter:
+    """
+    Operación $export de FHIR Bulk Data: el kick-off crea el trabajo y lo deja
+    en el pool de exportación; el trabajo recorre cada colección por lotes y
+    escribe NDJSON comprimido en ficheros de EXPORT_PART_RESOURCES recursos.
+    El estado vive en disco para que cualquier worker pueda consultarlo.
+
+    `sources` asocia cada tipo de recurso a una función `(batch_size, query)`
+    que recorre sus documentos ya listos para exportar.
+    """
+
+    def __init__(self, sources, export_dir=EXPORT_DIR, part_resources=EXPORT_PART_RESOURCES):
+        self.sources = sources
+        self.export_dir = export_dir
+        self.part_resources = part_resources
+
+    # --- Estado en disco ---
+
+    def _job_dir(self, job_id):
+        if not _JOB_ID_RE.match(job_id):
+            return None
+        return os.path.join(self.export_dir, job_id)
+
+    def _write_status(self, job_id, status):
+        path = os.path.join(self._job_dir(job_id), STATUS_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(dumps(status))
+        os.replace(tmp_path, path)
+
+    def _read_status(self, job_id):
+        job_dir = self._job_dir(job_id)
+        if job_dir is None:
+            return None
+        try:
+            with open(os.path.join(job_dir, STATUS_FILE), "rb") as f:
+                return loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    # --- Operación ---
+
+    def kick_off(self, types, since=None, request_url=None):
+        """Crea el trabajo y lo encola. `since` es un datetime o None. Retorna el id del trabajo."""
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self._job_dir(job_id))
+        status = {
+            "id": job_id,
+            "status": "in-progress",
+            "pid": os.getpid(),
+            "request": request_url,
+            # Instante de corte: lo modificado después entra en la siguiente exportación con _since
+            "transactionTime": now_instant(),
+            "since": format_instant(since) if since is not None else None,
+            "types": list(types),
+            "progress": {resource_type: 0 for resource_type in types},
+            "output": [],
+            "error": None,
+            "createdAt": time.time(),
+        }
+        self._write_status(job_id, status)
+        get_executor().submit(self._run, job_id, status)
+        return job_id
+
+    def status(self, job_id):
+        """
+        Estado del trabajo, o None si no existe. Un trabajo "in-progress" cuyo
+        worker ya no existe se da por fallido.
+        """
+        status = self._read_status(job_id)
+        if status is not None and status["status"] == "in-progress" and not _pid_alive(status["pid"]):
+            status["status"] = "error"
+            status["error"] = "El worker que ejecutaba la exportación terminó antes de completarla."
+            self._write_status(job_id, status)
+        return status
+
+    def cancel(self, job_id):
+        """Cancela (si sigue en curso) y borra el trabajo. Retorna False si no existe."""
+        status = self._read_status(job_id)
+        if status is None:
+            return False
+        job_dir = self._job_dir(job_id)
+        if status["status"] == "in-progress" and _pid_alive(status["pid"]):
+            # El hilo que exporta (quizá en otro worker) lo ve entre lote y lote y borra el directorio
+            open(os.path.join(job_dir, CANCEL_FILE), "w").close()
+        else:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return True
+
+    def file_path(self, job_id, file_name):
+        """Ruta de un fichero de una exportación terminada, o None."""
+        status = self._read_status(job_id)
+        if status is None or status["status"] != "completed" or not _FILE_NAME_RE.match(file_name):
+            return None
+        if file_name not in {output["file"] for output in status["output"]}:
+            return None
+        return os.path.join(self._job_dir(job_id), file_name)
+
+    def purge_expired(self):
+        if not os.path.isdir(self.export_dir):
+            return
+        limit = time.time() - EXPORT_RETENTION_HOURS * 3600
+        for job_id in os.listdir(self.export_dir):
+            status = self._read_status(job_id)
+            if status is not None and status["status"] != "in-progress" and status["createdAt"] < limit:
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    # --- Ejecución (en el pool de exportación) ---
+
+    def _run(self, job_id, status):
+        job_dir = self._job_dir(job_id)
+        if status["since"]:
+            query = {"meta.lastUpdated": {"$gt": status["since"], "$lte": status["transactionTime"]}}
+        else:
+            # Exportación completa: incluye los documentos anteriores a meta.lastUpdated
+            query = {"$or": [
+                {"meta.lastUpdated": {"$lte": status["transactionTime"]}},
+                {"meta.lastUpdated": {"$exists": False}},
+            ]}
+        try:
+            for resource_type in status["types"]:
+                resources = self.sources[resource_type](STREAM_BATCH_SIZE, query)
+                for output in self._write_parts(job_id, resource_type, resources, status):
+                    status["output"].append(output)
+                    self._write_status(job_id, status)
+            status["status"] = "completed"
+            self._write_status(job_id, status)
+        except ExportCancelled:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        except Exception as e:
+            print(f"Error en la exportación {job_id}: {e}")
+            status["status"] = "error"
+            status["error"] = str(e)
+            self._write_status(job_id, status)
+
+    def _write_parts(self, job_id, resource_type, resources, status):
+        """Escribe los recursos en ficheros `<Tipo>-<n>.ndjson.gz`; genera una salida por fichero."""
+        job_dir = self._job_dir(job_id)
+        cancel_path = os.path.join(job_dir, CANCEL_FILE)
+        resources = iter(resources)
+        reported_at = time.monotonic()
+        part = 0
+        while True:
+            first = next(resources, None)
+            if first is None:
+                return
+            part += 1
+            file_name = f"{resource_type}-{part}.ndjson.gz"
+            path = os.path.join(job_dir, file_name)
+            count = 0
+
+            def part_resources():
+                nonlocal count
+                yield first
+                count = 1
+                for resource in resources:
+                    yield resource
+                    count += 1
+                    if count >= self.part_resources:
+                        return
+
+            with gzip.open(f"{path}.tmp", "wb", compresslevel=EXPORT_COMPRESSLEVEL) as f:
+                for chunk in stream_ndjson(part_resources()):
+                    if os.path.exists(cancel_path):
+                        raise ExportCancelled()
+                    f.write(chunk)
+                    status["progress"][resource_type] += chunk.count(b"\n")
+                    if time.monotonic() - reported_at >= EXPORT_PROGRESS_INTERVAL:
+                        self._write_status(job_id, status)
+                        reported_at = time.monotonic()
+            os.replace(f"{path}.tmp", path)
+            yield {"type": resource_type, "file": file_name, "count": count}
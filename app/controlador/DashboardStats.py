@@ -0,0 +1,192 @@
+import argparse
+import os
+import time
+from bisect import bisect_right
+from collections import Counter
+from datetime import date, timezone
+
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from connection import close_client, get_collection
+
+STATS_COLLECTION_NAME = "dashboard_stats"
+# Límite inferior (años) de cada banda de edad de GET /api/patients/$stats
+STATS_AGE_BANDS = [int(age) for age in os.getenv("STATS_AGE_BANDS", "0,18,30,45,60,75").split(",")]
+# Valor de los contadores de documentos sin el campo
+UNKNOWN = "desconocido"
+
+# Un contador por (recurso, dimensión, valor): los rangos de días se leen del índice
+STATS_INDEXES = [
+    ([("recurso", ASCENDING), ("dimension", ASCENDING), ("valor", ASCENDING)], {"name": "recurso_dimension_valor"}),
+]
+
+
+def _day(moment):
+    """Día (UTC, como $dateToString) de un datetime de MongoDB, o None."""
+    if moment is None:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%d")
+
+
+# Dimensión -> (su valor en un documento, la expresión equivalente para el $group
+# de la reconstrucción). Las dos deben dar lo mismo para cualquier documento.
+APPOINTMENT_DIMENSIONS = {
+    "tipoServicio": (lambda doc: doc.get("tipoServicio"), "$tipoServicio"),
+    "estadoCita": (lambda doc: doc.get("estadoCita"), "$estadoCita"),
+    "dia": (lambda doc: _day(doc.get("fechaCita")), {"$dateToString": {"format": "%Y-%m-%d", "date": "$fechaCita"}}),
+}
+PATIENT_DIMENSIONS = {
+    "genero": (lambda doc: doc.get("gender"), "$gender"),
+    # Año de nacimiento: las bandas de edad dependen del día de la consulta y se
+    # calculan al leer, sobre los ~120 años distintos. $substr es $substrBytes
+    # con el nombre que también entiende mongomock.
+    "nacimiento": (lambda doc: (doc.get("birthDate") or "")[:4],
+                   {"$substr": [{"$ifNull": ["$birthDate", ""]}, 0, 4]}),
+}
+
+
+def _value(value):
+    return None if value in (None, "") else value
+
+
+def age_bands(birth_years, bands=STATS_AGE_BANDS, today=None):
+    """
+    Pacientes por banda de edad a partir de los contadores por año de
+    nacimiento. La edad es la que se cumple en el año en curso: un paciente
+    puede quedar en la banda siguiente hasta unos meses antes de su cumpleaños.
+    """
+    today = today or date.today()
+    labels = [f"{low}-{high - 1}" for low, high in zip(bands, bands[1:])] + [f"{bands[-1]}+"]
+    result = dict.fromkeys(labels + [UNKNOWN], 0)
+    for year, total in birth_years.items():
+        age = today.year - int(year) if year.isdigit() else None
+        if age is None or age < bands[0]:
+            result[UNKNOWN] += total
+        else:
+            result[labels[bisect_right(bands, age) - 1]] += total
+    return result
+
+
+class DashboardStats:
+    """
+    Contadores de un recurso para el panel del LIS: un documento por valor de
+    cada dimensión (p. ej. citas por estadoCita) con el total de documentos.
+    Cada escritura los ajusta con un $inc por contador afectado, en una sola
+    bulk_write por lote, así que el panel lee O(contadores) en lugar de la
+    colección. `rebuild` los recalcula desde la colección con una agregación.
+    """
+
+    def __init__(self, resource, source_name, dimensions, collection=None, source_collection=None):
+        self.resource = resource
+        self.source_name = source_name
+        self.dimensions = dimensions
+        self._collection = collection
+        self._source_collection = source_collection
+
+    @property
+    def source(self):
+        if self._source_collection is not None:
+            return self._source_collection
+        return get_collection(self.source_name)
+
+    @property
+    def collection(self):
+        if self._collection is not None:
+            return self._collection
+        if self._source_collection is not None:
+            return self._source_collection.database[STATS_COLLECTION_NAME]
+        return get_collection(STATS_COLLECTION_NAME)
+
+    def ensure_indexes(self):
+        for keys, options in STATS_INDEXES:
+            self.collection.create_index(keys, **options)
+
+    def _bucket(self, dimension, value):
+        return {
+            "_id": f"{self.resource}|{dimension}|{'' if value is None else value}",
+            "recurso": self.resource,
+            "dimension": dimension,
+            "valor": value,
+        }
+
+    def record(self, added=(), removed=(), session=None):
+        """Suma los documentos `added` y resta los `removed` (la versión reemplazada de un documento)."""
+        deltas = Counter()
+        for docs, sign in ((added, 1), (removed, -1)):
+            for doc in docs:
+                for dimension, (value, _) in self.dimensions.items():
+                    deltas[dimension, _value(value(doc))] += sign
+        operations = []
+        for (dimension, value), delta in deltas.items():
+            if delta:
+                bucket = self._bucket(dimension, value)
+                operations.append(UpdateOne(
+                    {"_id": bucket.pop("_id")}, {"$inc": {"total": delta}, "$setOnInsert": bucket}, upsert=True,
+                ))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False, session=session)
+
+    def counts(self, dimension, start=None, end=None):
+        """{valor: total} de una dimensión, en orden de valor; `start`/`end` acotan el valor (p. ej. días)."""
+        query = {"recurso": self.resource, "dimension": dimension}
+        if start is not None or end is not None:
+            query["valor"] = {key: bound for key, bound in (("$gte", start), ("$lte", end)) if bound is not None}
+        cursor = self.collection.find(query, {"_id": 0, "valor": 1, "total": 1}).sort("valor", ASCENDING)
+        return {UNKNOWN if doc["valor"] is None else doc["valor"]: doc["total"] for doc in cursor if doc["total"] > 0}
+
+    def rebuild(self):
+        """
+        Recalcula los contadores desde la colección: un $group por dimensión
+        (en el servidor, con disco si hace falta) y un reemplazo por contador.
+        Los $inc de escrituras concurrentes con la agregación pueden perderse o
+        contarse dos veces: conviene ejecutarlo con poca carga. Retorna
+        {dimensión: contadores}.
+        """
+        summary = {}
+        for dimension, (_, expression) in self.dimensions.items():
+            totals = Counter()
+            pipeline = [{"$group": {"_id": expression, "total": {"$sum": 1}}}]
+            for row in self.source.aggregate(pipeline, allowDiskUse=True):
+                totals[_value(row["_id"])] += row["total"]
+            buckets = [dict(self._bucket(dimension, value), total=total) for value, total in totals.items()]
+            if buckets:
+                self.collection.bulk_write(
+                    [ReplaceOne({"_id": bucket["_id"]}, bucket, upsert=True) for bucket in buckets], ordered=False,
+                )
+            # Los valores que ya no tiene ningún documento
+            self.collection.delete_many({
+                "recurso": self.resource, "dimension": dimension, "_id": {"$nin": [bucket["_id"] for bucket in buckets]},
+            })
+            summary[dimension] = len(buckets)
+        return summary
+
+
+def appointment_stats(source_collection=None):
+    return DashboardStats("citas", "appointments", APPOINTMENT_DIMENSIONS, source_collection=source_collection)
+
+
+def patient_stats(source_collection=None):
+    return DashboardStats("pacientes", "patients", PATIENT_DIMENSIONS, source_collection=source_collection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye las estadísticas del panel desde las colecciones.")
+    parser.add_argument("--resource", choices=["citas", "pacientes"], action="append",
+                        help="recurso a reconstruir (por defecto todos)")
+    args = parser.parse_args()
+    try:
+        for stats in (appointment_stats(), patient_stats()):
+            if args.resource and stats.resource not in args.resource:
+                continue
+            start = time.perf_counter()
+            stats.ensure_indexes()
+            summary = stats.rebuild()
+            print(f"{stats.resource}: {summary} contadores en {time.perf_counter() - start:.2f}s")
+    finally:
+        close_client()
+
+
+if __name__ == "__main__":
+    main()
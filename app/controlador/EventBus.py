@@ -0,0 +1,277 @@
+import asyncio
+import collections
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.controlador import bundles
+from app.controlador.fechas import format_instant, now_instant
+from app.controlador.serializacion import dumps
+
+# Origen de los cambios: "changestream" (réplica o Atlas), "polling" (consulta
+# periódica por meta.lastUpdated, p. ej. un mongod suelto o mongomock) o "auto":
+# change streams si el servidor los admite y si no, consulta periódica.
+EVENT_SOURCE = os.getenv("EVENT_SOURCE", "auto")
+# Eventos recientes que cada worker conserva para reanudar una suscripción
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+# Eventos pendientes por cliente; un cliente que se queda atrás recibe "resync"
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+EVENT_MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", "500"))
+# Segundos sin eventos tras los que se envía un latido al cliente
+EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT", "15"))
+# Consulta periódica: intervalo (s), documentos por consulta y retraso (ms) con el
+# que se leen los cambios, para no saltarse escrituras con un meta.lastUpdated
+# asignado antes que el de otra ya confirmada
+EVENT_POLL_INTERVAL = float(os.getenv("EVENT_POLL_INTERVAL", "1"))
+EVENT_POLL_BATCH = int(os.getenv("EVENT_POLL_BATCH", "500"))
+EVENT_POLL_LAG_MS = float(os.getenv("EVENT_POLL_LAG_MS", "1000"))
+
+_METHODS = {"insert": "POST", "replace": "PUT", "update": "PUT", "delete": "DELETE"}
+# Marca que se entrega a un cliente que perdió eventos
+RESYNC = object()
+
+
+class EventBusFull(Exception):
+    pass
+
+
+class Event:
+    """Un cambio ya serializado una sola vez para todos los clientes (SSE y WebSocket)."""
+
+    __slots__ = ("token", "topic", "text", "sse")
+
+    def __init__(self, token, topic, notification):
+        self.token = token
+        self.topic = topic
+        payload = dumps({"type": "notification", "id": token, "topic": topic, "notification": notification})
+        self.text = payload.decode()
+        self.sse = b"id: " + token.encode() + b"\nevent: notification\ndata: " + payload + b"\n\n"
+
+
+class Subscription:
+    """Cola de eventos de un cliente conectado (SSE o WebSocket)."""
+
+    def __init__(self, topics, maxsize=EVENT_QUEUE_SIZE):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        if self.overflowed or event.topic not in self.topics:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # No se bloquea al resto de clientes: este tendrá que volver a leer el listado
+            self.overflowed = True
+
+    async def events(self, heartbeat=EVENT_HEARTBEAT):
+        """Genera Event, None (latido) o RESYNC, tras el que la suscripción termina."""
+        while True:
+            if self.overflowed and self.queue.empty():
+                yield RESYNC
+                return
+            if self.queue.empty():
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+            else:
+                # Sin esperar: wait_for crea una tarea por llamada
+                event = self.queue.get_nowait()
+            if event is RESYNC:
+                yield RESYNC
+                return
+            yield event
+
+
+class EventBus:
+    """
+    Notificaciones de altas y cambios de pacientes y citas. Un solo hilo por
+    proceso vigila la base de datos (un change stream sobre las colecciones de
+    `topics`, o la consulta periódica) y cada cambio se serializa una vez y se
+    reparte a todos los clientes conectados al worker, sin consultas por cliente.
+
+    `topics` asocia cada tema (tipo de recurso) a (función que retorna su
+    colección, función que convierte el documento en el recurso público).
+
+    Cada evento lleva un token de reanudación (el resume token del change
+    stream, o la posición de la consulta periódica). Un cliente que se reconecta
+    con él (Last-Event-ID) recibe los eventos posteriores que el worker aún
+    conserva; si ya no están, recibe "resync" y debe volver a leer el listado.
+    """
+
+    def __init__(self, topics, source=EVENT_SOURCE, buffer_size=EVENT_BUFFER_SIZE,
+                 max_subscribers=EVENT_MAX_SUBSCRIBERS):
+        self.topics = topics
+        self.source = source
+        self.max_subscribers = max_subscribers
+        self.mode = None
+        self._subscribers = set()
+        self._recent = collections.deque(maxlen=buffer_size)
+        self._positions = {}
+        self._first = 0
+        self._number = 0
+        self._loop = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.published = 0
+
+    # --- En el event loop ---
+
+    def subscribe(self, topics, resume=None):
+        """Suscripción a `topics` desde el token `resume` (o desde ahora)."""
+        if len(self._subscribers) >= self.max_subscribers:
+            raise EventBusFull("Demasiados clientes suscritos a eventos; reintente en unos segundos.")
+        self._ensure_started()
+        subscription = Subscription(set(topics))
+        if resume:
+            position = self._positions.get(resume)
+            if position is None:
+                subscription.overflowed = True
+            else:
+                for event in list(self._recent)[position - self._first + 1:]:
+                    subscription.offer(event)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+    def _dispatch(self, event):
+        if len(self._recent) == self._recent.maxlen:
+            del self._positions[self._recent[0].token]
+            self._first += 1
+        self._positions[event.token] = self._first + len(self._recent)
+        self._recent.append(event)
+        self.published += 1
+        for subscription in list(self._subscribers):
+            subscription.offer(event)
+
+    def _resync_all(self):
+        """El origen perdió su posición: nadie puede reanudar con los tokens anteriores."""
+        self._recent.clear()
+        self._positions.clear()
+        for subscription in list(self._subscribers):
+            subscription.overflowed = True
+            try:
+                subscription.queue.put_nowait(RESYNC)
+            except asyncio.QueueFull:
+                pass
+
+    def _ensure_started(self):
+        if self._thread is None:
+            # Después del fork, en el worker: el hilo no sobreviviría a un fork
+            self._loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self._run, name="event-watcher", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "buffered": len(self._recent),
+        }
+
+    # --- En el hilo vigilante ---
+
+    def _publish(self, topic, method, doc, token):
+        _, to_resource = self.topics[topic]
+        self._number += 1
+        resource_id = str(doc["_id"])
+        # En un borrado el change stream solo trae la clave del documento
+        resource = to_resource(doc) if len(doc) > 1 else None
+        notification = bundles.notification_bundle(
+            self._number, topic, method, topic, resource_id, resource, now_instant()
+        )
+        self._loop.call_soon_threadsafe(self._dispatch, Event(token, topic, notification))
+
+    def _run(self):
+        if self.source != "polling":
+            try:
+                self._watch()
+                return
+            except Exception as e:
+                # Un mongod sin replica set (OperationFailure 40573) o un sustituto
+                # local como mongomock (sin watch en la base de datos)
+                if self.source == "changestream":
+                    print(f"Eventos: no se pudo abrir el change stream: {e}")
+                    raise
+                print(f"Eventos: sin change streams ({e!r}); consulta periódica por meta.lastUpdated")
+        self._poll()
+
+    def _watch(self):
+        collections_by_name = {getter().name: topic for topic, (getter, _) in self.topics.items()}
+        database = next(iter(self.topics.values()))[0]().database
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(collections_by_name)},
+            "operationType": {"$in": list(_METHODS)},
+        }}]
+        resume = None
+        opened = False
+        while not self._stop.is_set():
+            try:
+                with database.watch(pipeline, full_document="updateLookup", resume_after=resume,
+                                    max_await_time_ms=1000) as stream:
+                    self.mode = "changestream"
+                    opened = True
+                    while not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        resume = change["_id"]
+                        doc = change.get("fullDocument") or change["documentKey"]
+                        self._publish(collections_by_name[change["ns"]["coll"]], _METHODS[change["operationType"]],
+                                      doc, "c" + resume["_data"])
+            except OperationFailure as e:
+                if not opened:
+                    raise
+                # ChangeStreamHistoryLost y similares: se sigue desde ahora
+                print(f"Eventos: no se pudo reanudar el change stream ({e}); se continúa desde ahora")
+                resume = None
+                self._loop.call_soon_threadsafe(self._resync_all)
+            except PyMongoError as e:
+                if not opened:
+                    raise
+                print(f"Eventos: change stream interrumpido ({e}); reintentando")
+                self._stop.wait(1)
+
+    def _poll(self):
+        self.mode = "polling"
+        positions = {}
+        for topic, (getter, _) in self.topics.items():
+            # Desde el cambio más reciente: solo se notifican los posteriores
+            newest = getter().find_one({}, {"meta.lastUpdated": 1}, sort=[("meta.lastUpdated", -1), ("_id", -1)])
+            positions[topic] = (((newest or {}).get("meta") or {}).get("lastUpdated") or "", newest and newest["_id"])
+        while not self._stop.wait(EVENT_POLL_INTERVAL):
+            until = format_instant(datetime.now(timezone.utc) - timedelta(milliseconds=EVENT_POLL_LAG_MS))
+            for topic, (getter, _) in self.topics.items():
+                try:
+                    while self._poll_topic(topic, getter(), positions, until) == EVENT_POLL_BATCH:
+                        pass
+                except PyMongoError as e:
+                    print(f"Eventos: error consultando cambios de {topic}: {e}")
+
+    def _poll_topic(self, topic, collection, positions, until):
+        instant, last_id = positions[topic]
+        query = {"meta.lastUpdated": {"$gt": instant, "$lte": until}}
+        if last_id is not None:
+            query = {"$or": [query, {"meta.lastUpdated": instant, "_id": {"$gt": last_id}}]}
+        docs = list(collection.find(query).sort([("meta.lastUpdated", 1), ("_id", 1)]).limit(EVENT_POLL_BATCH))
+        for doc in docs:
+            instant, last_id = doc["meta"]["lastUpdated"], doc["_id"]
+            positions[topic] = (instant, last_id)
+            # Sin historial de operaciones: las citas (sin versionId) se notifican como PUT
+            method = "POST" if doc["meta"].get("versionId") == "1" else "PUT"
+            self._publish(topic, method, doc, f"p{topic}.{instant}.{last_id}")
+        return len(docs)
@@ -0,0 +1,266 @@
+import os
+from datetime import datetime
+
+from app.controlador.hl7v2 import HL7ParseError, component, fhir_date, parse_timestamp
+
+# Sistema de los identificadores de PID-3 sin autoridad asignadora con OID;
+# si traen el espacio de nombres (PID-3.4.1) se añade al final.
+HL7_IDENTIFIER_SYSTEM = os.getenv("HL7_IDENTIFIER_SYSTEM", "urn:lis:hl7:pid")
+# tipoServicio de las citas creadas a partir de órdenes ORM^O01
+HL7_SERVICE_TYPE = os.getenv("HL7_SERVICE_TYPE", "laboratorio")
+
+SUPPORTED_MESSAGES = {("ADT", "A04"), ("ADT", "A08"), ("ORM", "O01")}
+
+V2_0203 = "http://terminology.hl7.org/CodeSystem/v2-0203"
+_GENDERS = {"M": "male", "F": "female", "O": "other", "A": "other", "U": "unknown", "N": "unknown"}
+_NAME_USES = {"L": "official", "D": "usual", "M": "maiden", "N": "nickname", "A": "anonymous"}
+_ADDRESS_USES = {"H": "home", "B": "work", "C": "temp", "O": "work"}
+_TELECOM_USES = {"PRN": "home", "ORN": "home", "WPN": "work", "VHN": "home", "EMR": "home", "NET": "home"}
+# ORC-1 (control de la orden) y ORC-5 (estado) a estadoCita
+_ORDER_CONTROL_STATES = {"CA": "Cancelada", "OC": "Cancelada", "DC": "Cancelada", "CR": "Cancelada"}
+_ORDER_STATUS_STATES = {"CM": "Completada", "IP": "En proceso", "CA": "Cancelada", "DC": "Cancelada"}
+
+
+class HL7MappingError(ValueError):
+    pass
+
+
+def _identifier(cx, subcomponent):
+    value = component(cx, 1)
+    if not value:
+        return None
+    # CX.4 (autoridad asignadora, HD): espacio de nombres & identificador universal & tipo
+    authority = component(cx, 4).split(subcomponent)
+    namespace = authority[0]
+    if len(authority) >= 3 and authority[1] and authority[2] == "ISO":
+        system = f"urn:oid:{authority[1]}"
+    else:
+        system = f"{HL7_IDENTIFIER_SYSTEM}:{namespace}" if namespace else HL7_IDENTIFIER_SYSTEM
+    identifier = {"system": system, "value": value}
+    type_code = component(cx, 5)
+    if type_code:
+        identifier["type"] = {"coding": [{"system": V2_0203, "code": type_code}]}
+    return identifier
+
+
+def _name(xpn):
+    family = component(xpn, 1)
+    given = [part for part in (component(xpn, 2), component(xpn, 3)) if part]
+    if not family and not given:
+        return None
+    name = {"text": " ".join(given + [family]).strip()}
+    if family:
+        name["family"] = family
+    if given:
+        name["given"] = given
+    suffix, prefix = component(xpn, 4), component(xpn, 5)
+    if suffix:
+        name["suffix"] = [suffix]
+    if prefix:
+        name["prefix"] = [prefix]
+    use = _NAME_USES.get(component(xpn, 7))
+    if use:
+        name["use"] = use
+    return name
+
+
+def _address(xad):
+    lines = [line for line in (component(xad, 1), component(xad, 2)) if line]
+    address = {"line": lines} if lines else {}
+    for n, key in ((3, "city"), (4, "state"), (5, "postalCode"), (6, "country")):
+        value = component(xad, n)
+        if value:
+            address[key] = value
+    if not address:
+        return None
+    use = _ADDRESS_USES.get(component(xad, 7))
+    if use:
+        address["use"] = use
+    return address
+
+
+def _telecom(xtn, work):
+    equipment = component(xtn, 3)
+    email = component(xtn, 4)
+    if email or equipment in ("Internet", "X.400"):
+        value, system = email or component(xtn, 1), "email"
+    else:
+        local = component(xtn, 7)
+        value = component(xtn, 6) + local if local else component(xtn, 1)
+        system = "fax" if equipment == "FX" else "phone"
+    if not value:
+        return None
+    telecom = {"system": system, "value": value}
+    use = "mobile" if equipment == "CP" else ("work" if work else _TELECOM_USES.get(component(xtn, 2)))
+    if use:
+        telecom["use"] = use
+    return telecom
+
+
+def patient_from_pid(pid):
+    """
+    Patient FHIR a partir del segmento PID. El primer identificador es el de
+    tipo MR (historia clínica) si lo hay: es la clave con la que
+    PatientCrud.bulk_create_patients decide si crea o actualiza.
+    """
+    subcomponent = pid.delimiters.subcomponent
+    identifiers = [identifier for identifier in (_identifier(cx, subcomponent) for cx in pid.repetitions(3)) if identifier]
+    if not identifiers:
+        raise HL7MappingError("PID-3 sin identificador del paciente")
+    identifiers.sort(key=lambda identifier: identifier.get("type", {}).get("coding", [{}])[0].get("code") != "MR")
+
+    patient = {"resourceType": "Patient", "identifier": identifiers}
+    names = [name for name in map(_name, pid.repetitions(5)) if name]
+    if names:
+        patient["name"] = names
+    telecom = [
+        telecom
+        for field in (13, 14)
+        for telecom in (_telecom(xtn, field == 14) for xtn in pid.repetitions(field))
+        if telecom
+    ]
+    if telecom:
+        patient["telecom"] = telecom
+    gender = _GENDERS.get(pid.get(8))
+    if gender:
+        patient["gender"] = gender
+    birth_date = fhir_date(pid.get(7))
+    if birth_date:
+        patient["birthDate"] = birth_date
+    addresses = [address for address in map(_address, pid.repetitions(11)) if address]
+    if addresses:
+        patient["address"] = addresses
+    deceased = pid.get(30)
+    if deceased in ("Y", "N"):
+        patient["deceasedBoolean"] = deceased == "Y"
+    return patient
+
+
+def _order_number(segment, field):
+    number = segment.get(field, 1)
+    if not number:
+        return ""
+    namespace = segment.get(field, 2)
+    return f"{number}^{namespace}" if namespace else number
+
+
+def _exam(obr):
+    """Texto del examen de OBR-4 (o su código si no trae texto)."""
+    return obr.get(4, 2) or obr.get(4, 1)
+
+
+def orders_from_message(message):
+    """
+    Citas (documentos de la colección appointments) de las órdenes de un
+    ORM^O01: una por ORC, con los exámenes de sus OBR en examenesSolicitados.
+    Se identifican por numeroOrden (número de orden del solicitante, ORC-2 u
+    OBR-2, o del laboratorio si no viene).
+    """
+    header = message.header
+    sent = parse_timestamp(header.get(7)) or datetime.now()
+    orders, current = [], None
+    for segment in message.segments:
+        if segment.name == "ORC":
+            current = {"orc": segment, "obr": []}
+            orders.append(current)
+        elif segment.name == "OBR":
+            if current is None:
+                current = {"orc": None, "obr": []}
+                orders.append(current)
+            current["obr"].append(segment)
+        elif segment.name == "TQ1" and current is not None:
+            current["tq1"] = segment
+
+    appointments = []
+    for order in orders:
+        orc, obrs, tq1 = order["orc"], order["obr"], order.get("tq1")
+        number = (orc and (_order_number(orc, 2) or _order_number(orc, 3))) or next(
+            (_order_number(obr, 2) or _order_number(obr, 3) for obr in obrs if obr.raw(2) or obr.raw(3)), ""
+        )
+        if not number:
+            raise HL7MappingError("Orden sin número de orden (ORC-2/ORC-3 u OBR-2/OBR-3)")
+        # Inicio solicitado (TQ1-7, ORC-7.4, OBR-27.4) o, si no, fecha de la observación o de la orden
+        candidates = [tq1.get(7) if tq1 else "", orc.get(7, 4) if orc else ""]
+        candidates += [obr.get(27, 4) for obr in obrs] + [obr.get(7) for obr in obrs]
+        candidates.append(orc.get(9) if orc else "")
+        moment = next((m for m in map(parse_timestamp, candidates) if m), sent)
+
+        state = "Pendiente"
+        if orc is not None:
+            state = _ORDER_CONTROL_STATES.get(orc.get(1)) or _ORDER_STATUS_STATES.get(orc.get(5), state)
+        notes = "; ".join(obr.get(13) for obr in obrs if obr.get(13))
+        appointments.append({
+            "numeroOrden": number,
+            "tipoServicio": HL7_SERVICE_TYPE,
+            "fechaCita": moment,
+            "horaCita": moment.time().isoformat(),
+            "examenesSolicitados": [exam for exam in map(_exam, obrs) if exam],
+            "notasPaciente": notes or None,
+            "estadoCita": state,
+            "origen": {"aplicacion": header.get(3), "mensaje": message.control_id},
+        })
+    return appointments
+
+
+def map_message(message):
+    """(Patient, [citas]) de un mensaje ADT^A04/A08 u ORM^O01, o HL7MappingError."""
+    if isinstance(message, HL7ParseError):
+        raise HL7MappingError(str(message))
+    kind = message.message_type
+    if kind not in SUPPORTED_MESSAGES:
+        raise HL7MappingError(f"Tipo de mensaje no soportado: {'^'.join(kind)}")
+    pid = message.segment("PID")
+    if pid is None:
+        raise HL7MappingError("El mensaje no trae segmento PID")
+    patient = patient_from_pid(pid)
+    orders = orders_from_message(message) if kind[0] == "ORM" else []
+    if kind[0] == "ORM" and not orders:
+        raise HL7MappingError("ORM^O01 sin segmentos ORC/OBR")
+    return patient, orders
+
+
+class HL7Ingest:
+    """
+    Escribe lotes de mensajes HL7 v2 ya interpretados: todos los pacientes del
+    lote en un único bulk_create_patients (crea o actualiza por identificador)
+    y todas las órdenes en un único upsert por numeroOrden.
+    """
+
+    def __init__(self, patient_crud, appointment_crud):
+        self.patients = patient_crud
+        self.appointments = appointment_crud
+
+    def ingest_messages(self, messages):
+        """
+        Retorna un resultado por mensaje, en orden: ("success", id del paciente),
+        ("invalid", msg) si no se puede mapear o no valida, los ("duplicate"|"conflict", msg)
+        de PatientCrud.bulk_create_patients, o ("error", msg).
+        """
+        outcomes = [None] * len(messages)
+        payloads, owners, orders = [], [], []
+        for index, message in enumerate(messages):
+            try:
+                patient, message_orders = map_message(message)
+            except HL7MappingError as e:
+                outcomes[index] = ("invalid", str(e))
+                continue
+            payloads.append(patient)
+            owners.append(index)
+            orders.append(message_orders)
+
+        pending, pending_owners = [], []
+        results = self.patients.bulk_create_patients(payloads) if payloads else []
+        for index, message_orders, (status, result) in zip(owners, orders, results):
+            outcomes[index] = (status, result)
+            if status != "success":
+                continue
+            for order in message_orders:
+                order["idPacienteFHIR"] = result
+                pending.append(order)
+                pending_owners.append(index)
+
+        if pending:
+            for index, (status, result) in zip(pending_owners, self.appointments.upsert_orders(pending)):
+                if status != "success" and outcomes[index][0] == "success":
+                    outcomes[index] = (status, result)
+        return outcomes
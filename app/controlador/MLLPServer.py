@@ -0,0 +1,149 @@
+import asyncio
+import os
+
+from app.controlador.hl7v2 import HL7_ENCODING, HL7ParseError, acknowledgement, batch, iter_messages
+from app.controlador.WriteQueue import WriteQueueFull
+
+# Puerto del listener MLLP de mensajes HL7 v2 (0: desactivado). Todos los
+# workers escuchan en el mismo puerto (SO_REUSEPORT) y el kernel reparte las
+# conexiones entre ellos.
+MLLP_PORT = int(os.getenv("MLLP_PORT", "0"))
+# Solo interfaces locales por defecto: MLLP no cifra ni autentica
+MLLP_HOST = os.getenv("MLLP_HOST", "127.0.0.1")
+# Tamaño máximo de una trama; una mayor cierra la conexión
+MLLP_MAX_FRAME_BYTES = int(os.getenv("MLLP_MAX_FRAME_BYTES", str(16 * 1024 * 1024)))
+# Mensajes por escritura y espera máxima (ms) para reunirlos, entre todas las conexiones
+HL7_BATCH_SIZE = int(os.getenv("HL7_BATCH_SIZE", "200"))
+HL7_BATCH_DELAY_MS = float(os.getenv("HL7_BATCH_DELAY_MS", "20"))
+
+START_BLOCK = b"\x0b"
+END_BLOCK = b"\x1c\r"
+
+# Resultado de HL7Ingest -> código de MSA-1. El emisor reenvía los AE: solo
+# los errores al guardar; un mensaje que no valida, un duplicado rechazado
+# (MPI_ON_WRITE=reject) o un identificador de varios pacientes fallaría igual.
+_ACK_CODES = {"success": "AA", "invalid": "AR", "duplicate": "AR", "conflict": "AR", "error": "AE"}
+
+
+class MLLPFrameError(Exception):
+    pass
+
+
+def frame(payload):
+    return START_BLOCK + payload + END_BLOCK
+
+
+class MLLPDecoder:
+    """Separa las tramas <VT> carga <FS><CR> de un flujo de bytes que llega por trozos."""
+
+    def __init__(self, max_frame_bytes=MLLP_MAX_FRAME_BYTES):
+        self.max_frame_bytes = max_frame_bytes
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Añade bytes recibidos; retorna la carga de las tramas completas."""
+        self._buffer += data
+        frames = []
+        position = 0
+        while True:
+            start = self._buffer.find(START_BLOCK, position)
+            if start == -1:
+                # Bytes fuera de una trama: se descartan
+                self._buffer.clear()
+                return frames
+            end = self._buffer.find(END_BLOCK, start + 1)
+            if end == -1:
+                # Se recorta una sola vez por llamada, no tras cada trama
+                del self._buffer[:start]
+                if len(self._buffer) > self.max_frame_bytes:
+                    raise MLLPFrameError(f"Trama MLLP de más de {self.max_frame_bytes} bytes")
+                return frames
+            frames.append(bytes(self._buffer[start + 1:end]))
+            position = end + len(END_BLOCK)
+
+
+class MLLPServer:
+    """
+    Listener MLLP (TCP) de mensajes HL7 v2. Cada trama trae un mensaje o un
+    lote (BHS ... BTS); cada mensaje se pasa a `submit` (p. ej. WriteQueue.submit
+    sobre HL7Ingest.ingest_messages, que agrupa los de todas las conexiones) y
+    se responde con una trama con su ACK, o con un lote de ACKs si la trama
+    traía varios mensajes. AA: guardado; AR: rechazado (no se puede
+    interpretar, no valida o es un duplicado rechazado: no tiene sentido
+    reenviarlo); AE: error al guardarlo, el emisor debe reintentar.
+    """
+
+    def __init__(self, submit, host=MLLP_HOST, port=MLLP_PORT):
+        self.submit = submit
+        self.host = host
+        self.port = port
+        self._server = None
+        # Conexión abierta -> su writer, para cerrarlas al parar el worker
+        self._handlers = {}
+        self.connections = 0
+        self.frames = 0
+        self.acks = {"AA": 0, "AE": 0, "AR": 0}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, reuse_port=True)
+        print(f"Listener MLLP en {self.host}:{self.port}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # Las conexiones abiertas terminan tras responder la trama en curso
+            for writer in self._handlers.values():
+                writer.close()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._handlers[asyncio.current_task()] = writer
+        decoder = MLLPDecoder()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for payload in decoder.feed(data):
+                    writer.write(frame(await self.acknowledge(payload)))
+                    await writer.drain()
+        except (ConnectionError, MLLPFrameError) as e:
+            print(f"Conexión MLLP cerrada: {e}")
+        finally:
+            self.connections -= 1
+            self._handlers.pop(asyncio.current_task(), None)
+            writer.close()
+
+    async def _process(self, message):
+        if isinstance(message, HL7ParseError):
+            return acknowledgement(None, "AR", str(message)), "AR"
+        try:
+            status, result = await self.submit(message)
+        except WriteQueueFull as e:
+            status, result = "error", str(e)
+        code = _ACK_CODES.get(status, "AR")
+        return acknowledgement(message, code, "" if code == "AA" else result), code
+
+    async def acknowledge(self, payload):
+        """Respuesta (bytes) a la carga de una trama."""
+        self.frames += 1
+        messages = list(iter_messages([payload]))
+        if not messages:
+            messages = [HL7ParseError("Trama sin mensajes HL7")]
+        results = await asyncio.gather(*(self._process(message) for message in messages))
+        for _, code in results:
+            self.acks[code] += 1
+        acks = [ack for ack, _ in results]
+        return (acks[0] if len(acks) == 1 else batch(acks)).encode(HL7_ENCODING)
+
+    def stats(self):
+        return {
+            "listening": self._server is not None,
+            "port": self.port,
+            "connections": self.connections,
+            "frames": self.frames,
+            "acks": dict(self.acks),
+        }
@@ -0,0 +1,163 @@
+import importlib
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from app.controlador.metricas import timer
+from app.controlador.serializacion import dumps
+
+PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", "2048"))
+PATIENT_CACHE_TTL = float(os.getenv("PATIENT_CACHE_TTL", "30"))
+# Backend compartido opcional, como "paquete.modulo:Clase". Debe implementar
+# get(key), set(key, value, ttl) y delete(key), como LocalCacheBackend.
+PATIENT_CACHE_BACKEND = os.getenv("PATIENT_CACHE_BACKEND", "")
+
+
+class CacheEntry:
+    __slots__ = ("version", "etag", "body")
+
+    def __init__(self, version, etag, body):
+        self.version = version
+        self.etag = etag
+        self.body = body
+
+
+class LocalCacheBackend:
+    """LRU con caducidad (TTL) en memoria del proceso."""
+
+    def __init__(self, max_entries=PATIENT_CACHE_SIZE):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "evictions": self.evictions, "expirations": self.expirations}
+
+
+def load_backend(spec):
+    if not spec:
+        return LocalCacheBackend()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def weak_etag(version):
+    return f'W/"{version}"'
+
+
+def etag_version(etag):
+    """Versión de un ETag `W/"3"` o `"3"` (cabecera If-Match), o None si no tiene esa forma."""
+    if not etag:
+        return None
+    tag = etag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    if len(tag) < 3 or not (tag[0] == tag[-1] == '"') or not tag[1:-1].isdigit():
+        return None
+    return tag[1:-1]
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(",")}
+    # If-None-Match usa comparación débil: W/"1" y "1" son equivalentes
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+
+class PatientCache:
+    """
+    Caché de lectura de pacientes ya serializados a JSON, con su versión
+    (`meta.versionId`) y ETag débil.
+
+    Las escrituras llaman a `invalidate(id, version)`; además de borrar la
+    entrada, se recuerda la versión mínima aceptable para que una lectura que
+    empezó antes de la escritura no vuelva a guardar la versión vieja.
+    """
+
+    def __init__(self, backend=None, ttl=PATIENT_CACHE_TTL):
+        self.backend = backend if backend is not None else load_backend(PATIENT_CACHE_BACKEND)
+        self.ttl = ttl
+        self._min_versions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, patient_id):
+        entry = self.backend.get(patient_id)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, patient_id, resource):
+        version = int((resource.get("meta") or {}).get("versionId") or 0)
+        with self._lock:
+            if version < self._min_versions.get(patient_id, 0):
+                return self._entry(version, resource)
+        entry = self._entry(version, resource)
+        self.backend.set(patient_id, entry, self.ttl)
+        return entry
+
+    def invalidate(self, patient_id, version=0):
+        with self._lock:
+            self._min_versions[patient_id] = int(version or 0)
+            self._min_versions.move_to_end(patient_id)
+            while len(self._min_versions) > PATIENT_CACHE_SIZE:
+                self._min_versions.popitem(last=False)
+        self.backend.delete(patient_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        if hasattr(self.backend, "stats"):
+            stats.update(self.backend.stats())
+        return stats
+
+    @staticmethod
+    def _entry(version, resource):
+        with timer("encoding"):
+            body = dumps(resource)
+        if version:
+            etag = weak_etag(version)
+        else:
+            # Documentos anteriores a meta.versionId: ETag a partir del contenido
+            etag = weak_etag(f"h{zlib.crc32(body):08x}")
+        return CacheEntry(version, etag, body)
@@ -0,0 +1,207 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from pymongo import UpdateOne
+
+from connection import close_client, get_collection
+from app.controlador.PatientMatch import (
+    MATCH_FIELD, MATCH_PROJECTION, MPI_POSSIBLE_SCORE, MPI_PROBABLE_SCORE, MatchFeatures, PatientMatcher,
+    match_fields, match_grade, match_pairs,
+)
+
+# Procesos que puntúan los bloques (0: en el propio proceso)
+MPI_DEDUP_PROCESSES = int(os.getenv("MPI_DEDUP_PROCESSES", str(os.cpu_count() or 1)))
+# Bloques más grandes que esto no se comparan: todos sus pares (n²/2) costarían
+# más que lo que aportan, y sus pacientes casi siempre comparten otros bloques
+MPI_MAX_BLOCK = int(os.getenv("MPI_MAX_BLOCK", "200"))
+# Bloques por tarea enviada a un proceso: cada tarea lee sus pacientes en una consulta
+MPI_DEDUP_TASK_BLOCKS = int(os.getenv("MPI_DEDUP_TASK_BLOCKS", "500"))
+MPI_BACKFILL_BATCH = 1000
+
+# Lo que se lee para calcular `_mpi` de los pacientes que no lo tienen
+_SOURCE_PROJECTION = {"name": 1, "identifier": 1, "telecom": 1, "birthDate": 1, "gender": 1}
+
+
+def backfill_match_fields(collection, batch_size=MPI_BACKFILL_BATCH):
+    """Calcula `_mpi` de los pacientes guardados antes de que existiera. Retorna cuántos actualizó."""
+    updated, operations = 0, []
+    cursor = collection.find({MATCH_FIELD: {"$exists": False}}, _SOURCE_PROJECTION).batch_size(batch_size)
+    for doc in cursor:
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {MATCH_FIELD: match_fields(doc)}}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
+
+
+def iter_blocks(collection, max_block=MPI_MAX_BLOCK):
+    """
+    Bloques con más de un paciente: (clave, [_id]), agrupados por MongoDB (con
+    disco si hace falta) sin traer los documentos. Los que superan `max_block`
+    vuelven con la lista vacía, para contarlos.
+    """
+    pipeline = [
+        {"$match": {f"{MATCH_FIELD}.bloques.0": {"$exists": True}}},
+        {"$project": {"bloques": f"${MATCH_FIELD}.bloques"}},
+        {"$unwind": "$bloques"},
+        {"$group": {"_id": "$bloques", "n": {"$sum": 1}, "ids": {"$push": "$_id"}}},
+        {"$match": {"n": {"$gt": 1}}},
+        # Los bloques enormes salen sin _id: ningún documento del resultado pasa de los 16 MB
+        {"$project": {"n": 1, "ids": {"$cond": [{"$lte": ["$n", max_block]}, "$ids", []]}}},
+    ]
+    for block in collection.aggregate(pipeline, allowDiskUse=True):
+        yield block["_id"], block["ids"]
+
+
+def _score_blocks(blocks, collection=None):
+    """
+    En un proceso del pool: lee una vez los `_mpi` de todos los pacientes de la
+    tarea y puntúa todos los pares de cada bloque. Retorna (comparaciones,
+    [(id, id, puntuación)]) con los pares que superan MPI_POSSIBLE_SCORE.
+    """
+    collection = collection if collection is not None else get_collection("patients")
+    ids = list({_id for block in blocks for _id in block})
+    docs = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": ids}}, MATCH_PROJECTION)}
+    comparisons, pairs = 0, []
+    for block in blocks:
+        block_docs = [docs[_id] for _id in block if _id in docs]
+        comparisons += len(block_docs) * (len(block_docs) - 1) // 2
+        if len(block_docs) > 1:
+            pairs.extend(match_pairs(MatchFeatures.from_documents(block_docs), MPI_POSSIBLE_SCORE))
+    return comparisons, pairs
+
+
+class _Clusters:
+    """Unión-búsqueda sobre los pares: cada grupo es un mismo paciente con varios registros."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        while parent != self.parent[parent]:
+            self.parent[parent] = self.parent[self.parent[parent]]
+            parent = self.parent[parent]
+        return parent
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+    def sizes(self):
+        counts = {}
+        for item in self.parent:
+            root = self.find(item)
+            counts[root] = counts.get(root, 0) + 1
+        return counts
+
+
+class PatientDedup:
+    """
+    Búsqueda de duplicados en toda la colección, fuera de línea. MongoDB agrupa
+    los pacientes por clave de bloqueo, los bloques se reparten en tareas entre
+    un pool de procesos (cada proceso lee sus pacientes con su propio cliente y
+    puntúa cada bloque con numpy) y los pares encontrados se guardan en
+    patient_matches para revisarlos. Un par que aparece en varios bloques se
+    guarda una vez, con su mejor puntuación.
+    """
+
+    def __init__(self, collection=None, matcher=None, processes=MPI_DEDUP_PROCESSES, max_block=MPI_MAX_BLOCK,
+                 task_blocks=MPI_DEDUP_TASK_BLOCKS):
+        self._collection = collection
+        self.matcher = matcher or PatientMatcher(patients_collection=collection)
+        self.processes = processes
+        self.max_block = max_block
+        self.task_blocks = task_blocks
+
+    @property
+    def collection(self):
+        return self._collection if self._collection is not None else get_collection("patients")
+
+    def _tasks(self, summary):
+        task = []
+        for _, ids in iter_blocks(self.collection, self.max_block):
+            summary["blocks"] += 1
+            if not ids:
+                summary["oversizedBlocks"] += 1
+                continue
+            task.append(ids)
+            if len(task) >= self.task_blocks:
+                yield task
+                task = []
+        if task:
+            yield task
+
+    def _scored(self, summary):
+        """Resultados de cada tarea, en el pool o en línea."""
+        if self.processes <= 0:
+            for task in self._tasks(summary):
+                yield _score_blocks(task, self.collection)
+            return
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=context) as executor:
+            # Como mucho dos tareas por proceso en vuelo: la lista de bloques no se
+            # carga entera en memoria y los procesos nunca esperan trabajo
+            pending = set()
+            for task in self._tasks(summary):
+                pending.add(executor.submit(_score_blocks, task))
+                if len(pending) >= 2 * self.processes:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in pending:
+                yield future.result()
+
+    def run(self):
+        start = time.perf_counter()
+        summary = {"backfilled": backfill_match_fields(self.collection), "blocks": 0, "oversizedBlocks": 0,
+                   "comparisons": 0}
+        best = {}
+        for comparisons, pairs in self._scored(summary):
+            summary["comparisons"] += comparisons
+            for a, b, score in pairs:
+                key = (a, b) if str(a) < str(b) else (b, a)
+                if score > best.get(key, 0.0):
+                    best[key] = score
+
+        grades = {"certain": 0, "probable": 0, "possible": 0}
+        clusters = _Clusters()
+        pairs = []
+        for (a, b), score in best.items():
+            grades[match_grade(score)] += 1
+            if score >= MPI_PROBABLE_SCORE:
+                clusters.union(a, b)
+            pairs.append((a, b, score))
+        for first in range(0, len(pairs), MPI_BACKFILL_BATCH):
+            self.matcher.record(pairs[first:first + MPI_BACKFILL_BATCH], "lote")
+
+        sizes = clusters.sizes().values()
+        summary.update({
+            "pairs": grades,
+            "clusters": len(sizes),
+            "largestCluster": max(sizes, default=0),
+            "seconds": round(time.perf_counter() - start, 2),
+        })
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca pacientes duplicados en toda la colección.")
+    parser.add_argument("--processes", type=int, default=MPI_DEDUP_PROCESSES)
+    parser.add_argument("--max-block", type=int, default=MPI_MAX_BLOCK)
+    args = parser.parse_args()
+    try:
+        summary = PatientDedup(processes=args.processes, max_block=args.max_block).run()
+    finally:
+        close_client()
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
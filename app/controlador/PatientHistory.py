@@ -0,0 +1,163 @@
+import os
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from connection import get_collection
+from app.controlador import parches
+
+HISTORY_COLLECTION_NAME = "patients_history"
+# Campo interno del paciente actual con la versión de la última instantánea
+# guardada en el historial: decide, en la misma escritura que cambia la
+# versión, si la siguiente entrada es instantánea o parche.
+HISTORY_FIELD = "_historial"
+# Cada cuántas versiones se guarda el recurso completo. Leer una versión
+# aplica como mucho HISTORY_SNAPSHOT_INTERVAL - 1 parches.
+HISTORY_SNAPSHOT_INTERVAL = int(os.getenv("HISTORY_SNAPSHOT_INTERVAL", "20"))
+
+HISTORY_INDEXES = [
+    ([("paciente", ASCENDING), ("version", DESCENDING)], {"name": "paciente_version"}),
+    ([("paciente", ASCENDING), ("tipo", ASCENDING), ("version", DESCENDING)], {"name": "paciente_tipo_version"}),
+]
+
+
+def history_marker(previous_marker, version):
+    """
+    Marcador `_historial` de la nueva versión y si su entrada debe ser una
+    instantánea: la primera versión con historial, o cuando la última
+    instantánea queda a HISTORY_SNAPSHOT_INTERVAL versiones o más.
+    """
+    last_snapshot = (previous_marker or {}).get("instantanea")
+    if last_snapshot is None or version - last_snapshot >= HISTORY_SNAPSHOT_INTERVAL:
+        return {"instantanea": version}, True
+    return {"instantanea": last_snapshot}, False
+
+
+def _without_version(resource):
+    """El recurso sin meta.versionId ni meta.lastUpdated: ya van en la entrada, no en el parche."""
+    meta = {key: value for key, value in (resource.get("meta") or {}).items() if key not in ("versionId", "lastUpdated")}
+    return {**resource, "meta": meta}
+
+
+def history_entry(patient_id, resource, previous, snapshot, method):
+    """
+    Entrada del historial para la versión de `resource` (recurso FHIR sin campos
+    internos). Las instantáneas guardan el recurso; el resto, el parche JSON
+    desde la versión anterior `previous`.
+    """
+    version = int(resource["meta"]["versionId"])
+    entry = {
+        "_id": f"{patient_id}/{version}",
+        "paciente": patient_id,
+        "version": version,
+        "lastUpdated": resource["meta"].get("lastUpdated"),
+        "metodo": method,
+    }
+    if snapshot or previous is None:
+        entry["tipo"] = "instantanea"
+        entry["recurso"] = resource
+    else:
+        entry["tipo"] = "parche"
+        entry["parche"] = parches.diff(_without_version(previous), _without_version(resource))
+    return entry
+
+
+class PatientHistory:
+    """Versiones anteriores de los pacientes: instantáneas periódicas y parches JSON entre ellas."""
+
+    def __init__(self, collection=None, patients_collection=None):
+        self._collection = collection
+        # Con una colección de pacientes inyectada (benchmarks), el historial va a su misma base de datos
+        self._patients_collection = patients_collection
+
+    @property
+    def collection(self):
+        if self._collection is not None:
+            return self._collection
+        if self._patients_collection is not None:
+            return self._patients_collection.database[HISTORY_COLLECTION_NAME]
+        return get_collection(HISTORY_COLLECTION_NAME)
+
+    def ensure_indexes(self):
+        for keys, options in HISTORY_INDEXES:
+            self.collection.create_index(keys, **options)
+
+    def record(self, entries, session=None):
+        """Guarda las entradas. Son idempotentes (_id = paciente/versión): un reintento no duplica."""
+        if not entries:
+            return
+        try:
+            if len(entries) == 1:
+                self.collection.insert_one(entries[0], session=session)
+            else:
+                self.collection.insert_many(entries, ordered=False, session=session)
+        except DuplicateKeyError:
+            pass
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+    def latest_version(self, patient_id):
+        entry = self.collection.find_one({"paciente": patient_id}, {"version": 1}, sort=[("version", DESCENDING)])
+        return entry["version"] if entry else None
+
+    def _entries(self, patient_id, lowest, highest):
+        """Entradas desde la instantánea anterior a `lowest` hasta `highest`, en orden de versión."""
+        snapshot = self.collection.find_one(
+            {"paciente": patient_id, "tipo": "instantanea", "version": {"$lte": lowest}},
+            {"version": 1},
+            sort=[("version", DESCENDING)],
+        )
+        if snapshot is None:
+            # Pacientes anteriores al historial: empieza en su primera instantánea
+            snapshot = self.collection.find_one(
+                {"paciente": patient_id, "tipo": "instantanea", "version": {"$lte": highest}},
+                {"version": 1},
+                sort=[("version", ASCENDING)],
+            )
+        if snapshot is None:
+            return []
+        return list(self.collection.find(
+            {"paciente": patient_id, "version": {"$gte": snapshot["version"], "$lte": highest}},
+        ).sort("version", ASCENDING))
+
+    @staticmethod
+    def _replay(entries):
+        """Reconstruye cada versión aplicando los parches sobre la última instantánea."""
+        resource = None
+        for entry in entries:
+            if entry["tipo"] == "instantanea":
+                resource = entry["recurso"]
+            elif resource is not None:
+                resource = parches.apply(resource, entry["parche"])
+                meta = resource.setdefault("meta", {})
+                meta["versionId"] = str(entry["version"])
+                meta["lastUpdated"] = entry["lastUpdated"]
+            else:
+                continue
+            yield entry, resource
+
+    def vread(self, patient_id, version):
+        """La versión `version` del paciente, o None si no está en el historial."""
+        for entry, resource in self._replay(self._entries(patient_id, version, version)):
+            if entry["version"] == version:
+                return resource
+        return None
+
+    def history(self, patient_id, count, before=None):
+        """
+        Hasta `count` versiones, de la más reciente a la más antigua, empezando
+        por la anterior a `before` (paginación). Retorna ([(entrada, recurso)], siguiente `before`).
+        """
+        highest = self.latest_version(patient_id) if before is None else before - 1
+        if highest is None or highest < 1:
+            return [], None
+        lowest = max(1, highest - count + 1)
+        versions = [
+            (entry, resource) for entry, resource in self._replay(self._entries(patient_id, lowest, highest))
+            if entry["version"] >= lowest
+        ]
+        versions.reverse()
+        # Las versiones anteriores a la primera instantánea (pacientes previos al historial) no existen
+        next_before = lowest if lowest > 1 and versions and versions[-1][0]["version"] == lowest else None
+        return versions, next_before
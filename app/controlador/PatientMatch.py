@@ -0,0 +1,402 @@
+import os
+import re
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+from connection import get_collection
+from app.controlador.PatientSearch import fold
+from app.controlador.PatientSummary import _preferred
+from app.controlador.fechas import now_instant
+
+MATCHES_COLLECTION_NAME = "patient_matches"
+
+# Campos derivados de cada Patient para el índice maestro de pacientes (MPI):
+# claves de bloqueo (indexadas) y los datos normalizados con los que se puntúa
+# un par. Comparar solo los pacientes que comparten alguna clave evita
+# comparar cada paciente con toda la colección.
+MATCH_FIELD = "_mpi"
+MATCH_PROJECTION = {MATCH_FIELD: 1}
+MATCH_INDEXES = [([(f"{MATCH_FIELD}.bloques", ASCENDING)], {"name": "mpi_bloques"})]
+MATCHES_INDEXES = [
+    ([("pacientes", ASCENDING)], {"name": "pacientes"}),
+    ([("estado", ASCENDING), ("_id", ASCENDING)], {"name": "estado_id"}),
+]
+
+# Puntuaciones mínimas (0-1) de cada grado de coincidencia (match-grade de FHIR)
+MPI_CERTAIN_SCORE = float(os.getenv("MPI_CERTAIN_SCORE", "0.92"))
+MPI_PROBABLE_SCORE = float(os.getenv("MPI_PROBABLE_SCORE", "0.8"))
+MPI_POSSIBLE_SCORE = float(os.getenv("MPI_POSSIBLE_SCORE", "0.65"))
+# Candidatos que se puntúan como mucho por paciente
+MPI_MAX_CANDIDATES = int(os.getenv("MPI_MAX_CANDIDATES", "500"))
+# Candidatos leídos como mucho en la consulta de un lote de altas (Bundles,
+# $import, cola de escrituras), sea cual sea su tamaño
+MPI_MAX_BATCH_CANDIDATES = int(os.getenv("MPI_MAX_BATCH_CANDIDATES", "5000"))
+# Comprobación al crear un paciente: "off", "flag" (se crea y el posible
+# duplicado queda en patient_matches para revisarlo) o "reject" (un duplicado
+# seguro se rechaza con 409, también en cada entrada de una carga por lotes)
+MPI_ON_WRITE = os.getenv("MPI_ON_WRITE", "flag")
+
+# Peso de cada campo en la puntuación. Identificador y teléfono solo suman
+# cuando coinciden (que no coincidan no dice mucho: cada sistema usa el suyo),
+# salvo dos identificadores distintos del mismo sistema, que restan.
+WEIGHTS = {"familia": 0.30, "dado": 0.20, "nacimiento": 0.30, "genero": 0.05, "identificador": 0.50, "telefono": 0.15}
+# Sin nombre ni fecha de nacimiento en ambos no hay coincidencia posible
+MIN_EVIDENCE = WEIGHTS["familia"]
+
+# Dimensión de los vectores de bigramas con que se comparan los nombres
+NAME_DIM = 256
+# Identificadores y teléfonos que se comparan por paciente
+MAX_IDS = 4
+MAX_PHONES = 2
+
+_GENDERS = {"male": 1, "female": 2, "other": 3}
+_NON_LETTERS = re.compile(r"[^a-z ]+")
+_NON_ALNUM = re.compile(r"[^0-9A-Z]+")
+_PHONETIC_RULES = [
+    # Grafías con el mismo sonido en español (y en los nombres de origen extranjero más comunes)
+    (re.compile(r"ch"), "X"), (re.compile(r"ll|y(?=[aeiou])"), "Y"), (re.compile(r"qu|k|c(?![ei])"), "K"),
+    (re.compile(r"gu(?=[ei])"), "G"), (re.compile(r"g(?=[ei])|j"), "J"), (re.compile(r"c|z|s"), "S"),
+    (re.compile(r"x"), "KS"), (re.compile(r"v|w|b"), "B"), (re.compile(r"ph"), "F"), (re.compile(r"h"), ""),
+    (re.compile(r"y"), "i"),
+]
+
+
+def normalize_name(text):
+    """Minúsculas, sin tildes ni signos, con un espacio entre palabras."""
+    return " ".join(_NON_LETTERS.sub(" ", fold(text or "")).split())
+
+
+def normalize_identifier(value):
+    """Valor de un identificador sin separadores ni ceros a la izquierda (10.207.137 = 10207137)."""
+    return _NON_ALNUM.sub("", (value or "").upper()).lstrip("0")
+
+
+def phonetic_code(word):
+    """
+    Código fonético de una palabra, pensado para nombres en español: las
+    grafías que suenan igual (b/v, c/s/z, ll/y, g/j, h muda...) dan el mismo
+    código, y solo se conserva la primera vocal. "Giménez" y "Jiménes" → "JMNS".
+    """
+    word = normalize_name(word).replace(" ", "")
+    if not word:
+        return ""
+    for pattern, replacement in _PHONETIC_RULES:
+        word = pattern.sub(replacement, word)
+    code = word[0].upper()
+    for char in word[1:]:
+        if char in "aeiou":
+            continue
+        char = char.upper()
+        if char != code[-1]:
+            code += char
+    return code[:6]
+
+
+def match_fields(patient_dict):
+    """Subdocumento `_mpi` de un Patient ya validado: datos normalizados y claves de bloqueo."""
+    name = _preferred(patient_dict.get("name")) or {}
+    family = normalize_name(name.get("family"))
+    given = normalize_name(" ".join(name.get("given") or []))
+    birth = patient_dict.get("birthDate") or None
+    identifiers = []
+    for identifier in patient_dict.get("identifier") or []:
+        value = normalize_identifier(identifier.get("value"))
+        if len(value) >= 4:
+            identifiers.append(f"{identifier.get('system') or ''}|{value}")
+    phones = []
+    for telecom in patient_dict.get("telecom") or []:
+        digits = re.sub(r"\D", "", telecom.get("value") or "")
+        if telecom.get("system") in ("phone", "sms") and len(digits) >= 7:
+            # Los últimos 7 dígitos: sin prefijos de país ni de área
+            phones.append(digits[-7:])
+
+    blocks = {f"id:{identifier.partition('|')[2]}" for identifier in identifiers}
+    blocks.update(f"tel:{phone}" for phone in phones)
+    if birth:
+        surnames = [word for word in family.split() if len(word) > 1]
+        # Apellido y fecha de nacimiento: cada apellido por separado, así
+        # "García" y "García López" caen en el mismo bloque
+        blocks.update(f"fn:{surname}:{birth}" for surname in surnames)
+        first_given = given.split()[0] if given else ""
+        if first_given:
+            # Nombre y fecha: cambios de apellido y apellidos mal escritos
+            blocks.add(f"nd:{phonetic_code(first_given)}:{birth}")
+            if surnames:
+                # Fonética de apellido y nombre, con el año: errores en ambos y en el día o el mes
+                blocks.add(f"ph:{phonetic_code(surnames[0])}:{phonetic_code(first_given)}:{birth[:4]}")
+    return {
+        "bloques": sorted(blocks),
+        "familia": family,
+        "dado": given,
+        "nacimiento": birth,
+        "genero": patient_dict.get("gender"),
+        "ids": identifiers[:MAX_IDS],
+        "telefonos": phones[:MAX_PHONES],
+    }
+
+
+def match_grade(score):
+    if score >= MPI_CERTAIN_SCORE:
+        return "certain"
+    if score >= MPI_PROBABLE_SCORE:
+        return "probable"
+    if score >= MPI_POSSIBLE_SCORE:
+        return "possible"
+    return None
+
+
+def _name_vectors(names):
+    """Bigramas de caracteres de cada nombre, contados y normalizados (filas de norma 1 o 0)."""
+    rows, columns = [], []
+    for row, name in enumerate(names):
+        if not name:
+            continue
+        padded = f" {name} "
+        for a, b in zip(padded, padded[1:]):
+            rows.append(row)
+            columns.append((ord(a) * 131 + ord(b)) % NAME_DIM)
+    vectors = np.zeros((len(names), NAME_DIM), dtype=np.float32)
+    np.add.at(vectors, (rows, columns), 1.0)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def _hashed(values_per_row, width):
+    """Matriz de hashes (filas x width) y su máscara de presencia."""
+    hashes = np.zeros((len(values_per_row), width), dtype=np.int64)
+    mask = np.zeros((len(values_per_row), width), dtype=bool)
+    for row, values in enumerate(values_per_row):
+        for column, value in enumerate(values[:width]):
+            hashes[row, column] = hash(value)
+            mask[row, column] = True
+    return hashes, mask
+
+
+def _any_equal(a, a_mask, b, b_mask):
+    """
+    Para cada par (fila de a, fila de b): ¿comparten algún valor presente? Se
+    compara columna a columna para no crear un array de len(a) x len(b) x
+    columnas x columnas.
+    """
+    equal = np.zeros((len(a), len(b)), dtype=bool)
+    for i in range(a.shape[1]):
+        for j in range(b.shape[1]):
+            equal |= (a[:, i, None] == b[None, :, j]) & a_mask[:, i, None] & b_mask[None, :, j]
+    return equal
+
+
+class MatchFeatures:
+    """
+    Datos de comparación de un grupo de pacientes en columnas (arrays de numpy),
+    para puntuar todos los pares de dos grupos de una vez.
+    """
+
+    __slots__ = ("ids", "family", "has_family", "given", "has_given", "birth", "gender",
+                 "id_values", "id_systems", "id_mask", "phones", "phone_mask")
+
+    def __init__(self, ids, fields):
+        self.ids = ids
+        families = [f.get("familia") or "" for f in fields]
+        givens = [f.get("dado") or "" for f in fields]
+        self.family = _name_vectors(families)
+        self.has_family = np.array([bool(f) for f in families])
+        self.given = _name_vectors(givens)
+        self.has_given = np.array([bool(g) for g in givens])
+        # Fecha de nacimiento como (año, mes, día); 0 si falta o está incompleta
+        birth = np.zeros((len(fields), 3), dtype=np.int32)
+        for row, f in enumerate(fields):
+            parts = (f.get("nacimiento") or "").split("-")
+            if len(parts) == 3 and all(part.isdigit() for part in parts):
+                birth[row] = [int(part) for part in parts]
+        self.birth = birth
+        self.gender = np.array([_GENDERS.get(f.get("genero"), 0) for f in fields], dtype=np.int8)
+        identifiers = [f.get("ids") or [] for f in fields]
+        self.id_values, self.id_mask = _hashed([[i.partition("|")[2] for i in ids_] for ids_ in identifiers], MAX_IDS)
+        self.id_systems, _ = _hashed([[i.partition("|")[0] for i in ids_] for ids_ in identifiers], MAX_IDS)
+        self.phones, self.phone_mask = _hashed([f.get("telefonos") or [] for f in fields], MAX_PHONES)
+
+    @classmethod
+    def from_documents(cls, docs):
+        """Desde documentos leídos con MATCH_PROJECTION."""
+        return cls([doc["_id"] for doc in docs], [doc.get(MATCH_FIELD) or {} for doc in docs])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, rows):
+        """Las filas `rows` (posiciones) del grupo, sin volver a calcular sus datos."""
+        subset = MatchFeatures.__new__(MatchFeatures)
+        subset.ids = [self.ids[row] for row in rows]
+        for name in MatchFeatures.__slots__[1:]:
+            setattr(subset, name, getattr(self, name)[rows])
+        return subset
+
+    def scores(self, other):
+        """Matriz (len(self) x len(other)) de puntuaciones entre 0 y 1."""
+        family = self.family @ other.family.T
+        has_family = self.has_family[:, None] & other.has_family[None, :]
+        given = self.given @ other.given.T
+        has_given = self.has_given[:, None] & other.has_given[None, :]
+
+        a, b = self.birth[:, None, :], other.birth[None, :, :]
+        has_birth = (a[..., 0] > 0) & (b[..., 0] > 0)
+        same = a == b
+        same_year, same_month, same_day = same[..., 0], same[..., 1], same[..., 2]
+        swapped = same_year & (a[..., 1] == b[..., 2]) & (a[..., 2] == b[..., 1])
+        near_year = (np.abs(a[..., 0] - b[..., 0]) == 1) & same_month & same_day
+        birth = np.select(
+            [same_year & same_month & same_day, swapped, (same_year & (same_month | same_day)) | near_year],
+            [1.0, 0.8, 0.5],
+            0.0,
+        )
+
+        has_gender = (self.gender[:, None] > 0) & (other.gender[None, :] > 0)
+        gender = (self.gender[:, None] == other.gender[None, :]).astype(np.float32)
+
+        shared_id = _any_equal(self.id_values, self.id_mask, other.id_values, other.id_mask)
+        same_system = _any_equal(self.id_systems, self.id_mask, other.id_systems, other.id_mask)
+        has_id = shared_id | same_system
+        shared_phone = _any_equal(self.phones, self.phone_mask, other.phones, other.phone_mask)
+
+        numerator = (
+            WEIGHTS["familia"] * family * has_family + WEIGHTS["dado"] * given * has_given
+            + WEIGHTS["nacimiento"] * birth * has_birth + WEIGHTS["genero"] * gender * has_gender
+            + WEIGHTS["identificador"] * shared_id + WEIGHTS["telefono"] * shared_phone
+        )
+        evidence = WEIGHTS["familia"] * has_family + WEIGHTS["nacimiento"] * has_birth
+        denominator = (
+            evidence + WEIGHTS["dado"] * has_given + WEIGHTS["genero"] * has_gender
+            + WEIGHTS["identificador"] * has_id + WEIGHTS["telefono"] * shared_phone
+        )
+        scores = np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64),
+                           where=denominator > 0)
+        scores[evidence < MIN_EVIDENCE] = 0.0
+        # Sin fecha de nacimiento que comparar, un nombre igual no basta para un duplicado seguro
+        scores[~has_birth] *= 0.9
+        return scores
+
+
+def match_pairs(features, threshold=MPI_POSSIBLE_SCORE):
+    """Pares (id, id, puntuación) de un bloque que superan `threshold`, cada par una vez."""
+    scores = features.scores(features)
+    rows, columns = np.nonzero(np.triu(scores >= threshold, k=1))
+    return [(features.ids[r], features.ids[c], float(scores[r, c])) for r, c in zip(rows, columns)]
+
+
+def link_id(a, b):
+    first, second = sorted((str(a), str(b)))
+    return f"{first}:{second}"
+
+
+class PatientMatcher:
+    """
+    Búsqueda de posibles duplicados de un paciente: una consulta por las claves
+    de bloqueo (índice multikey de `_mpi.bloques`) y la puntuación vectorizada
+    de los candidatos. Los pares encontrados se guardan en patient_matches
+    (una entrada por par, con su estado de revisión).
+    """
+
+    def __init__(self, collection=None, patients_collection=None):
+        self._collection = collection
+        self._patients_collection = patients_collection
+
+    @property
+    def patients(self):
+        if self._patients_collection is not None:
+            return self._patients_collection
+        return get_collection("patients")
+
+    @property
+    def collection(self):
+        if self._collection is not None:
+            return self._collection
+        if self._patients_collection is not None:
+            return self._patients_collection.database[MATCHES_COLLECTION_NAME]
+        return get_collection(MATCHES_COLLECTION_NAME)
+
+    def ensure_indexes(self):
+        for keys, options in MATCHES_INDEXES:
+            self.collection.create_index(keys, **options)
+
+    def find_matches(self, patient_dict, exclude=None, threshold=MPI_POSSIBLE_SCORE, limit=MPI_MAX_CANDIDATES):
+        """
+        Posibles duplicados de un paciente (con o sin `_mpi`): [(id, puntuación,
+        grado)] de mayor a menor puntuación. `exclude` es el _id del propio paciente.
+        """
+        return self.find_matches_many([patient_dict], [exclude], threshold, limit)[0]
+
+    def find_matches_many(self, patient_dicts, excludes=None, threshold=MPI_POSSIBLE_SCORE,
+                          limit=MPI_MAX_CANDIDATES):
+        """
+        Como find_matches para varios pacientes, con una sola consulta de
+        candidatos (como mucho MPI_MAX_BATCH_CANDIDATES). Cada paciente se
+        puntúa solo contra los candidatos de sus bloques, no contra los de todo el lote.
+        """
+        fields = [patient.get(MATCH_FIELD) or match_fields(patient) for patient in patient_dicts]
+        excludes = excludes or [None] * len(patient_dicts)
+        blocks = sorted({block for f in fields for block in f["bloques"]})
+        if not blocks:
+            return [[] for _ in patient_dicts]
+        query = {f"{MATCH_FIELD}.bloques": {"$in": blocks}}
+        cap = min(limit * len(patient_dicts), MPI_MAX_BATCH_CANDIDATES)
+        candidates = list(self.patients.find(query, MATCH_PROJECTION).limit(cap))
+        if not candidates:
+            return [[] for _ in patient_dicts]
+        by_block = {}
+        for column, candidate in enumerate(candidates):
+            for block in candidate[MATCH_FIELD]["bloques"]:
+                by_block.setdefault(block, []).append(column)
+        own, others = MatchFeatures(list(excludes), fields), MatchFeatures.from_documents(candidates)
+        results = []
+        for row, (f, exclude) in enumerate(zip(fields, excludes)):
+            columns = sorted({
+                column for block in f["bloques"] for column in by_block.get(block, ())
+                if candidates[column]["_id"] != exclude
+            })[:limit]
+            if not columns:
+                results.append([])
+                continue
+            scores = own.take([row]).scores(others.take(columns))[0]
+            matches = [
+                (str(candidates[column]["_id"]), float(score))
+                for column, score in zip(columns, scores) if score >= threshold
+            ]
+            matches.sort(key=lambda match: -match[1])
+            results.append([(id_, score, match_grade(score)) for id_, score in matches])
+        return results
+
+    def record(self, pairs, origin):
+        """Guarda pares (id, id, puntuación). Los ya revisados conservan su estado."""
+        if not pairs:
+            return 0
+        now = now_instant()
+        operations = [
+            UpdateOne(
+                {"_id": link_id(a, b)},
+                {
+                    "$set": {"puntuacion": round(score, 4), "grado": match_grade(score), "origen": origin, "actualizado": now},
+                    "$setOnInsert": {"pacientes": sorted((str(a), str(b))), "estado": "pendiente"},
+                },
+                upsert=True,
+            )
+            for a, b, score in pairs
+        ]
+        self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def get_links(self, count, after=None, state="pendiente", patient_id=None):
+        """Página de pares por `_id`: [(entrada)], siguiente cursor."""
+        query = {"estado": state} if state else {}
+        if patient_id:
+            query["pacientes"] = patient_id
+        if after:
+            query["_id"] = {"$gt": after}
+        docs = list(self.collection.find(query).sort("_id", 1).limit(count + 1))
+        next_cursor = docs[count - 1]["_id"] if len(docs) > count else None
+        return docs[:count], next_cursor
+
+    def set_link_state(self, link, state):
+        result = self.collection.update_one({"_id": link}, {"$set": {"estado": state, "actualizado": now_instant()}})
+        return result.matched_count > 0
@@ -0,0 +1,226 @@
+import re
+import unicodedata
+from datetime import date, timedelta
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+from app.controlador.fechas import format_instant, parse_instant
+
+# Campos derivados que se guardan junto a cada Patient para que las búsquedas
+# de texto (sin mayúsculas ni tildes, por prefijo) usen índices normales.
+SEARCH_FIELDS = "_busqueda"
+
+SEARCH_INDEXES = [
+    ([(f"{SEARCH_FIELDS}.nombres", ASCENDING)], {"name": "search_name"}),
+    ([(f"{SEARCH_FIELDS}.familias", ASCENDING)], {"name": "search_family"}),
+    ([(f"{SEARCH_FIELDS}.dados", ASCENDING)], {"name": "search_given"}),
+    ([(f"{SEARCH_FIELDS}.ciudades", ASCENDING)], {"name": "search_address_city"}),
+    ([("birthDate", ASCENDING)], {"name": "search_birthdate"}),
+    ([("gender", ASCENDING)], {"name": "search_gender"}),
+    ([("telecom.value", ASCENDING)], {"name": "search_telecom"}),
+    ([("meta.lastUpdated", ASCENDING)], {"name": "search_last_updated"}),
+]
+
+STRING_PARAMS = {
+    "name": f"{SEARCH_FIELDS}.nombres",
+    "family": f"{SEARCH_FIELDS}.familias",
+    "given": f"{SEARCH_FIELDS}.dados",
+    "address-city": f"{SEARCH_FIELDS}.ciudades",
+}
+DATE_PARAMS = {
+    "birthdate": "birthDate",
+    "_lastUpdated": "meta.lastUpdated",
+}
+# Parámetros de control: no filtran, los interpreta la ruta
+CONTROL_PARAMS = {"_count", "after", "_stream", "_summary", "_elements"}
+
+SUMMARY_ELEMENTS = [
+    "identifier", "active", "name", "telecom", "gender", "birthDate", "deceasedBoolean",
+    "deceasedDateTime", "address", "managingOrganization", "link",
+]
+MANDATORY_ELEMENTS = ["resourceType", "meta"]
+
+_PREFIXES = ("eq", "ne", "gt", "lt", "ge", "le", "sa", "eb", "ap")
+_DATE_RE = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+
+
+class SearchParameterError(ValueError):
+    pass
+
+
+def fold(text):
+    """Minúsculas y sin tildes, para comparar nombres como lo hace la búsqueda FHIR."""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in normalized if not unicodedata.combining(c)).lower().strip()
+
+
+def search_fields(patient_dict):
+    """Calcula los campos derivados de búsqueda de un Patient ya validado."""
+    familias, dados, nombres = set(), set(), set()
+    for name in patient_dict.get("name") or []:
+        if name.get("family"):
+            family = fold(name["family"])
+            familias.add(family)
+            familias.update(family.split())
+        for given in name.get("given") or []:
+            dados.add(fold(given))
+        if name.get("text"):
+            nombres.update(fold(name["text"]).split())
+    nombres.update(token for value in familias | dados for token in value.split())
+    ciudades = {fold(address["city"]) for address in patient_dict.get("address") or [] if address.get("city")}
+    return {
+        "nombres": sorted(nombres),
+        "familias": sorted(familias),
+        "dados": sorted(dados),
+        "ciudades": sorted(ciudades),
+    }
+
+
+def _split_prefix(value):
+    if len(value) > 2 and value[:2] in _PREFIXES and not value[:2].isdigit():
+        return value[:2], value[2:]
+    return "eq", value
+
+
+def _date_bounds(value):
+    """Intervalo [inicio, fin) como texto para una fecha o instante FHIR de cualquier precisión."""
+    if "T" in value:
+        try:
+            start = parse_instant(value)
+        except ValueError:
+            raise SearchParameterError(f"Fecha inválida: {value!r}")
+        step = timedelta(milliseconds=1) if "." in value else timedelta(seconds=1)
+        return format_instant(start), format_instant(start + step)
+    if not _DATE_RE.match(value):
+        raise SearchParameterError(f"Fecha inválida: {value!r}")
+    try:
+        parts = [int(part) for part in value.split("-")]
+        if len(parts) == 1:
+            return value, f"{parts[0] + 1:04d}"
+        if len(parts) == 2:
+            year, month = parts
+            if not 1 <= month <= 12:
+                raise ValueError(value)
+            return value, f"{year + 1:04d}-01" if month == 12 else f"{year:04d}-{month + 1:02d}"
+        return value, (date.fromisoformat(value) + timedelta(days=1)).isoformat()
+    except ValueError:
+        raise SearchParameterError(f"Fecha inválida: {value!r}")
+
+
+def _date_condition(value):
+    # Las fechas se guardan como texto ISO, así que un prefijo ("1986", "1986-02")
+    # ordena antes que cualquier fecha completa que empiece por él.
+    prefix, value = _split_prefix(value)
+    start, end = _date_bounds(value)
+    if prefix in ("eq", "ap"):
+        return {"$gte": start, "$lt": end}
+    if prefix == "ne":
+        return {"$not": {"$gte": start, "$lt": end}}
+    if prefix in ("gt", "sa"):
+        return {"$gte": end}
+    if prefix in ("lt", "eb"):
+        return {"$lt": start}
+    if prefix == "ge":
+        return {"$gte": start}
+    return {"$lt": end}
+
+
+def _string_condition(value, modifier):
+    folded = re.escape(fold(value))
+    if modifier == "exact":
+        return {"$regex": f"^{folded}$"}
+    if modifier == "contains":
+        return {"$regex": folded}
+    if modifier:
+        raise SearchParameterError(f"Modificador no soportado: :{modifier}")
+    # Prefijo anclado: MongoDB lo resuelve como un rango sobre el índice
+    return {"$regex": f"^{folded}"}
+
+
+def parse_identifier_token(token):
+    """
+    Interpreta un parámetro de búsqueda FHIR de tipo token para identifier:
+    `system|value`, `|value` (sin system), `system|` (solo system) o `value`.
+    Retorna (system, value); system es None si no se indicó y "" si se pidió vacío.
+    """
+    if "|" not in token:
+        return None, token
+    system, value = token.split("|", 1)
+    return system, value
+
+
+def identifier_filter(system, value):
+    if system is None:
+        return {"identifier.value": value}
+    if not value:
+        return {"identifier.system": system}
+    if system == "":
+        return {"identifier": {"$elemMatch": {"system": {"$exists": False}, "value": value}}}
+    return {"identifier": {"$elemMatch": {"system": system, "value": value}}}
+
+
+def _param_filter(name, modifier, value):
+    if name in STRING_PARAMS:
+        return {STRING_PARAMS[name]: _string_condition(value, modifier)}
+    if modifier:
+        raise SearchParameterError(f"Modificador no soportado en {name}: :{modifier}")
+    if name in DATE_PARAMS:
+        return {DATE_PARAMS[name]: _date_condition(value)}
+    if name == "gender":
+        return {"gender": value}
+    if name == "identifier":
+        return identifier_filter(*parse_identifier_token(value))
+    if name == "telecom":
+        system, telecom_value = parse_identifier_token(value)
+        if system:
+            return {"telecom": {"$elemMatch": {"system": system, "value": telecom_value}}}
+        return {"telecom.value": telecom_value}
+    if name == "_id":
+        try:
+            return {"_id": ObjectId(value)}
+        except InvalidId:
+            raise SearchParameterError(f"_id inválido: {value!r}")
+    raise SearchParameterError(f"Parámetro de búsqueda no soportado: {name}")
+
+
+def is_search(params):
+    """True si la petición trae algún parámetro que filtra (no solo de control)."""
+    return any(name.split(":", 1)[0] not in CONTROL_PARAMS for name, _ in params)
+
+
+def build_query(params):
+    """
+    Traduce los parámetros de búsqueda de Patient (lista de pares nombre/valor) a
+    un filtro de MongoDB. Parámetros repetidos se combinan con AND y los valores
+    separados por comas con OR, como en FHIR.
+    """
+    clauses = []
+    for raw_name, raw_value in params:
+        name, _, modifier = raw_name.partition(":")
+        if name in CONTROL_PARAMS:
+            continue
+        alternatives = [_param_filter(name, modifier, value) for value in raw_value.split(",") if value != ""]
+        if not alternatives:
+            raise SearchParameterError(f"Valor vacío para {raw_name}")
+        clauses.append(alternatives[0] if len(alternatives) == 1 else {"$or": alternatives})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def build_projection(summary=None, elements=None):
+    """Proyección de MongoDB para `_summary` y `_elements`. None = documento completo."""
+    if elements:
+        fields = [element.strip() for element in elements.split(",") if element.strip()]
+        return {field: 1 for field in fields + MANDATORY_ELEMENTS}
+    if summary in (None, "false"):
+        return None
+    if summary == "true":
+        return {field: 1 for field in SUMMARY_ELEMENTS + MANDATORY_ELEMENTS}
+    if summary == "text":
+        return {field: 1 for field in ["text", "id"] + MANDATORY_ELEMENTS}
+    if summary == "data":
+        return {"text": 0}
+    raise SearchParameterError(f"_summary no soportado: {summary!r}")
@@ -0,0 +1,60 @@
+from pymongo import ASCENDING
+
+# Resumen de cada paciente para los listados del portal (nombre, identificador,
+# fecha de nacimiento y género), guardado como campos escalares en un
+# subdocumento. El índice SUMMARY_INDEX contiene _id y esos campos: el listado
+# paginado por _id se resuelve solo con el índice, sin leer los documentos.
+SUMMARY_FIELD = "_resumen"
+SUMMARY_KEYS = ("nombre", "identificador", "nacimiento", "genero")
+SUMMARY_INDEX_NAME = "resumen_cubierto"
+SUMMARY_INDEX = (
+    [("_id", ASCENDING)] + [(f"{SUMMARY_FIELD}.{key}", ASCENDING) for key in SUMMARY_KEYS],
+    {"name": SUMMARY_INDEX_NAME},
+)
+# Solo campos del índice: así la consulta queda cubierta
+SUMMARY_PROJECTION = {"_id": 1, **{f"{SUMMARY_FIELD}.{key}": 1 for key in SUMMARY_KEYS}}
+
+
+def _preferred(items):
+    """El elemento con use=official o, si no hay, el primero."""
+    items = items or []
+    return next((item for item in items if item.get("use") == "official"), items[0] if items else None)
+
+
+def summary_fields(patient_dict):
+    """
+    Subdocumento `_resumen` de un Patient ya validado. Todos los campos están
+    siempre presentes (null si faltan) y son escalares: un array haría
+    multikey el índice y ya no podría cubrir la consulta.
+    """
+    name = _preferred(patient_dict.get("name")) or {}
+    full_name = name.get("text") or " ".join((name.get("given") or []) + [name.get("family") or ""]).strip()
+    identifier = _preferred(patient_dict.get("identifier")) or {}
+    return {
+        "nombre": full_name or None,
+        "identificador": identifier.get("value"),
+        "nacimiento": patient_dict.get("birthDate"),
+        "genero": patient_dict.get("gender"),
+    }
+
+
+class PatientSummary:
+    """Fila del listado de pacientes. Se serializa directamente (serializacion._default)."""
+
+    __slots__ = ("id", "name", "identifier", "birthDate", "gender")
+
+    def __init__(self, id, name, identifier, birthDate, gender):
+        self.id = id
+        self.name = name
+        self.identifier = identifier
+        self.birthDate = birthDate
+        self.gender = gender
+
+    @classmethod
+    def from_document(cls, doc):
+        """Desde un documento leído con SUMMARY_PROJECTION."""
+        summary = doc.get(SUMMARY_FIELD) or {}
+        return cls(
+            str(doc["_id"]), summary.get("nombre"), summary.get("identificador"),
+            summary.get("nacimiento"), summary.get("genero"),
+        )
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import orjson
+
+# Versión de las reglas de validación. Los documentos guardados llevan este
+# número en VALIDATION_MARKER; al leerlos no se vuelven a validar mientras
+# coincida. Se incrementa cuando cambian las reglas o la versión de fhir.resources.
+VALIDATION_VERSION = 1
+VALIDATION_MARKER = "_validacion"
+
+VALIDATION_CACHE_SIZE = int(os.getenv("VALIDATION_CACHE_SIZE", "1024"))
+
+_GENDERS = {"male", "female", "other", "unknown"}
+_DATE_RE = re.compile(r"^([0-9]([0-9]([0-9][1-9]|[1-9]0)|[1-9]00)|[1-9]000)(-(0[1-9]|1[0-2])(-(0[1-9]|[1-2][0-9]|3[0-1]))?)?$")
+
+
+_patient_model = None
+_WARMUP_PATIENT = {
+    "resourceType": "Patient",
+    "identifier": [{"use": "official", "type": {"coding": [{"code": "ID"}]}, "system": "urn:x", "value": "1"}],
+    "name": [{"use": "official", "text": "A B", "family": "B", "given": ["A"]}],
+    "telecom": [{"system": "phone", "value": "1", "use": "mobile"}],
+    "gender": "unknown",
+    "birthDate": "2000-01-01",
+    "address": [{"use": "home", "line": ["x"], "city": "x", "postalCode": "1", "country": "COL"}],
+    "meta": {"versionId": "1", "lastUpdated": "2000-01-01T00:00:00Z"},
+}
+
+
+class PatientValidationError(ValueError):
+    pass
+
+
+def patient_model():
+    """
+    Modelo Patient de fhir.resources, importado en el primer uso: su árbol de
+    modelos pydantic es lo más lento de importar de toda la aplicación.
+    """
+    global _patient_model
+    if _patient_model is None:
+        from fhir.resources.patient import Patient
+        _patient_model = Patient
+    return _patient_model
+
+
+def preload_models():
+    """
+    Carga el modelo Patient por adelantado. Lo llama app/wsgi.py para que, con
+    preload_app, quede en la memoria del maestro de gunicorn y los workers lo
+    compartan tras el fork (copy-on-write). Valida además un Patient de
+    ejemplo: fhir.resources importa los tipos anidados (HumanName, Address,
+    ...) la primera vez que los encuentra.
+    """
+    patient_model().__pydantic_validator__.validate_python(_WARMUP_PATIENT)
+
+
+class PatientValidator:
+    """
+    Valida recursos FHIR Patient en formato dict -> dict.
+
+    - Hace primero unas comprobaciones estructurales baratas (campos conocidos,
+      resourceType, gender, birthDate) para rechazar rápido los payloads inválidos.
+    - Usa directamente el validador/serializador de pydantic-core del modelo
+      Patient, sin pasar por `Patient(**data)` ni `.dict()`.
+    - Guarda en una caché LRU el resultado normalizado, indexado por el hash del
+      JSON canónico de la entrada, para no revalidar payloads repetidos.
+    """
+
+    def __init__(self, cache_size=VALIDATION_CACHE_SIZE):
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._fields = None
+        self.hits = 0
+        self.misses = 0
+
+    def known_fields(self):
+        if self._fields is None:
+            fields = {field.alias or name for name, field in patient_model().model_fields.items()}
+            fields.add("resourceType")
+            self._fields = fields
+        return self._fields
+
+    def precheck(self, data):
+        if not isinstance(data, dict):
+            raise PatientValidationError("El recurso Patient debe ser un objeto JSON.")
+        if data.get("resourceType", "Patient") != "Patient":
+            raise PatientValidationError(f"resourceType inválido: {data.get('resourceType')!r}")
+        unknown = data.keys() - self.known_fields()
+        if unknown:
+            raise PatientValidationError(f"Campos desconocidos en Patient: {sorted(unknown)}")
+        gender = data.get("gender")
+        if gender is not None and gender not in _GENDERS:
+            raise PatientValidationError(f"gender inválido: {gender!r}")
+        birth_date = data.get("birthDate")
+        if birth_date is not None and (not isinstance(birth_date, str) or not _DATE_RE.match(birth_date)):
+            raise PatientValidationError(f"birthDate inválido: {birth_date!r}")
+
+    def validate(self, data):
+        """Devuelve una copia normalizada (JSON) del Patient o lanza PatientValidationError."""
+        self.precheck(data)
+        try:
+            canonical = orjson.dumps(data, option=orjson.OPT_SORT_KEYS, default=str)
+        except TypeError as e:
+            raise PatientValidationError(str(e)) from e
+        key = hashlib.blake2b(canonical, digest_size=16).digest()
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        if cached is not None:
+            # El resultado se guarda serializado: cada llamada recibe su propia copia
+            return orjson.loads(cached)
+
+        try:
+            Patient = patient_model()
+            model = Patient.__pydantic_validator__.validate_python(data)
+        except Exception as e:
+            raise PatientValidationError(str(e)) from e
+        normalized = Patient.__pydantic_serializer__.to_python(model, mode="json", by_alias=True, exclude_none=True)
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = orjson.dumps(normalized)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return normalized
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+def is_validated(document):
+    return document.get(VALIDATION_MARKER) == VALIDATION_VERSION
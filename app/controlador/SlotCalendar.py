@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Agenda de los servicios del laboratorio: franjas de SLOT_MINUTES entre la hora
+# de apertura y la de cierre, con SLOT_CAPACITY citas por franja y servicio.
+SLOT_MINUTES = int(os.getenv("SLOT_MINUTES", "15"))
+SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", "1"))
+OPENING_TIME = os.getenv("OPENING_TIME", "07:00")
+CLOSING_TIME = os.getenv("CLOSING_TIME", "17:00")
+# Segundos que se confía en el calendario en memoria antes de recargar el día
+# (otros workers también reservan franjas).
+CALENDAR_TTL = float(os.getenv("CALENDAR_TTL", "5"))
+# Días (servicio, día) que se guardan como mucho en memoria; se descartan los usados hace más tiempo
+CALENDAR_MAX_DAYS = int(os.getenv("CALENDAR_MAX_DAYS", "1024"))
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+OPENING_MINUTE = _minutes(OPENING_TIME)
+CLOSING_MINUTE = _minutes(CLOSING_TIME)
+
+
+def slot_minute(moment):
+    """Minuto del día en que empieza la franja, o None si la hora no es una franja válida."""
+    minute = moment.hour * 60 + moment.minute
+    if moment.second or moment.microsecond or minute % SLOT_MINUTES:
+        return None
+    if not OPENING_MINUTE <= minute <= CLOSING_MINUTE - SLOT_MINUTES:
+        return None
+    return minute
+
+
+def slot_id(service, day, minute):
+    return f"{service}|{day.isoformat()}T{minute // 60:02d}:{minute % 60:02d}"
+
+
+class DaySlots:
+    """Franjas ocupadas de un servicio en un día, ordenadas por minuto de inicio."""
+
+    __slots__ = ("starts", "counts", "loaded_at")
+
+    def __init__(self, occupied=()):
+        self.starts = []
+        self.counts = {}
+        self.loaded_at = time.monotonic()
+        for minute, count in occupied:
+            self.set(minute, count)
+
+    def occupied(self, minute):
+        # Búsqueda binaria: O(log n) en el número de franjas ocupadas del día
+        index = bisect_left(self.starts, minute)
+        if index < len(self.starts) and self.starts[index] == minute:
+            return self.counts[minute]
+        return 0
+
+    def set(self, minute, count):
+        if minute not in self.counts:
+            insort(self.starts, minute)
+        self.counts[minute] = count
+
+    def release(self, minute):
+        if self.occupied(minute) > 0:
+            self.counts[minute] -= 1
+
+    def free_slots(self, capacity):
+        free = []
+        for minute in range(OPENING_MINUTE, CLOSING_MINUTE - SLOT_MINUTES + 1, SLOT_MINUTES):
+            available = capacity - self.occupied(minute)
+            if available > 0:
+                free.append((minute, available))
+        return free
+
+
+class SlotCalendar:
+    """
+    Calendario en memoria por (servicio, día). Sirve para listar franjas libres y
+    para rechazar sin ir a la base de datos una reserva sobre una franja que ya
+    se sabe llena, mientras el día no supere `ttl`. La garantía contra dobles
+    reservas la da la actualización condicional atómica en MongoDB
+    (AppointmentCrud.reserve_slot). Guarda como mucho `max_days` días (LRU):
+    el servicio lo elige el cliente.
+    """
+
+    def __init__(self, loader, capacity=SLOT_CAPACITY, ttl=CALENDAR_TTL, max_days=CALENDAR_MAX_DAYS):
+        # loader(servicio, día) -> iterable de (minuto, ocupados)
+        self._loader = loader
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fresh(self, key):
+        """Día en memoria si no ha caducado (lo marca como usado), o None. Con el candado tomado."""
+        slots = self._days.get(key)
+        if slots is None:
+            return None
+        if time.monotonic() - slots.loaded_at > self.ttl:
+            del self._days[key]
+            return None
+        self._days.move_to_end(key)
+        return slots
+
+    def day(self, service, day):
+        key = (service, day)
+        with self._lock:
+            slots = self._fresh(key)
+        if slots is None:
+            slots = DaySlots(self._loader(service, day))
+            with self._lock:
+                self._days[key] = slots
+                self._days.move_to_end(key)
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+        return slots
+
+    def is_full(self, service, day, minute):
+        with self._lock:
+            slots = self._fresh((service, day))
+            return slots is not None and slots.occupied(minute) >= self.capacity
+
+    def record(self, service, day, minute, occupied):
+        with self._lock:
+            slots = self._days.get((service, day))
+            if slots is not None:
+                slots.set(minute, occupied)
+
+    def release(self, service, day, minute):
+        """Una plaza menos ocupada en la franja (cita cancelada o que no llegó a guardarse)."""
+        with self._lock:
+            slots = self._days.get((service, day))
+            if slots is not None:
+                slots.release(minute)
+
+    def free_slots(self, service, start_day, end_day):
+        """Franjas libres por día entre start_day y end_day (inclusive)."""
+        result = []
+        day = start_day
+        while day <= end_day:
+            slots = self.day(service, day)
+            result.append({
+                "fecha": day.isoformat(),
+                "franjas": [
+                    {"hora": f"{minute // 60:02d}:{minute % 60:02d}", "disponibles": available}
+                    for minute, available in slots.free_slots(self.capacity)
+                ],
+            })
+            day += timedelta(days=1)
+        return result
+
+
+def slot_start(day, minute):
+    return datetime(day.year, day.month, day.day) + timedelta(minutes=minute)
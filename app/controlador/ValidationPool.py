@@ -0,0 +1,165 @@
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import orjson
+
+from app.controlador.PatientValidator import PatientValidationError, PatientValidator, preload_models
+
+# Procesos de validación por worker (0: todo se valida en el propio worker).
+# La validación de fhir.resources es Python puro y retiene el GIL: en un
+# proceso aparte no bloquea las demás peticiones del worker. Por defecto los
+# núcleos se reparten entre los workers de gunicorn (WEB_CONCURRENCY, que fija
+# gunicorn.conf.py) para no lanzar núcleos x workers procesos.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+VALIDATION_PROCESSES = int(os.getenv(
+    "VALIDATION_PROCESSES", str(max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))),
+))
+# Por debajo de este tamaño (bytes JSON de todo el lote) se valida en línea:
+# el viaje al proceso cuesta más que validar un par de pacientes.
+VALIDATION_INLINE_MAX_BYTES = int(os.getenv("VALIDATION_INLINE_MAX_BYTES", "32768"))
+# Pacientes por tarea enviada a un proceso
+VALIDATION_TASK_SIZE = int(os.getenv("VALIDATION_TASK_SIZE", "100"))
+
+# Validador de cada proceso hijo (con su propia caché)
+_child_validator = None
+
+
+def _init_child():
+    global _child_validator
+    preload_models()
+    _child_validator = PatientValidator()
+
+
+def _validate_raw(raw_payloads):
+    """
+    En el proceso hijo. Recibe los pacientes como bytes JSON y devuelve, por
+    cada uno, (True, bytes JSON normalizado) o (False, mensaje de error): entre
+    procesos solo viajan bytes, nunca modelos de fhir.resources.
+    """
+    results = []
+    for raw in raw_payloads:
+        try:
+            results.append((True, orjson.dumps(_child_validator.validate(orjson.loads(raw)))))
+        except orjson.JSONDecodeError as e:
+            results.append((False, f"JSON inválido: {e}"))
+        except PatientValidationError as e:
+            results.append((False, str(e)))
+    return results
+
+
+class ValidationPool:
+    """
+    Valida pacientes en un pool de procesos del worker. Los lotes pequeños se
+    validan en línea con `validator` (y su caché); los grandes se reparten
+    entre los procesos en tareas de VALIDATION_TASK_SIZE pacientes.
+
+    Los procesos se crean en el primer uso, con forkserver: el worker ya tiene
+    hilos y no es seguro hacer fork de él directamente. Si el pool falla (un
+    proceso muere, un lote no se puede enviar) se descarta, el lote se valida
+    en línea y el siguiente lote crea un pool nuevo.
+    """
+
+    def __init__(self, validator, processes=VALIDATION_PROCESSES, inline_max_bytes=VALIDATION_INLINE_MAX_BYTES,
+                 task_size=VALIDATION_TASK_SIZE):
+        self.validator = validator
+        self.processes = processes
+        self.inline_max_bytes = inline_max_bytes
+        self.task_size = task_size
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # Los contadores los actualizan a la vez los hilos de AsyncCrud
+        self._stats_lock = threading.Lock()
+        self.inline = 0
+        self.pooled = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                if "forkserver" in methods:
+                    # El servidor importa fhir.resources una vez; los procesos lo heredan
+                    context.set_forkserver_preload(["app.controlador.PatientValidator", "fhir.resources.patient"])
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=context, initializer=_init_child,
+                )
+                self._executor_pid = os.getpid()
+        return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def validate(self, payload):
+        """Un paciente (dict o bytes JSON): el dict normalizado o PatientValidationError."""
+        result = self.validate_many([payload])[0]
+        if isinstance(result, PatientValidationError):
+            raise result
+        return result
+
+    def validate_many(self, payloads):
+        """
+        Valida una lista de pacientes (dict o bytes JSON). Retorna, en el mismo
+        orden, el dict normalizado o la PatientValidationError de cada uno.
+        """
+        if not payloads:
+            return []
+        raws = [payload if isinstance(payload, (bytes, bytearray)) else None for payload in payloads]
+        if self.processes > 0:
+            try:
+                raws = [raw if raw is not None else orjson.dumps(payload) for raw, payload in zip(raws, payloads)]
+            except TypeError:
+                # Algún payload no es JSON (p. ej. fechas ya convertidas): se valida en línea
+                pass
+            else:
+                if sum(len(raw) for raw in raws) >= self.inline_max_bytes:
+                    return self._validate_pooled(raws)
+        return [self._validate_inline(payload) for payload in payloads]
+
+    def _validate_inline(self, payload):
+        with self._stats_lock:
+            self.inline += 1
+        try:
+            if isinstance(payload, (bytes, bytearray)):
+                try:
+                    payload = orjson.loads(payload)
+                except orjson.JSONDecodeError as e:
+                    raise PatientValidationError(f"JSON inválido: {e}") from e
+            return self.validator.validate(payload)
+        except PatientValidationError as e:
+            return e
+
+    def _validate_pooled(self, raws):
+        size = max(1, min(self.task_size, math.ceil(len(raws) / self.processes)))
+        tasks = [raws[start:start + size] for start in range(0, len(raws), size)]
+        executor = self._get_executor()
+        try:
+            # BrokenProcessPool si muere un proceso; cualquier otro error, al enviar o recibir un lote
+            pooled = list(executor.map(_validate_raw, tasks))
+        except Exception as e:
+            print(f"Error en el pool de validación, se valida en el worker: {e!r}")
+            self._discard(executor)
+            return [self._validate_inline(raw) for raw in raws]
+        with self._stats_lock:
+            self.pooled += len(raws)
+        results = []
+        for task_results in pooled:
+            for ok, value in task_results:
+                results.append(orjson.loads(value) if ok else PatientValidationError(value))
+        return results
+
+    def stats(self):
+        with self._stats_lock:
+            return {"processes": self.processes, "inline": self.inline, "pooled": self.pooled}
@@ -0,0 +1,101 @@
+import asyncio
+import os
+
+# Cola de escrituras opcional para POST /api/patients y /api/appointments:
+# agrupa las altas que llegan casi a la vez en una sola escritura a MongoDB.
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE_ENABLED", "0") == "1"
+# Documentos por escritura; al llegar a este número se escribe sin esperar
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+# Espera máxima (ms) del primer documento de un lote antes de escribirlo
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "5"))
+# Documentos en cola o escribiéndose por worker; por encima se rechazan (503)
+WRITE_QUEUE_MAX_PENDING = int(os.getenv("WRITE_QUEUE_MAX_PENDING", "2000"))
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class WriteQueue:
+    """
+    Agrupa escrituras individuales en lotes. Cada `submit` espera el resultado
+    de su propio documento; el lote se escribe cuando reúne `max_batch`
+    documentos o cuando el primero lleva `max_delay_ms` esperando.
+
+    `write_batch` es una corrutina que recibe la lista de documentos y retorna
+    un resultado (status, id|error) por documento, en el mismo orden (p. ej.
+    PatientCrud.bulk_create_patients a través de AsyncCrud).
+
+    Vive en el event loop del worker: no necesita locks. Si la petición que
+    espera se cancela, su documento se escribe igualmente.
+    """
+
+    def __init__(self, write_batch, max_batch=WRITE_BATCH_SIZE, max_delay_ms=WRITE_BATCH_DELAY_MS,
+                 max_pending=WRITE_QUEUE_MAX_PENDING):
+        self._write_batch = write_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.max_pending = max_pending
+        self._buffer = []
+        self._timer = None
+        self._flushes = set()
+        self._closed = False
+        self.pending = 0
+        self.batches = 0
+        self.written = 0
+        self.rejected = 0
+
+    async def submit(self, item):
+        if self._closed or self.pending >= self.max_pending:
+            self.rejected += 1
+            raise WriteQueueFull("Demasiadas escrituras pendientes; reintente en unos segundos.")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._buffer.append((item, future))
+        self.pending += 1
+        if len(self._buffer) >= self.max_batch:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try:
+            outcomes = await self._write_batch([item for item, _ in batch])
+        except Exception as e:
+            print(f"Error escribiendo un lote de la cola: {e}")
+            outcomes = [("error", str(e))] * len(batch)
+        finally:
+            self.pending -= len(batch)
+        self.batches += 1
+        self.written += len(batch)
+        for (_, future), outcome in zip(batch, outcomes):
+            if not future.done():
+                future.set_result(outcome)
+
+    async def close(self):
+        """Deja de aceptar escrituras y espera a que se escriba todo lo pendiente."""
+        self._closed = True
+        self._flush_now()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "batches": self.batches,
+            "written": self.written,
+            "avgBatchSize": round(self.written / self.batches, 2) if self.batches else 0.0,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,292 @@
+import asyncio
+import collections
+import math
+import multiprocessing
+import os
+import time
+import zlib
+
+from starlette.datastructures import Headers
+
+from app.controlador import bundles
+from app.controlador.AsyncCrud import DB_THREADS
+from app.controlador.metricas import registry
+from app.controlador.serializacion import FHIRJSONResponse
+
+# Control de admisión delante de las rutas /api: un límite de concurrencia por
+# grupo de rutas en cada worker (con una cola corta y acotada) y una cubeta de
+# tokens por cliente compartida entre los workers. Lo que no cabe se rechaza
+# enseguida (503 o 429 con Retry-After) en vez de esperar al timeout de gunicorn.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Peticiones simultáneas por worker. Las lecturas usan como mucho un hilo de
+# AsyncCrud (y una conexión del pool) cada una; las escrituras y los lotes dejan
+# hilos libres para las lecturas.
+ADMISSION_READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", str(DB_THREADS)))
+ADMISSION_WRITE_LIMIT = int(os.getenv("ADMISSION_WRITE_LIMIT", str(max(1, DB_THREADS // 2))))
+ADMISSION_BULK_LIMIT = int(os.getenv("ADMISSION_BULK_LIMIT", "2"))
+# Peticiones en espera por grupo (múltiplo del límite) y espera máxima en la cola (ms)
+ADMISSION_QUEUE_FACTOR = float(os.getenv("ADMISSION_QUEUE_FACTOR", "2"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "2000"))
+# Cubeta de tokens por cliente: peticiones por segundo sostenidas y ráfaga máxima
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "50"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "100"))
+# Huecos de la tabla compartida; dos clientes que caen en el mismo hueco comparten cubeta
+RATE_LIMIT_SLOTS = int(os.getenv("RATE_LIMIT_SLOTS", "4096"))
+# Detrás de Render u otro proxy todas las peticiones llegan desde su IP: con
+# TRUST_FORWARDED_FOR=1 se identifica al cliente por X-Forwarded-For. Cada proxy
+# de confianza añade a la derecha la IP de la que recibió la petición, así que
+# se toma la que añadió el más externo de los TRUSTED_PROXY_HOPS; lo que haya a
+# su izquierda lo escribe el cliente y no sirve para identificarlo.
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+_LOCK_STRIPES = 64
+# Si un worker muere dentro de la sección crítica su candado queda tomado: los
+# demás no esperan más de esto y dejan pasar la petición sin limitarla.
+_LOCK_TIMEOUT = 0.05
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def route_group(method, path):
+    """Grupo de límites de una petición, o None si no se limita (/, /metrics, /internal)."""
+    if path != "/api" and not path.startswith("/api/"):
+        return None
+    # Las suscripciones a eventos duran horas y no consultan la base de datos:
+    # ocuparían un hueco de lectura todo ese tiempo (EventBus tiene su propio límite)
+    if path == "/api/events" or path.startswith("/api/events/"):
+        return None
+    if method == "POST" and (path == "/api" or path.endswith("/$import")):
+        return "bulk"
+    # $match solo consulta, aunque el paciente a comparar vaya en el cuerpo de un POST
+    if method == "POST" and path.endswith("/$match"):
+        return "read"
+    if method in ("POST", "PUT", "PATCH", "DELETE"):
+        return "write"
+    return "read"
+
+
+def client_key(scope):
+    """
+    IP del cliente: con TRUST_FORWARDED_FOR, la de X-Forwarded-For que añadió
+    el proxy de confianza más externo (TRUSTED_PROXY_HOPS desde la derecha); si
+    no la hay, la de la conexión.
+    """
+    if TRUST_FORWARDED_FOR and TRUSTED_PROXY_HOPS > 0:
+        forwarded = [address.strip() for address in ",".join(Headers(scope=scope).getlist("x-forwarded-for")).split(",")]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS and forwarded[-TRUSTED_PROXY_HOPS]:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    client = scope.get("client")
+    return client[0] if client else "desconocido"
+
+
+class SharedTokenBuckets:
+    """
+    Cubetas de tokens por cliente en memoria compartida (mmap anónimo). Se crean
+    al importar el módulo, en el maestro de gunicorn (preload_app), y los workers
+    las heredan con el fork: el límite por cliente es el mismo para los cuatro.
+    Sin preload_app cada worker tendría sus propias cubetas.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, slots=RATE_LIMIT_SLOTS):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        # Por hueco: tokens disponibles e instante (time.monotonic, común a todo el sistema) del último cálculo
+        self._state = multiprocessing.RawArray("d", slots * 2)
+        self._locks = [multiprocessing.Lock() for _ in range(_LOCK_STRIPES)]
+
+    def take(self, client):
+        """
+        Consume un token del cliente. Retorna 0 si la petición pasa o los
+        segundos que faltan para el siguiente token.
+        """
+        if self.rate <= 0:
+            return 0.0
+        slot = zlib.crc32(client.encode()) % self.slots
+        lock = self._locks[slot % _LOCK_STRIPES]
+        if not lock.acquire(timeout=_LOCK_TIMEOUT):
+            print(f"Control de admisión: candado de cubetas ocupado, petición de {client} sin limitar")
+            return 0.0
+        try:
+            now = time.monotonic()
+            tokens, last = self._state[2 * slot], self._state[2 * slot + 1]
+            tokens = self.burst if last == 0 else min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._state[2 * slot] = tokens
+            self._state[2 * slot + 1] = now
+            return wait
+        finally:
+            lock.release()
+
+
+class ConcurrencyLimit:
+    """
+    Límite de peticiones simultáneas de un grupo de rutas en este worker, con
+    una cola FIFO acotada. Una petición se rechaza sin esperar si la cola está
+    llena o si la espera estimada (posición en la cola por el tiempo medio de
+    servicio) ya supera `queue_timeout`; si espera y no entra a tiempo, también.
+    """
+
+    def __init__(self, limit, max_queue, queue_timeout):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Media móvil del tiempo de servicio (segundos), para estimar la espera
+        self.service_time = 0.0
+        self._waiters = collections.deque()
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise AdmissionRejected(503, reason, max(1, math.ceil(self.queue_timeout)))
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._reject("cola llena")
+        if (len(self._waiters) + 1) / self.limit * self.service_time > self.queue_timeout:
+            self._reject("espera estimada demasiado larga")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        expire = loop.call_later(
+            self.queue_timeout, lambda: waiter.done() or waiter.set_exception(asyncio.TimeoutError())
+        )
+        try:
+            await waiter
+        except asyncio.TimeoutError:
+            self._reject("tiempo de espera agotado")
+        except asyncio.CancelledError:
+            # El cliente se fue; si release() ya nos había pasado el hueco, se devuelve
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release(None)
+            raise
+        finally:
+            expire.cancel()
+            if not waiter.done() or waiter.cancelled() or waiter.exception() is not None:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        self.admitted += 1
+
+    def release(self, elapsed):
+        if elapsed is not None:
+            self.service_time = elapsed if self.service_time == 0 else 0.9 * self.service_time + 0.1 * elapsed
+        # El hueco pasa directamente al primero de la cola que siga esperando
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "maxQueue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "serviceTimeMs": round(self.service_time * 1000, 2),
+        }
+
+
+def default_limits():
+    timeout = ADMISSION_QUEUE_TIMEOUT_MS / 1000
+    return {
+        group: ConcurrencyLimit(limit, max(1, int(limit * ADMISSION_QUEUE_FACTOR)), timeout)
+        for group, limit in (
+            ("read", ADMISSION_READ_LIMIT),
+            ("write", ADMISSION_WRITE_LIMIT),
+            ("bulk", ADMISSION_BULK_LIMIT),
+        )
+    }
+
+
+class AdmissionControl:
+    """Estado del control de admisión: cubetas compartidas y límites de este worker."""
+
+    def __init__(self, buckets=None, limits=None):
+        self.buckets = buckets or SharedTokenBuckets()
+        # Los límites son por worker: se crean en el primer uso, ya después del fork
+        self._limits = limits
+        self.rate_limited = 0
+
+    @property
+    def limits(self):
+        if self._limits is None:
+            self._limits = default_limits()
+        return self._limits
+
+    async def admit(self, group, client):
+        """Retorna el ConcurrencyLimit ocupado o lanza AdmissionRejected."""
+        wait = self.buckets.take(client)
+        if wait > 0:
+            self.rate_limited += 1
+            raise AdmissionRejected(429, "límite de peticiones del cliente", max(1, math.ceil(wait)))
+        limit = self.limits[group]
+        await limit.acquire()
+        return limit
+
+    def stats(self):
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "rateLimit": {"rps": self.buckets.rate, "burst": self.buckets.burst, "rejected": self.rate_limited},
+            "groups": {group: limit.stats() for group, limit in self.limits.items()},
+        }
+
+
+admission = AdmissionControl()
+
+
+class AdmissionMiddleware:
+    """
+    Aplica el control de admisión a las rutas /api. Las peticiones rechazadas
+    reciben un OperationOutcome con 429 (límite del cliente) o 503 (worker
+    saturado) y Retry-After, y se cuentan en lis_admission_rejected_total.
+    """
+
+    def __init__(self, app, control=None):
+        self.app = app
+        self.control = control or admission
+
+    async def __call__(self, scope, receive, send):
+        group = route_group(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if group is None or not ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        try:
+            limit = await self.control.admit(group, client_key(scope))
+        except AdmissionRejected as e:
+            registry.inc("lis_admission_rejected_total", {"group": group, "status": str(e.status_code)})
+            response = FHIRJSONResponse(
+                bundles.operation_outcome(f"Petición rechazada: {e.reason}", code="throttled"),
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release(time.perf_counter() - start)
@@ -0,0 +1,166 @@
+import os
+
+from app.controlador.serializacion import dumps
+
+# Tamaño de lote del cursor de Mongo al exportar en streaming: acota la memoria
+# usada por petición independientemente del tamaño de la colección.
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Cache-Control de los listados: el navegador guarda la respuesta pero la
+# revalida (If-None-Match/If-Modified-Since) pasados LIST_CACHE_MAX_AGE segundos.
+# Son datos de pacientes: nunca en cachés compartidas.
+LIST_CACHE_MAX_AGE = int(os.getenv("LIST_CACHE_MAX_AGE", "0"))
+LIST_CACHE_CONTROL = f"private, max-age={LIST_CACHE_MAX_AGE}" if LIST_CACHE_MAX_AGE else "private, no-cache"
+# Los recursos serializados se agrupan en bloques de este tamaño antes de
+# enviarlos, en lugar de un envío por recurso.
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", "65536"))
+
+MATCH_GRADE_EXTENSION = "http://hl7.org/fhir/StructureDefinition/match-grade"
+
+
+def searchset_bundle(resources, self_url, next_url=None):
+    """Construye un Bundle FHIR de tipo searchset para una página de resultados."""
+    links = [{"relation": "self", "url": self_url}]
+    if next_url:
+        links.append({"relation": "next", "url": next_url})
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "link": links,
+        "entry": [{"resource": resource} for resource in resources],
+    }
+
+
+def match_bundle(matches, self_url):
+    """
+    Resultado de Patient/$match: un searchset con la puntuación (search.score)
+    y el grado de coincidencia (certain, probable, possible) de cada paciente.
+    `matches` son tuplas (recurso, puntuación, grado) de mayor a menor puntuación.
+    """
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(matches),
+        "link": [{"relation": "self", "url": self_url}],
+        "entry": [
+            {
+                "fullUrl": f"Patient/{resource['id']}",
+                "resource": resource,
+                "search": {
+                    "mode": "match",
+                    "score": round(score, 4),
+                    "extension": [{"url": MATCH_GRADE_EXTENSION, "valueCode": grade}],
+                },
+            }
+            for resource, score, grade in matches
+        ],
+    }
+
+
+def history_bundle(versions, self_url, next_url=None, resource_type="Patient"):
+    """
+    Bundle FHIR de tipo history. `versions` son pares (entrada del historial,
+    recurso) de la versión más reciente a la más antigua.
+    """
+    links = [{"relation": "self", "url": self_url}]
+    if next_url:
+        links.append({"relation": "next", "url": next_url})
+    entries = []
+    for entry, resource in versions:
+        resource_id, version = resource["id"], entry["version"]
+        created = entry["metodo"] == "POST"
+        entries.append({
+            "fullUrl": f"{resource_type}/{resource_id}/_history/{version}",
+            "resource": resource,
+            "request": {
+                "method": entry["metodo"],
+                "url": resource_type if created else f"{resource_type}/{resource_id}",
+            },
+            "response": {
+                "status": "201 Created" if created else "200 OK",
+                "etag": f'W/"{version}"',
+                "lastModified": entry.get("lastUpdated"),
+            },
+        })
+    return {"resourceType": "Bundle", "type": "history", "link": links, "entry": entries}
+
+
+def notification_bundle(event_number, topic, method, resource_type, resource_id, resource, timestamp):
+    """
+    Notificación de un cambio al estilo de las Subscription de FHIR (Bundle
+    subscription-notification): un SubscriptionStatus con el evento y, si se
+    tiene, el recurso tal como quedó. `method` es POST, PUT o DELETE.
+    """
+    reference = f"{resource_type}/{resource_id}"
+    entries = [{
+        "resource": {
+            "resourceType": "SubscriptionStatus",
+            "status": "active",
+            "type": "event-notification",
+            "topic": topic,
+            "notificationEvent": [{"eventNumber": event_number, "timestamp": timestamp, "focus": {"reference": reference}}],
+        },
+    }]
+    entry = {"fullUrl": reference, "request": {"method": method, "url": resource_type if method == "POST" else reference}}
+    if resource is not None:
+        entry["resource"] = resource
+    entries.append(entry)
+    return {"resourceType": "Bundle", "type": "subscription-notification", "timestamp": timestamp, "entry": entries}
+
+
+def _chunked(parts):
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def stream_ndjson(resources):
+    """Genera NDJSON (una línea por recurso) a medida que llegan del cursor."""
+    return _chunked(dumps(resource) + b"\n" for resource in resources)
+
+
+def _bundle_parts(resources):
+    yield b'{"resourceType":"Bundle","type":"searchset","entry":['
+    first = True
+    for resource in resources:
+        prefix = b"" if first else b","
+        first = False
+        yield prefix + b'{"resource":' + dumps(resource) + b"}"
+    yield b"]}"
+
+
+def stream_bundle(resources):
+    """Genera un Bundle searchset por partes, sin materializar la lista de entradas."""
+    return _chunked(_bundle_parts(resources))
+
+
+def operation_outcome(message, code="invalid", severity="error"):
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": severity, "code": code, "diagnostics": message}],
+    }
+
+
+_STATUS_LINES = {
+    "success": "201 Created",
+    "invalid": "422 Unprocessable Entity",
+    "unsupported": "400 Bad Request",
+    "conflict": "409 Conflict",
+    "duplicate": "409 Conflict",
+    "error": "500 Internal Server Error",
+}
+
+
+def response_entry(status, value, resource_type="Patient"):
+    """Entrada de un Bundle batch-response/transaction-response para un resultado (status, id|error)."""
+    if status == "success":
+        return {"response": {"status": _STATUS_LINES[status], "location": f"{resource_type}/{value}"}}
+    code = {"invalid": "processing", "conflict": "conflict", "duplicate": "duplicate"}.get(status, "exception")
+    return {"response": {"status": _STATUS_LINES[status], "outcome": operation_outcome(value, code=code)}}
@@ -0,0 +1,180 @@
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.controlador.metricas import timer
+
+# brotli y zstandard son opcionales: sin ellos solo se ofrece gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Respuestas más pequeñas (bytes) se envían sin comprimir; las respuestas en
+# streaming se comprimen siempre, su tamaño no se conoce de antemano.
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+# Orden de preferencia del servidor cuando el cliente acepta varias con la misma q
+COMPRESSION_ENCODINGS = [
+    encoding.strip() for encoding in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if encoding.strip()
+]
+# Niveles pensados para comprimir en cada petición, no para ficheros estáticos
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/fhir+json", "application/fhir+ndjson",
+                      "application/ndjson", "text/")
+
+
+class _GzipEncoder:
+    def __init__(self):
+        # wbits 31: formato gzip (cabecera y CRC), no deflate crudo
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, final):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data, final):
+        output = self._compressor.process(data)
+        return output + (self._compressor.finish() if final else self._compressor.flush())
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data, final):
+        output = self._compressor.compress(data)
+        if final:
+            return output + self._compressor.flush()
+        return output + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+ENCODERS = {"gzip": _GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+if zstandard is not None:
+    ENCODERS["zstd"] = _ZstdEncoder
+
+
+def negotiate(accept_encoding, encodings=None):
+    """
+    Codificación a usar según Accept-Encoding (con valores q), o None para
+    enviar sin comprimir. A igual q decide el orden de `encodings`.
+    """
+    if not accept_encoding:
+        return None
+    encodings = [e for e in (encodings or COMPRESSION_ENCODINGS) if e in ENCODERS]
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressible(message):
+    if message["status"] < 200 or message["status"] in (204, 304):
+        return False
+    headers = Headers(raw=message["headers"])
+    if "content-encoding" in headers or "no-transform" in headers.get("cache-control", ""):
+        return False
+    return headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+
+def _varies(message):
+    """
+    ¿Puede cambiar la respuesta con Accept-Encoding? Las comprimibles, aunque
+    esta vez salgan sin comprimir (pequeñas, sin Accept-Encoding, HEAD), y los
+    304, que deben llevar el mismo Vary que la respuesta completa.
+    """
+    return message["status"] == 304 or _compressible(message)
+
+
+class CompressionMiddleware:
+    """
+    Comprime las respuestas JSON/NDJSON con la codificación negociada (zstd, br
+    o gzip). Las respuestas completas por debajo de `minimum_size` salen sin
+    comprimir. Las respuestas en streaming se comprimen bloque a bloque, sin
+    acumular el cuerpo: cada bloque se vacía del compresor al enviarlo.
+    Las que ya traen Content-Encoding (ficheros de $export) pasan tal cual.
+    Todas las que dependen de Accept-Encoding llevan Vary, para que una caché
+    intermedia no sirva la versión comprimida a quien no la acepta o al revés.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # HEAD no tiene cuerpo que comprimir, pero lleva el mismo Vary que el GET
+        encoding = None if scope["method"] == "HEAD" else negotiate(Headers(scope=scope).get("accept-encoding"))
+
+        start_message = None
+        encoder = None
+        passthrough = encoding is None
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough
+            if message["type"] == "http.response.start":
+                if _varies(message):
+                    MutableHeaders(scope=message).add_vary_header("Accept-Encoding")
+                if passthrough:
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if encoder is None:
+                start, start_message = start_message, None
+                if not _compressible(start) or (not more_body and len(body) < self.minimum_size):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = ENCODERS[encoding]()
+                headers = MutableHeaders(raw=start["headers"])
+                del headers["content-length"]
+                headers["content-encoding"] = encoding
+                with timer("compression"):
+                    data = encoder.compress(body, final=not more_body)
+                if not more_body:
+                    headers["content-length"] = str(len(data))
+                await send(start)
+                await send({"type": "http.response.body", "body": data, "more_body": more_body})
+                return
+
+            with timer("compression"):
+                data = encoder.compress(body, final=not more_body)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
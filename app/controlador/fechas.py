@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+
+def now_instant():
+    """Instante FHIR actual en UTC con precisión de milisegundos (p. ej. 2025-01-31T10:15:00.123Z).
+
+    Todos los `meta.lastUpdated` se guardan con este formato fijo, así que las
+    comparaciones de texto en MongoDB equivalen a comparaciones de fecha.
+    """
+    return format_instant(datetime.now(timezone.utc))
+
+
+def format_instant(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def parse_instant(text):
+    """Convierte un instante ISO 8601 (acepta sufijo Z) a datetime con zona horaria UTC."""
+    value = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def http_date(instant):
+    """Instante FHIR (meta.lastUpdated) en formato de fecha HTTP, para Last-Modified."""
+    return format_datetime(parse_instant(instant), usegmt=True)
+
+
+def not_modified_since(instant, if_modified_since):
+    """True si `instant` no es posterior a la fecha HTTP de If-Modified-Since (con precisión de segundos)."""
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parse_instant(instant).replace(microsecond=0) <= since
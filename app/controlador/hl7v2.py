@@ -0,0 +1,348 @@
+import codecs
+import os
+from datetime import datetime
+
+# Codificación de los mensajes HL7 v2 recibidos (MSH-18 casi nunca viene informado)
+HL7_ENCODING = os.getenv("HL7_ENCODING", "utf-8")
+HL7_VERSION = "2.5.1"
+
+# Segmentos de lote (FHS/BHS ... BTS/FTS): delimitan, no pertenecen a ningún mensaje
+BATCH_SEGMENTS = frozenset(("FHS", "BHS", "BTS", "FTS"))
+
+
+class HL7ParseError(ValueError):
+    pass
+
+
+class Delimiters:
+    """Separadores de un mensaje: MSH-1 y los cuatro caracteres de MSH-2."""
+
+    __slots__ = ("field", "component", "repetition", "escape", "subcomponent")
+
+    def __init__(self, field="|", encoding="^~\\&"):
+        if len(encoding) < 4:
+            encoding = encoding + "^~\\&"[len(encoding):]
+        self.field = field
+        self.component, self.repetition, self.escape, self.subcomponent = encoding[:4]
+
+    @property
+    def encoding_characters(self):
+        return self.component + self.repetition + self.escape + self.subcomponent
+
+
+DEFAULT_DELIMITERS = Delimiters()
+# Casi todos los emisores usan los mismos separadores: se reutiliza el objeto
+_delimiters_cache = {("|", "^~\\&"): DEFAULT_DELIMITERS}
+
+
+def _delimiters(field, encoding):
+    delimiters = _delimiters_cache.get((field, encoding))
+    if delimiters is None:
+        delimiters = _delimiters_cache[(field, encoding)] = Delimiters(field, encoding)
+    return delimiters
+
+
+def _escape_sequence(sequence, delimiters):
+    if sequence == "F":
+        return delimiters.field
+    if sequence == "S":
+        return delimiters.component
+    if sequence == "T":
+        return delimiters.subcomponent
+    if sequence == "R":
+        return delimiters.repetition
+    if sequence == "E":
+        return delimiters.escape
+    if sequence == ".br":
+        return "\n"
+    if sequence in ("H", "N"):
+        # Resaltado de texto: sin equivalente en FHIR
+        return ""
+    if sequence[:1] == "X" and len(sequence) % 2 == 1:
+        try:
+            return bytes.fromhex(sequence[1:]).decode(HL7_ENCODING, errors="replace")
+        except ValueError:
+            pass
+    # Secuencia desconocida: se conserva tal cual
+    return delimiters.escape + sequence + delimiters.escape
+
+
+def unescape(value, delimiters=DEFAULT_DELIMITERS):
+    """Resuelve las secuencias de escape (\\F\\, \\S\\, \\T\\, \\R\\, \\E\\, \\Xhh\\, \\.br\\)."""
+    escape = delimiters.escape
+    if escape not in value:
+        return value
+    parts = value.split(escape)
+    if len(parts) % 2 == 0:
+        # Escape sin cerrar: el valor no está bien escapado, se deja como llegó
+        return value
+    for i in range(1, len(parts), 2):
+        parts[i] = _escape_sequence(parts[i], delimiters)
+    return "".join(parts)
+
+
+def escape(value, delimiters=DEFAULT_DELIMITERS):
+    """Inverso de unescape para los separadores, al construir mensajes."""
+    d = delimiters
+    value = value.replace(d.escape, f"{d.escape}E{d.escape}")
+    for char, code in ((d.field, "F"), (d.component, "S"), (d.subcomponent, "T"), (d.repetition, "R")):
+        value = value.replace(char, f"{d.escape}{code}{d.escape}")
+    return value.replace("\r", f"{d.escape}.br{d.escape}").replace("\n", f"{d.escape}.br{d.escape}")
+
+
+class Segment:
+    """
+    Un segmento, partido solo por campos. Componentes, subcomponentes y
+    repeticiones se separan al leer cada valor: la mayoría de campos de un
+    mensaje no se usan nunca. `fields[n]` es el campo n (fields[0] es el
+    nombre); en MSH, fields[1] es el separador de campos, como en la norma.
+    """
+
+    __slots__ = ("name", "fields", "delimiters")
+
+    def __init__(self, fields, delimiters):
+        self.name = fields[0]
+        self.fields = fields
+        self.delimiters = delimiters
+
+    def raw(self, n):
+        return self.fields[n] if n < len(self.fields) else ""
+
+    def repetition_count(self, n):
+        raw = self.raw(n)
+        return raw.count(self.delimiters.repetition) + 1 if raw else 0
+
+    def get(self, n, component=1, subcomponent=1, repetition=0):
+        """Valor (sin escapes) de un campo, componente y subcomponente; "" si no viene."""
+        raw = self.raw(n)
+        if not raw:
+            return ""
+        if self.name == "MSH" and n <= 2:
+            return raw
+        d = self.delimiters
+        if d.repetition in raw:
+            repetitions = raw.split(d.repetition)
+            raw = repetitions[repetition] if repetition < len(repetitions) else ""
+        elif repetition:
+            return ""
+        if d.component in raw:
+            components = raw.split(d.component)
+            raw = components[component - 1] if component <= len(components) else ""
+        elif component > 1:
+            return ""
+        if d.subcomponent in raw:
+            subcomponents = raw.split(d.subcomponent)
+            raw = subcomponents[subcomponent - 1] if subcomponent <= len(subcomponents) else ""
+        elif subcomponent > 1:
+            return ""
+        return unescape(raw, d) if d.escape in raw else raw
+
+    def repetitions(self, n):
+        """
+        Componentes (sin escapes) de cada repetición del campo n: una lista de
+        listas. Para leer varios componentes de un campo sin partirlo en cada
+        get; los subcomponentes quedan unidos por su separador.
+        """
+        raw = self.raw(n)
+        if not raw:
+            return []
+        d = self.delimiters
+        result = []
+        for repetition in raw.split(d.repetition) if d.repetition in raw else (raw,):
+            components = repetition.split(d.component)
+            if d.escape in repetition:
+                components = [unescape(component, d) for component in components]
+            result.append(components)
+        return result
+
+
+def component(components, n):
+    """Componente n (desde 1) de una lista de Segment.repetitions, o ""."""
+    return components[n - 1] if n <= len(components) else ""
+
+
+class Message:
+    __slots__ = ("segments", "delimiters")
+
+    def __init__(self, segments, delimiters):
+        self.segments = segments
+        self.delimiters = delimiters
+
+    @property
+    def header(self):
+        return self.segments[0]
+
+    def segment(self, name):
+        """Primer segmento con ese nombre, o None."""
+        for segment in self.segments:
+            if segment.name == name:
+                return segment
+        return None
+
+    def all(self, name):
+        return [segment for segment in self.segments if segment.name == name]
+
+    @property
+    def message_type(self):
+        """(MSH-9.1, MSH-9.2), p. ej. ("ADT", "A04")."""
+        return self.header.get(9, 1), self.header.get(9, 2)
+
+    @property
+    def control_id(self):
+        return self.header.get(10)
+
+    def __str__(self):
+        d = self.delimiters
+        lines = []
+        for segment in self.segments:
+            fields = segment.fields
+            if segment.name == "MSH":
+                fields = fields[:1] + fields[2:]
+            lines.append(d.field.join(fields))
+        return "\r".join(lines) + "\r"
+
+
+def parse_segments(lines):
+    """Mensaje a partir de sus líneas de segmento, la primera MSH."""
+    header = lines[0] if lines else ""
+    if not header.startswith("MSH") or len(header) < 8:
+        raise HL7ParseError("El mensaje no empieza por un segmento MSH")
+    field = header[3]
+    end = header.find(field, 4)
+    delimiters = _delimiters(field, header[4:end if end != -1 else len(header)])
+    segments = []
+    for line in lines:
+        fields = line.split(field)
+        if fields[0] == "MSH":
+            fields.insert(1, field)
+        segments.append(Segment(fields, delimiters))
+    return Message(segments, delimiters)
+
+
+def parse_message(text):
+    """Un único mensaje en texto (segmentos separados por \\r, \\n o \\r\\n)."""
+    if "\n" in text:
+        text = text.replace("\r\n", "\r").replace("\n", "\r")
+    return parse_segments([line for line in text.split("\r") if line])
+
+
+def iter_messages(chunks, encoding=HL7_ENCODING):
+    """
+    Mensajes de un flujo de texto o bytes (un fichero, un lote con FHS/BHS, la
+    carga de una trama MLLP) leído por trozos: cada mensaje se entrega en cuanto
+    empieza el siguiente, sin tener el flujo entero en memoria. Un mensaje que
+    no se puede interpretar se entrega como HL7ParseError en su lugar.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    buffer = ""
+    current = []
+
+    def finish():
+        try:
+            return parse_segments(current)
+        except HL7ParseError as e:
+            return e
+
+    for chunk in chunks:
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = decoder.decode(chunk)
+        buffer += chunk
+        if "\n" in buffer:
+            buffer = buffer.replace("\r\n", "\r").replace("\n", "\r")
+        lines = buffer.split("\r")
+        buffer = lines.pop()
+        for line in lines:
+            if not line:
+                continue
+            name = line[:3]
+            if name == "MSH" or name in BATCH_SEGMENTS:
+                if current:
+                    yield finish()
+                current = []
+                if name != "MSH":
+                    continue
+            current.append(line)
+    buffer += decoder.decode(b"", final=True)
+    if buffer and buffer[:3] not in BATCH_SEGMENTS:
+        current.append(buffer)
+    if current:
+        yield finish()
+
+
+def parse_timestamp(value):
+    """TS/DTM de HL7 (YYYY[MM[DD[HH[MM[SS[.S]]]]]][+/-ZZZZ]) como datetime sin zona, o None."""
+    if not value:
+        return None
+    for sign in ("+", "-"):
+        position = value.find(sign, 4)
+        if position != -1:
+            # La hora local del emisor es la que se muestra en la agenda
+            value = value[:position]
+            break
+    digits, _, fraction = value.partition(".")
+    if not digits.isdigit() or len(digits) < 4 or len(digits) % 2:
+        return None
+    try:
+        return datetime(
+            int(digits[0:4]), int(digits[4:6] or 1), int(digits[6:8] or 1),
+            int(digits[8:10] or 0), int(digits[10:12] or 0), int(digits[12:14] or 0),
+            int((fraction + "000000")[:6]) if fraction.isdigit() else 0,
+        )
+    except ValueError:
+        return None
+
+
+def fhir_date(value):
+    """Fecha HL7 (YYYY[MM[DD]]...) como date de FHIR (YYYY, YYYY-MM o YYYY-MM-DD), o None."""
+    digits = value[:8]
+    if not digits.isdigit() or len(digits) not in (4, 6, 8):
+        return None
+    if parse_timestamp(digits) is None:
+        return None
+    return "-".join(digits[i:i + size] for i, size in ((0, 4), (4, 2), (6, 2)) if digits[i:i + size])
+
+
+def format_timestamp(moment):
+    return moment.strftime("%Y%m%d%H%M%S")
+
+
+def build_segment(fields, delimiters=DEFAULT_DELIMITERS):
+    """Segmento en texto a partir de sus campos (fields[0] es el nombre), ya escapados."""
+    if fields[0] in ("MSH", "BHS", "FHS"):
+        fields = [fields[0] + delimiters.field + delimiters.encoding_characters] + list(fields[1:])
+    return delimiters.field.join(fields)
+
+
+def acknowledgement(message, code, text="", control_id=None, now=None):
+    """
+    ACK de modo original para `message` (o para una trama que no se pudo
+    interpretar, si es None): AA aceptado, AE error al procesarlo, AR rechazado.
+    """
+    now = now or datetime.now()
+    d = message.delimiters if message is not None else DEFAULT_DELIMITERS
+    header = message.header if message is not None else None
+    # Remitente y destinatario intercambiados respecto al mensaje original
+    receiving = [header.raw(5), header.raw(6), header.raw(3), header.raw(4)] if header else ["", "", "", ""]
+    trigger = header.get(9, 2) if header else ""
+    msh = build_segment(
+        ["MSH", *receiving, format_timestamp(now), "",
+         f"ACK{d.component}{trigger}{d.component}ACK" if trigger else "ACK",
+         control_id or f"{format_timestamp(now)}{now.microsecond:06d}",
+         (header.raw(11) or "P") if header else "P",
+         (header.raw(12) or HL7_VERSION) if header else HL7_VERSION],
+        d,
+    )
+    msa = ["MSA", code, message.control_id if message is not None else ""]
+    if text:
+        msa.append(escape(text, d))
+    return msh + "\r" + d.field.join(msa) + "\r"
+
+
+def batch(messages, now=None):
+    """Varios mensajes (ya en texto) envueltos en un lote BHS ... BTS."""
+    now = now or datetime.now()
+    return (
+        build_segment(["BHS", "", "", "", "", format_timestamp(now)]) + "\r"
+        + "".join(messages)
+        + f"BTS|{len(messages)}\r"
+    )
@@ -0,0 +1,300 @@
+import contextvars
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import orjson
+from pymongo import monitoring
+
+# Directorio compartido por los workers de un mismo gunicorn: cada proceso
+# vuelca ahí sus métricas (un fichero por PID) y /metrics suma todos los
+# ficheros. gunicorn.conf.py lo fija al cargarse y lo vacía al arrancar el
+# maestro. Se lee en cada uso (metrics_dir): con preload_app la app se importa
+# antes de on_starting. Sin la variable, uno por proceso que importó el módulo.
+_DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), f"lis-metrics-{os.getpid()}")
+# Segundos entre volcados a disco de las métricas de cada worker
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Peticiones más lentas que esto (ms) se registran con el desglose por fase
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ("validation", "db", "encoding", "compression")
+
+METRICS_HELP = {
+    "lis_http_requests_total": ("counter", "Peticiones HTTP atendidas"),
+    "lis_http_request_duration_seconds": ("histogram", "Duración de las peticiones HTTP"),
+    "lis_request_phase_seconds": ("histogram", "Tiempo por petición en validación, MongoDB, codificación JSON y compresión"),
+    "lis_mongodb_commands_total": ("counter", "Comandos enviados a MongoDB"),
+    "lis_mongodb_command_duration_seconds": ("histogram", "Duración de los comandos de MongoDB"),
+    "lis_admission_rejected_total": ("counter", "Peticiones rechazadas por el control de admisión (429/503)"),
+}
+
+# Tiempos por fase de la petición en curso. AsyncCrud copia el contexto al
+# hilo de la base de datos, así que el diccionario es el mismo en ambos lados;
+# en bulk_create_patients se valida un bloque mientras otro hilo escribe el
+# anterior, y las sumas se hacen con el candado para no perder ninguna.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+def _add_timing(timings, phase, seconds):
+    with _timings_lock:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+class Registry:
+    """Contadores e histogramas de este proceso, indexados por (nombre, etiquetas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Un contador por cubo, más el desbordamiento (+Inf); luego suma y total
+                histogram = self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            counts = histogram[0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [
+                    [name, list(labels), list(counts), total, count]
+                    for (name, labels), (counts, total, count) in self.histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+
+
+@contextmanager
+def timer(phase):
+    """Suma la duración del bloque a la fase `phase` de la petición en curso."""
+    timings = _request_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_timing(timings, phase, time.perf_counter() - start)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Cuenta los comandos de MongoDB y suma su duración a la fase "db" de la petición."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        registry.inc("lis_mongodb_commands_total", {"command": event.command_name, "outcome": outcome})
+        registry.observe("lis_mongodb_command_duration_seconds", {"command": event.command_name}, seconds)
+        # Los eventos se emiten en el hilo que ejecuta la operación, con el contexto de la petición
+        timings = _request_timings.get()
+        if timings is not None:
+            _add_timing(timings, "db", seconds)
+
+
+command_listener = CommandMetricsListener()
+
+
+# --- Volcado por proceso y agregación entre workers ---
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def metrics_dir():
+    return os.getenv("METRICS_DIR") or _DEFAULT_METRICS_DIR
+
+
+def _metrics_file(pid):
+    return os.path.join(metrics_dir(), f"{pid}.json")
+
+
+def flush():
+    """Escribe las métricas de este proceso en su fichero (reemplazo atómico)."""
+    os.makedirs(metrics_dir(), exist_ok=True)
+    path = _metrics_file(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(registry.snapshot()))
+    os.replace(tmp_path, path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"No se pudieron volcar las métricas: {e}")
+
+
+def start_flusher():
+    """Arranca (una vez por proceso, después del fork) el hilo que vuelca las métricas."""
+    global _flusher_pid
+    pid = os.getpid()
+    if _flusher_pid == pid:
+        return
+    with _flusher_lock:
+        if _flusher_pid != pid:
+            threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+            _flusher_pid = pid
+
+
+def clear_metrics_dir():
+    """Borra los ficheros de una ejecución anterior (lo llama el maestro de gunicorn)."""
+    directory = metrics_dir()
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith(".json") or name.endswith(".tmp"):
+            os.remove(os.path.join(directory, name))
+
+
+def collect():
+    """
+    Suma las métricas de todos los workers. Los ficheros de workers ya
+    terminados se conservan: los contadores de Prometheus no deben bajar.
+    """
+    flush()
+    directory = metrics_dir()
+    counters, histograms = {}, {}
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), "rb") as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError):
+            continue
+        for metric, labels, value in data["counters"]:
+            key = (metric, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for metric, labels, counts, total, count in data["histograms"]:
+            key = (metric, tuple(tuple(pair) for pair in labels))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus():
+    """Métricas de todos los workers en formato de texto de Prometheus (0.0.4)."""
+    counters, histograms = collect()
+    lines = []
+    for metric, (kind, help_text) in METRICS_HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind == "counter":
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{_labels(labels)} {value}")
+            continue
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Middleware ASGI ---
+
+class MetricsMiddleware:
+    """
+    Mide cada petición HTTP: duración total por ruta (la plantilla, p. ej.
+    /api/patients/{object_id}, no la URL concreta), código de respuesta y el
+    tiempo de cada fase (validación, MongoDB, codificación, compresión). Las peticiones
+    más lentas que SLOW_REQUEST_MS se registran con su desglose.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start_flusher()
+        timings = {}
+        token = _request_timings.set(timings)
+        status_code = 500
+        event_stream = False
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, event_stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                event_stream = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_timings.reset(token)
+            # El router de Starlette deja la ruta resuelta en el mismo scope
+            route = getattr(scope.get("route"), "path", "sin-ruta")
+            method = scope["method"]
+            registry.inc("lis_http_requests_total", {"method": method, "route": route, "status": str(status_code)})
+            registry.observe("lis_http_request_duration_seconds", {"method": method, "route": route}, elapsed)
+            for phase, seconds in timings.items():
+                registry.observe("lis_request_phase_seconds", {"method": method, "route": route, "phase": phase}, seconds)
+            # Una conexión SSE dura lo que el cliente quiera: no es una petición lenta
+            if elapsed * 1000 >= SLOW_REQUEST_MS and not event_stream:
+                breakdown = ", ".join(f"{phase} {timings.get(phase, 0.0) * 1000:.1f} ms" for phase in PHASES)
+                other = (elapsed - sum(timings.values())) * 1000
+                print(f"Petición lenta: {method} {route} -> {status_code} en {elapsed * 1000:.1f} ms "
+                      f"({breakdown}, resto {other:.1f} ms)")
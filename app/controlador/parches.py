@@ -0,0 +1,58 @@
+import copy
+
+# JSON Patch (RFC 6902) reducido a lo que necesita el historial de pacientes:
+# `diff` genera operaciones add/remove/replace entre dos versiones de un recurso
+# y `apply` las aplica. Las listas de distinta longitud se reemplazan enteras;
+# en un recurso FHIR son cortas y así el parche sigue siendo pequeño.
+
+
+def _escape(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token):
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(old, new, path=""):
+    """Operaciones JSON Patch que transforman `old` en `new`."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = []
+        for key in old.keys() - new.keys():
+            operations.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                operations.append({"op": "add", "path": child, "value": value})
+            elif old[key] != value:
+                operations.extend(diff(old[key], value, child))
+        return operations
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        operations = []
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            if old_item != new_item:
+                operations.extend(diff(old_item, new_item, f"{path}/{index}"))
+        return operations
+    if old == new:
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def apply(document, operations):
+    """Aplica las operaciones sobre una copia de `document` y la retorna."""
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if operation["path"] == "":
+            document = copy.deepcopy(operation["value"])
+            continue
+        *parents, last = [_unescape(token) for token in operation["path"].split("/")[1:]]
+        target = document
+        for token in parents:
+            target = target[int(token)] if isinstance(target, list) else target[token]
+        if isinstance(target, list):
+            last = int(last)
+        if operation["op"] == "remove":
+            del target[last]
+        else:
+            target[last] = copy.deepcopy(operation["value"])
+    return document
@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+import orjson
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from fastapi.responses import JSONResponse
+
+from app.controlador.metricas import timer
+
+
+def _default(value):
+    # Tipos BSON que orjson no conoce; datetime, date y time los serializa él mismo
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return str(value)
+    # DTO con __slots__ (p. ej. PatientSummary): sus atributos, en orden
+    slots = getattr(type(value), "__slots__", None)
+    if slots is not None:
+        return {name: getattr(value, name) for name in slots}
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(value):
+    """Serializa a JSON (bytes UTF-8) directamente desde los documentos de MongoDB."""
+    return orjson.dumps(value, default=_default)
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+class FHIRJSONResponse(JSONResponse):
+    """
+    Respuesta JSON serializada con orjson. Las rutas que devuelven documentos
+    de MongoDB la usan directamente para evitar el paso por jsonable_encoder.
+    """
+
+    def render(self, content):
+        with timer("encoding"):
+            return dumps(content)
@@ -0,0 +1,1712 @@
+import itertools
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import bson
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# Almacenamiento embebido con la misma interfaz que las colecciones de pymongo
+# que usa la aplicación (find, bulk_write, find_one_and_update, sesiones con
+# transacción, create_index, aggregate...), sobre un fichero SQLite. Cada
+# colección es una tabla (clave ordenable del _id -> documento BSON) y cada
+# índice, una tabla de claves que se mantiene en la misma transacción que el
+# documento. Los índices solo acotan los candidatos: el filtro de MongoDB se
+# evalúa siempre sobre el documento, así que un índice nunca cambia el resultado.
+
+# Espera máxima (ms) por el bloqueo de escritura de otro proceso o hilo
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Caché de páginas y memoria mapeada por conexión (MB)
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+# NORMAL: con WAL, un corte de luz puede perder las últimas transacciones pero
+# no corrompe el fichero; FULL sincroniza cada commit
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+# Documentos leídos por consulta al recorrer un cursor
+FETCH_SIZE = 500
+# Tabla con la definición de los índices de todas las colecciones
+INDEXES_TABLE = "_indices"
+
+_command_listeners = []
+
+
+def register(listener):
+    """Como pymongo.monitoring.register: `listener` recibe succeeded/failed de cada operación."""
+    _command_listeners.append(listener)
+
+
+class CommandEvent:
+    """Lo que usan los listeners de comandos de pymongo (metricas.CommandMetricsListener)."""
+
+    __slots__ = ("command_name", "duration_micros")
+
+    def __init__(self, command_name, duration_micros):
+        self.command_name = command_name
+        self.duration_micros = duration_micros
+
+
+@contextmanager
+def _command(name):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        _notify(name, start, "failed")
+        raise
+    _notify(name, start, "succeeded")
+
+
+def _notify(name, start, outcome):
+    if _command_listeners:
+        event = CommandEvent(name, int((time.perf_counter() - start) * 1e6))
+        for listener in _command_listeners:
+            getattr(listener, outcome)(event)
+
+
+_MISSING = object()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+# --- Orden y comparación de valores, como MongoDB ---
+
+def _utc(moment):
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def _type_order(value):
+    """Orden entre tipos de BSON: null < números < texto < objeto < array < binario < ObjectId < bool < fecha."""
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def encode_key(value):
+    """
+    Texto que ordena como el valor en MongoDB: primero por tipo y dentro de cada
+    tipo por valor (los números como double con los bits reordenados). Es la
+    clave de las tablas de índice y del _id de cada documento.
+    """
+    order = _type_order(value)
+    if order == 0:
+        return "0"
+    if order == 1:
+        bits = struct.unpack(">Q", struct.pack(">d", float(value) + 0.0))[0]
+        bits = bits ^ 0xFFFFFFFFFFFFFFFF if bits >> 63 else bits | (1 << 63)
+        return f"1{bits:016x}"
+    if order == 2:
+        return "2" + value
+    if order == 7:
+        return "7" + str(value)
+    if order == 8:
+        return "81" if value else "80"
+    if order == 9:
+        return "9" + _utc(value).isoformat(timespec="milliseconds")
+    if order == 5:
+        return "5" + value.hex()
+    if order == 4:
+        return "4" + "\x00".join(encode_key(item) for item in value)
+    return str(order) + repr(value)
+
+
+def _equal(a, b):
+    if isinstance(a, datetime) and isinstance(b, datetime):
+        return _utc(a) == _utc(b)
+    return _type_order(a) == _type_order(b) and a == b
+
+
+def _compare(a, b):
+    """-1, 0 o 1 entre valores del mismo tipo; None si son de tipos distintos (no se comparan)."""
+    if _type_order(a) != _type_order(b):
+        return None
+    if isinstance(a, datetime):
+        a, b = _utc(a), _utc(b)
+    elif isinstance(a, (dict, list)):
+        a, b = encode_key(a), encode_key(b)
+    return (a > b) - (a < b)
+
+
+# --- Rutas con puntos ---
+
+def _resolve(value, parts):
+    """Valores en la ruta `parts`, recorriendo los arrays como MongoDB. Vacía si no existe."""
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        return _resolve(value[head], rest) if head in value else []
+    if isinstance(value, list):
+        found = []
+        if head.isdigit() and int(head) < len(value):
+            found.extend(_resolve(value[int(head)], rest))
+        for item in value:
+            if isinstance(item, dict):
+                found.extend(_resolve(item, parts))
+        return found
+    return []
+
+
+def _flatten(values):
+    """Los valores y los elementos de los que son arrays: a lo que se aplica un operador de comparación."""
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _set_path(doc, path, value):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list) and part.isdigit():
+            target = target[int(part)]
+            continue
+        child = target.get(part)
+        if not isinstance(child, (dict, list)):
+            child = target[part] = {}
+        target = child
+    last = parts[-1]
+    if isinstance(target, list) and last.isdigit():
+        index = int(last)
+        target.extend([None] * (index + 1 - len(target)))
+        target[index] = value
+    else:
+        target[last] = value
+
+
+def _get_path(doc, path, default=None):
+    target = doc
+    for part in path.split("."):
+        if isinstance(target, dict) and part in target:
+            target = target[part]
+        elif isinstance(target, list) and part.isdigit() and int(part) < len(target):
+            target = target[int(part)]
+        else:
+            return default
+    return target
+
+
+def _unset_path(doc, path):
+    parts = path.split(".")
+    target = _get_path(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+    elif isinstance(target, list) and parts[-1].isdigit() and int(parts[-1]) < len(target):
+        target[int(parts[-1])] = None
+
+
+# --- Filtros ---
+
+def _is_operator_dict(condition):
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith("$") for key in condition)
+
+
+_REGEX_FLAGS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}
+
+
+def _regex(pattern, options=""):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    if isinstance(pattern, bson.regex.Regex):
+        return pattern.try_compile()
+    flags = 0
+    for option in options or "":
+        flags |= _REGEX_FLAGS.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def _equals_any(values, target):
+    if isinstance(target, (re.Pattern, bson.regex.Regex)):
+        pattern = _regex(target)
+        return any(isinstance(value, str) and pattern.search(value) for value in _flatten(values))
+    if not values:
+        return target is None
+    for value in values:
+        if _equal(value, target) or (isinstance(value, list) and any(_equal(item, target) for item in value)):
+            return True
+    return False
+
+
+# Lista de $in -> (lista, expresiones regulares, claves), por identidad: una
+# consulta evalúa la misma lista en cada documento candidato
+_IN_OPTIONS = {}
+_IN_OPTIONS_MAX = 64
+
+
+def _in_options(options):
+    cached = _IN_OPTIONS.get(id(options))
+    if cached is not None and cached[0] is options:
+        return cached[1], cached[2]
+    patterns = [option for option in options if isinstance(option, (re.Pattern, bson.regex.Regex))]
+    keys = {encode_key(option) for option in options if not isinstance(option, (re.Pattern, bson.regex.Regex))}
+    if len(_IN_OPTIONS) >= _IN_OPTIONS_MAX:
+        _IN_OPTIONS.clear()
+    _IN_OPTIONS[id(options)] = (options, patterns, keys)
+    return patterns, keys
+
+
+def _in_any(values, options):
+    """$in: las opciones se comparan por su clave (un conjunto), no una a una contra cada valor."""
+    patterns, keys = _in_options(options)
+    if any(_equals_any(values, pattern) for pattern in patterns):
+        return True
+    if not values:
+        return "0" in keys
+    for value in values:
+        if encode_key(value) in keys or (isinstance(value, list) and any(encode_key(item) in keys for item in value)):
+            return True
+    return False
+
+
+def _elem_matches(item, condition):
+    if _is_operator_dict(condition):
+        return _apply_operators([item], condition, element=True)
+    return isinstance(item, dict) and matches(item, condition)
+
+
+_COMPARISONS = {"$gt": lambda c: c > 0, "$gte": lambda c: c >= 0, "$lt": lambda c: c < 0, "$lte": lambda c: c <= 0}
+
+
+def _apply_operators(values, condition, element=False):
+    candidates = values if element else list(_flatten(values))
+    for operator, argument in condition.items():
+        if operator in _COMPARISONS:
+            test = _COMPARISONS[operator]
+            if not any((c := _compare(value, argument)) is not None and test(c) for value in candidates):
+                return False
+        elif operator == "$eq":
+            if not _equals_any(values, argument):
+                return False
+        elif operator == "$ne":
+            if _equals_any(values, argument):
+                return False
+        elif operator == "$in":
+            if not _in_any(values, argument):
+                return False
+        elif operator == "$nin":
+            if _in_any(values, argument):
+                return False
+        elif operator == "$exists":
+            if bool(values) != bool(argument):
+                return False
+        elif operator == "$regex":
+            pattern = _regex(argument, condition.get("$options"))
+            if not any(isinstance(value, str) and pattern.search(value) for value in candidates):
+                return False
+        elif operator == "$options":
+            continue
+        elif operator == "$not":
+            negated = argument if _is_operator_dict(argument) else {"$regex": argument}
+            if _apply_operators(values, negated, element):
+                return False
+        elif operator == "$elemMatch":
+            if not any(isinstance(value, list) and any(_elem_matches(item, argument) for item in value)
+                       for value in values):
+                return False
+        elif operator == "$size":
+            if not any(isinstance(value, list) and len(value) == argument for value in values):
+                return False
+        elif operator == "$all":
+            if not all(_equals_any(values, option) for option in argument):
+                return False
+        else:
+            raise OperationFailure(f"Operador de consulta no soportado en SQLite: {operator}", 2)
+    return True
+
+
+def matches(doc, query):
+    """True si el documento cumple el filtro de MongoDB `query`."""
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, clause) for clause in condition):
+                return False
+        elif key.startswith("$"):
+            raise OperationFailure(f"Operador de consulta no soportado en SQLite: {key}", 2)
+        else:
+            values = _resolve(doc, key.split("."))
+            if _is_operator_dict(condition):
+                if not _apply_operators(values, condition):
+                    return False
+            elif not _equals_any(values, condition):
+                return False
+    return True
+
+
+# --- Proyecciones, orden y actualizaciones ---
+
+def _include(source, target, parts):
+    head, rest = parts[0], parts[1:]
+    if head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = value
+    elif isinstance(value, dict):
+        child = target.get(head)
+        if not isinstance(child, dict):
+            child = target[head] = {}
+        _include(value, child, rest)
+    elif isinstance(value, list):
+        previous = target.get(head) if isinstance(target.get(head), list) else []
+        items = []
+        for position, item in enumerate(item for item in value if isinstance(item, dict)):
+            child = previous[position] if position < len(previous) else {}
+            _include(item, child, rest)
+            items.append(child)
+        target[head] = items
+
+
+def _exclude(doc, parts):
+    head, rest = parts[0], parts[1:]
+    if head not in doc:
+        return
+    if not rest:
+        del doc[head]
+    elif isinstance(doc[head], dict):
+        _exclude(doc[head], rest)
+    elif isinstance(doc[head], list):
+        for item in doc[head]:
+            if isinstance(item, dict):
+                _exclude(item, rest)
+
+
+def project(doc, projection):
+    """Aplica una proyección de inclusión o de exclusión (el documento se modifica)."""
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = [(field, flag) for field, flag in projection.items() if field != "_id"]
+    if any(flag for _, flag in fields):
+        result = {"_id": doc["_id"]} if include_id and "_id" in doc else {}
+        for field, flag in fields:
+            if flag:
+                _include(doc, result, field.split("."))
+        return result
+    for field, _ in fields:
+        _exclude(doc, field.split("."))
+    if not include_id:
+        doc.pop("_id", None)
+    return doc
+
+
+def _normalize_sort(sort, direction=None):
+    if sort is None:
+        return None
+    if isinstance(sort, str):
+        return [(sort, direction or 1)]
+    if isinstance(sort, dict):
+        return list(sort.items())
+    return [(field, order) for field, order in sort]
+
+
+def _sort_value(doc, field, order):
+    """Clave de orden de un campo: con arrays, el menor elemento en ascendente y el mayor en descendente."""
+    values = _resolve(doc, field.split("."))
+    keys = [encode_key(value) for value in _flatten(values) if not isinstance(value, list)]
+    if not keys:
+        # Un array vacío ordena antes que null o que el campo ausente
+        return "" if values else "0"
+    return min(keys) if order > 0 else max(keys)
+
+
+def sort_documents(docs, sort):
+    for field, order in reversed(sort):
+        docs.sort(key=lambda doc: _sort_value(doc, field, order), reverse=order < 0)
+    return docs
+
+
+def apply_update(doc, update, inserting=False):
+    """Aplica los operadores de actualización a `doc` (lo modifica)."""
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            if path == "_id" or path.startswith("_id."):
+                if operator in ("$set", "$setOnInsert") and inserting:
+                    doc["_id"] = value
+                    continue
+                if operator == "$set" and _equal(doc.get("_id"), value):
+                    continue
+                raise OperationFailure("No se puede modificar el campo inmutable _id", 66)
+            if operator in ("$set", "$setOnInsert"):
+                _set_path(doc, path, value)
+            elif operator == "$unset":
+                _unset_path(doc, path)
+            elif operator == "$inc":
+                current = _get_path(doc, path, 0)
+                if _type_order(current) != 1:
+                    raise OperationFailure(f"$inc sobre un valor no numérico en {path}", 14)
+                _set_path(doc, path, current + value)
+            elif operator in ("$min", "$max"):
+                current = _get_path(doc, path, _MISSING)
+                if current is _MISSING or (encode_key(value) < encode_key(current) if operator == "$min"
+                                           else encode_key(value) > encode_key(current)):
+                    _set_path(doc, path, value)
+            elif operator in ("$push", "$addToSet"):
+                current = _get_path(doc, path, _MISSING)
+                if current is _MISSING:
+                    current = []
+                    _set_path(doc, path, current)
+                elif not isinstance(current, list):
+                    raise OperationFailure(f"{operator} sobre un campo que no es un array: {path}", 2)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in items:
+                    if operator == "$push" or not any(_equal(existing, item) for existing in current):
+                        current.append(item)
+            elif operator == "$pull":
+                current = _get_path(doc, path)
+                if isinstance(current, list):
+                    current[:] = [item for item in current if not (
+                        _elem_matches(item, value) if isinstance(value, dict) else _equal(item, value)
+                    )]
+            elif operator == "$currentDate":
+                _set_path(doc, path, datetime.utcnow())
+            else:
+                raise OperationFailure(f"Operador de actualización no soportado en SQLite: {operator}", 9)
+    return doc
+
+
+def _upsert_document(query, update, replacement):
+    """Documento que crea un upsert: las igualdades del filtro más la actualización."""
+    doc = {}
+
+    def equalities(clauses):
+        for key, condition in clauses.items():
+            if key == "$and":
+                for clause in condition:
+                    equalities(clause)
+            elif key.startswith("$"):
+                continue
+            elif _is_operator_dict(condition):
+                if "$eq" in condition:
+                    _set_path(doc, key, condition["$eq"])
+            else:
+                _set_path(doc, key, condition)
+
+    equalities(query)
+    if replacement:
+        doc = {"_id": doc["_id"], **update} if "_id" in doc and "_id" not in update else dict(update)
+    else:
+        apply_update(doc, update, inserting=True)
+    if "_id" not in doc:
+        doc["_id"] = ObjectId()
+    return {"_id": doc["_id"], **{key: value for key, value in doc.items() if key != "_id"}}
+
+
+# --- Agregación ---
+
+def _field_value(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _date_to_string(moment, fmt):
+    moment = _utc(moment)
+    replacements = {"%L": f"{moment.microsecond // 1000:03d}", "%Y": f"{moment.year:04d}"}
+    for token, text in replacements.items():
+        fmt = fmt.replace(token, text)
+    return moment.strftime(fmt)
+
+
+def evaluate(expression, doc):
+    """Expresión de agregación sobre `doc` (subconjunto: rutas, comparaciones, $cond, texto y fechas)."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression == "$$ROOT":
+            return doc
+        value = _field_value(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(item, doc) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith("$"):
+        # Como en MongoDB, un campo que no existe no aparece en el objeto
+        return {
+            key: evaluate(value, doc) for key, value in expression.items()
+            if not (isinstance(value, str) and value.startswith("$") and value != "$$ROOT"
+                    and _field_value(doc, value[1:]) is _MISSING)
+        }
+    operator, argument = next(iter(expression.items()))
+    if operator == "$literal":
+        return argument
+    if operator == "$cond":
+        if isinstance(argument, dict):
+            argument = [argument["if"], argument["then"], argument["else"]]
+        condition, then, otherwise = argument
+        return evaluate(then if evaluate(condition, doc) else otherwise, doc)
+    if operator == "$dateToString":
+        moment = evaluate(argument["date"], doc)
+        return None if moment is None else _date_to_string(moment, argument.get("format", "%Y-%m-%dT%H:%M:%S.%LZ"))
+    args = [evaluate(item, doc) for item in (argument if isinstance(argument, list) else [argument])]
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a, b = (encode_key(value) for value in args)
+        return {"$eq": a == b, "$ne": a != b, "$gt": a > b, "$gte": a >= b, "$lt": a < b, "$lte": a <= b}[operator]
+    if operator == "$and":
+        return all(args)
+    if operator == "$or":
+        return any(args)
+    if operator == "$not":
+        return not args[0]
+    if operator == "$ifNull":
+        return next((value for value in args if value is not None), None)
+    if operator == "$in":
+        return any(_equal(args[0], item) for item in args[1])
+    if operator == "$size":
+        return len(args[0])
+    if operator == "$arrayElemAt":
+        items, index = args
+        return items[index] if -len(items) <= index < len(items) else None
+    if operator in ("$add", "$multiply"):
+        if any(value is None for value in args):
+            return None
+        result = args[0]
+        for value in args[1:]:
+            result = result + value if operator == "$add" else result * value
+        return result
+    if operator in ("$subtract", "$divide", "$mod"):
+        a, b = args
+        if a is None or b is None:
+            return None
+        return {"$subtract": lambda: a - b, "$divide": lambda: a / b, "$mod": lambda: a % b}[operator]()
+    if operator in ("$substr", "$substrBytes", "$substrCP"):
+        text, start, length = args
+        text = "" if text is None else str(text)
+        return text[start:] if length < 0 else text[start:start + length]
+    if operator == "$concat":
+        return None if any(value is None for value in args) else "".join(args)
+    if operator == "$toLower":
+        return (args[0] or "").lower()
+    if operator == "$toUpper":
+        return (args[0] or "").upper()
+    if operator in ("$year", "$month", "$dayOfMonth", "$hour", "$minute"):
+        moment = _utc(args[0])
+        return getattr(moment, {"$year": "year", "$month": "month", "$dayOfMonth": "day",
+                                "$hour": "hour", "$minute": "minute"}[operator])
+    raise OperationFailure(f"Expresión no soportada en SQLite: {operator}", 168)
+
+
+def _group_key(value):
+    if isinstance(value, dict):
+        return tuple((key, _group_key(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return ("[]",) + tuple(_group_key(item) for item in value)
+    return encode_key(value)
+
+
+def _group(docs, spec):
+    groups = {}
+    accumulators = {field: next(iter(acc.items())) for field, acc in spec.items() if field != "_id"}
+    for doc in docs:
+        key_value = evaluate(spec["_id"], doc)
+        state = groups.get(_group_key(key_value))
+        if state is None:
+            state = groups[_group_key(key_value)] = {"_id": key_value}
+            for field, (operator, _) in accumulators.items():
+                state[field] = {"$sum": 0, "$count": 0, "$push": [], "$addToSet": [], "$avg": [0, 0]}.get(operator, _MISSING)
+        for field, (operator, expression) in accumulators.items():
+            value = None if operator == "$count" else evaluate(expression, doc)
+            current = state[field]
+            if operator == "$sum":
+                state[field] = current + (value if _type_order(value) == 1 else 0)
+            elif operator == "$count":
+                state[field] = current + 1
+            elif operator == "$avg":
+                if _type_order(value) == 1:
+                    current[0] += value
+                    current[1] += 1
+            elif operator == "$push":
+                current.append(value)
+            elif operator == "$addToSet":
+                if not any(_equal(item, value) for item in current):
+                    current.append(value)
+            elif operator == "$first":
+                if current is _MISSING:
+                    state[field] = value
+            elif operator == "$last":
+                state[field] = value
+            elif operator in ("$min", "$max"):
+                if value is not None and (current is _MISSING or (encode_key(value) < encode_key(current)) == (operator == "$min")):
+                    state[field] = value
+            else:
+                raise OperationFailure(f"Acumulador no soportado en SQLite: {operator}", 15952)
+    for state in groups.values():
+        for field, (operator, _) in accumulators.items():
+            if operator == "$avg":
+                total, count = state[field]
+                state[field] = total / count if count else None
+            elif state[field] is _MISSING:
+                state[field] = None
+        yield state
+
+
+def _computed_fields(doc, spec):
+    for field, expression in spec.items():
+        _set_path(doc, field, evaluate(expression, doc))
+    return doc
+
+
+def _project_stage(doc, spec):
+    computed = {field: value for field, value in spec.items()
+                if not (isinstance(value, (bool, int)) and not isinstance(value, float))}
+    flags = {field: value for field, value in spec.items() if field not in computed}
+    if not computed and not any(flag for field, flag in flags.items() if field != "_id"):
+        return project(doc, flags)
+    result = {"_id": doc["_id"]} if flags.get("_id", 1) and "_id" in doc else {}
+    for field, flag in flags.items():
+        if flag and field != "_id":
+            _include(doc, result, field.split("."))
+    for field, expression in computed.items():
+        _set_path(result, field, evaluate(expression, doc))
+    return result
+
+
+def _unwind(docs, spec):
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    path = spec["path"][1:]
+    keep = spec.get("preserveNullAndEmptyArrays", False)
+    for doc in docs:
+        value = _get_path(doc, path, _MISSING)
+        if isinstance(value, list) and value:
+            for item in value:
+                copy = dict(doc)
+                _set_path(copy, path, item)
+                yield copy
+        elif isinstance(value, list) or value is _MISSING or value is None:
+            if keep:
+                yield doc
+        else:
+            yield doc
+
+
+def _stage(docs, name, spec):
+    if name == "$match":
+        return (doc for doc in docs if matches(doc, spec))
+    if name == "$project":
+        return (_project_stage(doc, spec) for doc in docs)
+    if name in ("$addFields", "$set"):
+        return (_computed_fields(doc, spec) for doc in docs)
+    if name == "$unset":
+        exclusion = {field: 0 for field in ([spec] if isinstance(spec, str) else spec)}
+        return (project(doc, exclusion) for doc in docs)
+    if name == "$unwind":
+        return _unwind(docs, spec)
+    if name == "$group":
+        return _group(docs, spec)
+    if name == "$sort":
+        return iter(sort_documents(list(docs), _normalize_sort(spec)))
+    if name == "$limit":
+        return itertools.islice(docs, spec)
+    if name == "$skip":
+        return itertools.islice(docs, spec, None)
+    if name == "$count":
+        total = sum(1 for _ in docs)
+        return iter([{spec: total}] if total else [])
+    raise OperationFailure(f"Etapa de agregación no soportada en SQLite: {name}", 40324)
+
+
+def run_pipeline(docs, stages):
+    for stage in stages:
+        (name, spec), = stage.items()
+        docs = _stage(docs, name, spec)
+    return docs
+
+
+# --- Plan de consulta ---
+
+def _regex_prefix(pattern, options=""):
+    """Prefijo literal de una expresión anclada con ^ (sin opción i), o None."""
+    if isinstance(pattern, re.Pattern):
+        if pattern.flags & re.IGNORECASE:
+            return None
+        pattern = pattern.pattern
+    if "i" in (options or "") or not isinstance(pattern, str) or not pattern.startswith("^"):
+        return None
+    prefix, position = [], 1
+    while position < len(pattern):
+        char = pattern[position]
+        if char == "\\" and position + 1 < len(pattern) and not pattern[position + 1].isalnum():
+            literal, step = pattern[position + 1], 2
+        elif char in ".^$*+?{}[]|()\\":
+            break
+        else:
+            literal, step = char, 1
+        following = pattern[position + step:position + step + 1]
+        if following in ("*", "?", "{"):
+            break
+        prefix.append(literal)
+        position += step
+        if following == "|":
+            return None
+    if "|" in pattern[position:]:
+        return None
+    return "".join(prefix)
+
+
+def _key_condition(condition):
+    """
+    Condición de un campo como rango sobre su clave codificada: ("eq", [claves])
+    o ("range", mínimo, incluido, máximo, incluido). None si no acota el índice.
+    """
+    if isinstance(condition, re.Pattern):
+        condition = {"$regex": condition}
+    if not _is_operator_dict(condition):
+        if isinstance(condition, (dict, list)):
+            return None
+        return "eq", [encode_key(condition)]
+    if "$eq" in condition and not isinstance(condition["$eq"], (dict, list, re.Pattern)):
+        return "eq", [encode_key(condition["$eq"])]
+    if "$in" in condition:
+        options = condition["$in"]
+        if any(isinstance(option, (dict, list, re.Pattern, bson.regex.Regex)) for option in options):
+            return None
+        return "eq", sorted({encode_key(option) for option in options})
+    if "$regex" in condition:
+        prefix = _regex_prefix(condition["$regex"], condition.get("$options"))
+        if prefix:
+            return "range", "2" + prefix, True, "2" + prefix + "\U0010ffff", True
+    bounds = [(op, value) for op, value in condition.items() if op in _COMPARISONS]
+    if not bounds or any(isinstance(value, (dict, list)) for _, value in bounds):
+        return None
+    kind = encode_key(bounds[0][1])[0]
+    low, low_inclusive, high, high_inclusive = kind, True, chr(ord(kind) + 1), False
+    for op, value in bounds:
+        if encode_key(value)[0] != kind:
+            return None
+        if op in ("$gt", "$gte"):
+            low, low_inclusive = encode_key(value), op == "$gte"
+        else:
+            high, high_inclusive = encode_key(value), op == "$lte"
+    return "range", low, low_inclusive, high, high_inclusive
+
+
+def _conjunction(query):
+    """(campo, condición) que deben cumplirse todas: las del primer nivel y las de $and y $elemMatch."""
+    conditions = []
+    for key, condition in query.items():
+        if key == "$and":
+            for clause in condition:
+                conditions.extend(_conjunction(clause))
+        elif not key.startswith("$"):
+            conditions.append((key, condition))
+            element = condition.get("$elemMatch") if isinstance(condition, dict) else None
+            if isinstance(element, dict) and not _is_operator_dict(element):
+                conditions.extend((f"{key}.{field}", value) for field, value in _conjunction(element))
+    return conditions
+
+
+def _sql_condition(column, key_condition, params):
+    if key_condition[0] == "eq":
+        keys = key_condition[1]
+        params.extend(keys)
+        return f"{column} = ?" if len(keys) == 1 else f"{column} IN ({','.join('?' * len(keys))})"
+    _, low, low_inclusive, high, high_inclusive = key_condition
+    params.extend([low, high])
+    return f"{column} {'>=' if low_inclusive else '>'} ? AND {column} {'<=' if high_inclusive else '<'} ?"
+
+
+def _admits_missing(key_condition):
+    """Si la condición admite la clave de null, que es también la de un campo que no existe."""
+    if key_condition[0] == "eq":
+        return "0" in key_condition[1]
+    _, low, low_inclusive, high, high_inclusive = key_condition
+    return (low < "0" or (low == "0" and low_inclusive)) and ("0" < high or (high == "0" and high_inclusive))
+
+
+class _Index:
+    __slots__ = ("name", "fields", "unique", "partial", "table")
+
+    def __init__(self, collection_table, name, fields, unique, partial):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.partial = partial
+        self.table = _quote(f"{collection_table}.${name}")
+
+    def entries(self, doc):
+        """Claves del documento en este índice (varias si algún campo es un array)."""
+        if self.partial and not matches(doc, self.partial):
+            return set()
+        keys = []
+        for field in self.fields:
+            values = set()
+            for value in _resolve(doc, field.split(".")):
+                if isinstance(value, list):
+                    # Vacío: antes que null, como en el orden de MongoDB
+                    values.update([encode_key(item) for item in value] or [""])
+                else:
+                    values.add(encode_key(value))
+            keys.append(values or {"0"})
+        return set(itertools.product(*keys))
+
+    def usable(self, conditions):
+        """Un índice parcial solo sirve si la consulta exige que el campo exista (no admite null)."""
+        if not self.partial:
+            return True
+        constrained = set()
+        for field, condition in conditions:
+            key_condition = _key_condition(condition)
+            if key_condition and not _admits_missing(key_condition):
+                constrained.add(field)
+        return all(
+            field in constrained and condition == {"$exists": True}
+            for field, condition in self.partial.items()
+        )
+
+
+class _Plan:
+    """
+    Candidatos de una consulta: condición sobre la clave del _id (`key`) y/o
+    subconsulta de rowids (`ids_sql`), de un índice (`index`, con su condición
+    sobre las columnas de alias i en `index_sql`) o de la unión de las ramas de un $or.
+    """
+
+    __slots__ = ("key", "ids_sql", "ids_params", "index", "index_sql", "index_params", "fields")
+
+    def __init__(self):
+        self.key = None
+        # Campo -> condición sobre sus claves, de las que se pueden planificar
+        self.fields = {}
+        self.ids_sql, self.ids_params = None, []
+        self.index, self.index_sql, self.index_params = None, None, []
+
+    def key_sql(self, column, params):
+        return _sql_condition(column, self.key, params)
+
+
+_SELECTIVITY = {"eq": 3, "range": 1}
+
+
+def _index_conditions(index, by_field):
+    """Condiciones SQL sobre las columnas del índice y su puntuación (prefijo de igualdades y un rango)."""
+    sql, params, score = [], [], 0
+    for position, field in enumerate(index.fields):
+        condition = by_field.get(field)
+        if condition is None:
+            break
+        sql.append(_sql_condition(f"i.k{position}", condition, params))
+        single = condition[0] == "eq" and len(condition[1]) == 1
+        score += _SELECTIVITY[condition[0]] if single or condition[0] == "range" else 2
+        if not single:
+            break
+    return sql, params, score
+
+
+def _order_position(index, field, by_field):
+    """
+    Posición de `field` en el índice si los campos anteriores tienen una
+    igualdad con un solo valor: el índice ya da los documentos en su orden.
+    """
+    if field not in index.fields:
+        return None
+    position = index.fields.index(field)
+    for previous in index.fields[:position]:
+        condition = by_field.get(previous)
+        if condition is None or condition[0] != "eq" or len(condition[1]) != 1:
+            return None
+    return position
+
+
+# --- Cliente, base de datos y colecciones ---
+
+class SQLiteClient:
+    """
+    Equivalente a MongoClient sobre un fichero SQLite. Una conexión por hilo
+    (en modo WAL las lecturas no esperan a las escrituras) y, como con
+    MongoClient, un cliente por proceso: no sobrevive a un fork.
+    """
+
+    def __init__(self, path, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._databases = {}
+
+    def connection(self):
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None,
+                check_same_thread=False, uri=self.path.startswith("file:"),
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+            conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {INDEXES_TABLE} "
+                "(tabla TEXT NOT NULL, nombre TEXT NOT NULL, campos TEXT NOT NULL, opciones BLOB NOT NULL, "
+                "PRIMARY KEY (tabla, nombre))"
+            )
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def __getitem__(self, name):
+        return self.get_database(name)
+
+    def get_database(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = SQLiteDatabase(self, name)
+            return self._databases[name]
+
+    @property
+    def admin(self):
+        return self.get_database("admin")
+
+    def start_session(self, **kwargs):
+        return SQLiteSession(self)
+
+    def drop_database(self, name):
+        database = name if isinstance(name, SQLiteDatabase) else self.get_database(name)
+        for collection_name in database.list_collection_names():
+            database.drop_collection(collection_name)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for conn in connections:
+            conn.close()
+
+
+class SQLiteSession:
+    """Sesión con transacción: todas las operaciones del callback van en una transacción de SQLite."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.end_session()
+
+    def end_session(self):
+        pass
+
+    def with_transaction(self, callback, *args, **kwargs):
+        conn = self.client.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = callback(self)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+
+class SQLiteDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, **kwargs):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections.setdefault(name, SQLiteCollection(self, name))
+        return collection
+
+    def list_collection_names(self):
+        prefix = f"{self.name}."
+        rows = self.client.connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+            (prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",),
+        )
+        return [name[len(prefix):] for name, in rows if ".$" not in name[len(prefix):]]
+
+    def drop_collection(self, name):
+        self.get_collection(name).drop()
+
+    def command(self, command, **kwargs):
+        if command in ("ping", {"ping": 1}):
+            return {"ok": 1.0}
+        raise OperationFailure(f"Comando no soportado en SQLite: {command}", 59)
+
+    def watch(self, *args, **kwargs):
+        # Mismo código que un mongod sin replica set: EventBus pasa a la consulta periódica
+        raise OperationFailure("SQLite no tiene change streams", 40573)
+
+
+@contextmanager
+def _transaction(conn):
+    """Transacción de escritura, salvo que ya haya una abierta (sesión): entonces es parte de ella."""
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@contextmanager
+def _savepoint(conn):
+    """Una operación de un lote: si falla a medias se deshace solo ella."""
+    conn.execute("SAVEPOINT operacion")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK TO operacion")
+        conn.execute("RELEASE operacion")
+        raise
+    conn.execute("RELEASE operacion")
+
+
+class SQLiteCursor:
+    """Cursor perezoso con la interfaz de pymongo: lee por lotes de la conexión del hilo que lo recorre."""
+
+    def __init__(self, collection, query, projection=None, sort=None, skip=0, limit=0, batch_size=0):
+        self.collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = _normalize_sort(sort)
+        self._skip = skip
+        self._limit = abs(limit or 0)
+        self._batch_size = batch_size or 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = abs(limit or 0)
+        return self
+
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        return self
+
+    def hint(self, index):
+        return self
+
+    def max_time_ms(self, max_time_ms):
+        return self
+
+    def close(self):
+        if self._results is not None:
+            self._results.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._results is None:
+            self._results = self.collection._documents(
+                self._query, self._sort, self._skip, self._limit, self._batch_size or FETCH_SIZE,
+            )
+        doc = next(self._results)
+        return project(doc, self._projection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._table = _quote(self.full_name)
+        self._created = False
+        self._schema = None
+        self._indexes = []
+
+    def __repr__(self):
+        return f"SQLiteCollection({self.database.client.path!r}, {self.full_name!r})"
+
+    def _connection(self):
+        """Conexión del hilo, con la tabla creada y la lista de índices al día (otro proceso pudo crear uno)."""
+        conn = self.database.client.connection()
+        if not self._created:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                "(id INTEGER PRIMARY KEY, clave TEXT NOT NULL UNIQUE, doc BLOB NOT NULL)"
+            )
+            # Dentro de una sesión la creación se deshace con la transacción: se repite hasta confirmarla fuera
+            self._created = not conn.in_transaction
+        schema = conn.execute("PRAGMA schema_version").fetchone()[0]
+        if schema != self._schema:
+            rows = conn.execute(f"SELECT nombre, campos, opciones FROM {INDEXES_TABLE} WHERE tabla = ?", (self.full_name,))
+            indexes = []
+            for name, fields, options in rows:
+                options = bson.decode(options)
+                indexes.append(_Index(self.full_name, name, fields.split("\x00"), options.get("unique", False),
+                                      options.get("partialFilterExpression")))
+            self._indexes = indexes
+            self._schema = schema
+        return conn
+
+    # --- Índices ---
+
+    def create_index(self, keys, name=None, unique=False, partialFilterExpression=None, **kwargs):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{order}" for field, order in keys)
+        fields = [field for field, _ in keys]
+        if fields == ["_id"]:
+            return "_id_"
+        with _command("createIndexes"):
+            conn = self._connection()
+            if any(index.name == name for index in self._indexes):
+                return name
+            index = _Index(self.full_name, name, fields, unique, partialFilterExpression)
+            columns = ", ".join(f"k{position}" for position in range(len(fields)))
+            with _transaction(conn):
+                # Otro proceso pudo crearlo mientras se esperaba el bloqueo
+                if conn.execute(f"SELECT 1 FROM {INDEXES_TABLE} WHERE tabla = ? AND nombre = ?",
+                                (self.full_name, name)).fetchone():
+                    self._schema = None
+                    return name
+                if unique:
+                    conn.execute(f"CREATE TABLE {index.table} (doc INTEGER NOT NULL, {columns}, PRIMARY KEY ({columns})) WITHOUT ROWID")
+                else:
+                    conn.execute(f"CREATE TABLE {index.table} ({columns}, doc INTEGER NOT NULL, PRIMARY KEY ({columns}, doc)) WITHOUT ROWID")
+                conn.execute(f"CREATE INDEX {_quote(f'{self.full_name}.${name}.doc')} ON {index.table} (doc)")
+                for rowid, data in conn.execute(f"SELECT id, doc FROM {self._table}").fetchall():
+                    self._insert_entries(conn, index, rowid, index.entries(bson.decode(data)))
+                options = {"unique": unique}
+                if partialFilterExpression:
+                    options["partialFilterExpression"] = partialFilterExpression
+                conn.execute(f"INSERT INTO {INDEXES_TABLE} VALUES (?, ?, ?, ?)",
+                             (self.full_name, name, "\x00".join(fields), bson.encode(options)))
+            self._schema = None
+        return name
+
+    def index_information(self):
+        self._connection()
+        info = {"_id_": {"key": [("_id", 1)]}}
+        for index in self._indexes:
+            info[index.name] = {"key": [(field, 1) for field in index.fields], "unique": index.unique}
+            if index.partial:
+                info[index.name]["partialFilterExpression"] = index.partial
+        return info
+
+    def drop_index(self, name):
+        conn = self._connection()
+        with _transaction(conn):
+            for index in self._indexes:
+                if index.name == name:
+                    conn.execute(f"DROP TABLE {index.table}")
+            conn.execute(f"DELETE FROM {INDEXES_TABLE} WHERE tabla = ? AND nombre = ?", (self.full_name, name))
+        self._schema = None
+
+    def drop(self):
+        conn = self._connection()
+        with _transaction(conn):
+            for index in self._indexes:
+                conn.execute(f"DROP TABLE IF EXISTS {index.table}")
+            conn.execute(f"DELETE FROM {INDEXES_TABLE} WHERE tabla = ?", (self.full_name,))
+            conn.execute(f"DROP TABLE IF EXISTS {self._table}")
+        self._created = False
+        self._schema = None
+
+    @staticmethod
+    def _insert_entries(conn, index, rowid, entries):
+        if not entries:
+            return
+        placeholders = ",".join("?" * (len(index.fields) + 1))
+        columns = ", ".join(f"k{position}" for position in range(len(index.fields)))
+        try:
+            conn.executemany(f"INSERT INTO {index.table} ({columns}, doc) VALUES ({placeholders})",
+                             [(*entry, rowid) for entry in entries])
+        except sqlite3.IntegrityError:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {index.table} index: {index.name}", 11000,
+                {"index": index.name},
+            )
+
+    @staticmethod
+    def _delete_entries(conn, index, rowid, entries):
+        if not entries:
+            return
+        columns = " AND ".join(f"k{position} = ?" for position in range(len(index.fields)))
+        conn.executemany(f"DELETE FROM {index.table} WHERE doc = ? AND {columns}",
+                         [(rowid, *entry) for entry in entries])
+
+    # --- Plan y lectura ---
+
+    def _plan(self, query):
+        plan = _Plan()
+        conditions = _conjunction(query)
+        by_field = plan.fields
+        for field, condition in conditions:
+            key_condition = _key_condition(condition)
+            if key_condition is not None and field not in by_field:
+                by_field[field] = key_condition
+        if "_id" in by_field:
+            plan.key = by_field["_id"]
+            if plan.key[0] == "eq":
+                return plan
+        best = None
+        for index in self._indexes:
+            if not index.usable(conditions):
+                continue
+            sql, params, score = _index_conditions(index, by_field)
+            if sql and (best is None or score > best[3]):
+                best = (index, sql, params, score)
+        if best is not None:
+            index, sql, params, _ = best
+            plan.index, plan.index_sql, plan.index_params = index, " AND ".join(sql), params
+            plan.ids_sql = f"SELECT i.doc FROM {index.table} AS i WHERE {plan.index_sql}"
+            plan.ids_params = params
+        elif plan.key is None:
+            self._plan_or(query, plan)
+        return plan
+
+    def _plan_or(self, query, plan):
+        """Un $or en el que cada rama usa un índice: la unión de sus candidatos."""
+        clauses = [query["$or"]] if "$or" in query else []
+        clauses += [clause["$or"] for clause in query.get("$and", []) if "$or" in clause]
+        for branches in clauses:
+            parts, params = [], []
+            for branch in branches:
+                branch_plan = self._plan(branch)
+                if branch_plan.ids_sql is not None and branch_plan.key is None:
+                    parts.append(branch_plan.ids_sql)
+                    params.extend(branch_plan.ids_params)
+                elif branch_plan.key is not None and branch_plan.ids_sql is None:
+                    parts.append(f"SELECT id AS doc FROM {self._table} WHERE {branch_plan.key_sql('clave', params)}")
+                else:
+                    break
+            else:
+                plan.ids_sql, plan.ids_params = " UNION ".join(parts), params
+                return
+
+    def _rows(self, query, sort=None, batch=FETCH_SIZE):
+        """
+        (rowid, bytes, documento) que cumplen `query`, en el orden de `sort`.
+        Por _id o por un campo de un índice precedido de igualdades se leen ya
+        en orden y por lotes; con cualquier otro orden se leen todos los
+        candidatos y se ordenan.
+        """
+        plan = self._plan(query)
+        order = sort[0] if sort else None
+        if order is None or order[0] == "_id":
+            if order is None and plan.ids_sql is not None:
+                yield from self._candidate_rows(query, plan)
+            else:
+                yield from self._key_order_rows(query, plan, order is not None and order[1] < 0, batch)
+            return
+        index, position = plan.index, None
+        if plan.key is None and index is not None:
+            position = _order_position(index, order[0], plan.fields)
+        elif plan.key is None and plan.ids_sql is None:
+            index = next((index for index in self._indexes if index.fields[0] == order[0] and not index.partial), None)
+            position = 0 if index is not None else None
+        if position is not None:
+            yield from self._index_order_rows(query, plan, index, position, order[1] < 0, sort[1:], batch)
+            return
+        rows = list(self._candidate_rows(query, plan) if plan.ids_sql is not None
+                    else self._key_order_rows(query, plan, False, FETCH_SIZE))
+        yield from self._sorted_group(rows, sort)
+
+    def _candidate_rows(self, query, plan):
+        """Sin orden: los rowids candidatos del índice y sus documentos por lotes."""
+        sql, params = f"SELECT DISTINCT doc FROM ({plan.ids_sql})", list(plan.ids_params)
+        if plan.key is not None:
+            sql = f"SELECT id FROM {self._table} WHERE id IN ({plan.ids_sql}) AND {plan.key_sql('clave', params)}"
+        with _command("find"):
+            ids = sorted(rowid for rowid, in self._connection().execute(sql, params))
+        for first in range(0, len(ids), FETCH_SIZE):
+            chunk = ids[first:first + FETCH_SIZE]
+            with _command("getMore" if first else "find"):
+                rows = self._connection().execute(
+                    f"SELECT id, doc FROM {self._table} WHERE id IN ({','.join('?' * len(chunk))})", chunk,
+                ).fetchall()
+            for rowid, data in rows:
+                doc = bson.decode(data)
+                if matches(doc, query):
+                    yield rowid, data, doc
+
+    def _key_order_rows(self, query, plan, descending, batch):
+        """
+        En orden de _id, por lotes paginados por clave: entre lotes no queda
+        nada abierto y el cursor se puede seguir leyendo desde otro hilo. El
+        primer lote es del tamaño pedido (find_one lee un documento) y crecen.
+        """
+        comparison, order = ("<", "DESC") if descending else (">", "ASC")
+        source, where, params = f"{self._table} AS m", [], []
+        if plan.ids_sql is not None:
+            # Primero los candidatos y luego su orden: no recorre la tabla entera por clave
+            source = f"(SELECT DISTINCT doc AS cid FROM ({plan.ids_sql})) AS c CROSS JOIN {self._table} AS m ON m.id = c.cid"
+            params += plan.ids_params
+        if plan.key is not None:
+            where.append(plan.key_sql("m.clave", params))
+        last, command = None, "find"
+        while True:
+            conditions = where + ([f"m.clave {comparison} ?"] if last is not None else [])
+            sql = f"SELECT m.id, m.clave, m.doc FROM {source}"
+            if conditions:
+                sql += " WHERE " + " AND ".join(conditions)
+            with _command(command):
+                rows = self._connection().execute(
+                    f"{sql} ORDER BY m.clave {order} LIMIT {batch}", params + ([last] if last is not None else []),
+                ).fetchall()
+            for rowid, _, data in rows:
+                doc = bson.decode(data)
+                if matches(doc, query):
+                    yield rowid, data, doc
+            if len(rows) < batch:
+                return
+            last, command, batch = rows[-1][1], "getMore", min(batch * 2, FETCH_SIZE)
+
+    def _index_order_rows(self, query, plan, index, position, descending, rest, batch):
+        """En el orden del campo `position` de `index`; los empates se ordenan por el resto de claves."""
+        comparison, order = ("<", "DESC") if descending else (">", "ASC")
+        column = f"i.k{position}"
+        where = [plan.index_sql] if plan.index is index else []
+        params = list(plan.index_params) if plan.index is index else []
+        seen, group, group_key = set(), [], None
+        last, command = None, "find"
+        while True:
+            conditions = where + ([f"({column}, i.doc) {comparison} (?, ?)"] if last is not None else [])
+            sql = f"SELECT {column}, i.doc, m.doc FROM {index.table} AS i CROSS JOIN {self._table} AS m ON m.id = i.doc"
+            if conditions:
+                sql += " WHERE " + " AND ".join(conditions)
+            with _command(command):
+                rows = self._connection().execute(
+                    f"{sql} ORDER BY {column} {order}, i.doc {order} LIMIT {batch}", params + (list(last) if last else []),
+                ).fetchall()
+            for key, rowid, data in rows:
+                # Un documento con un array aparece una vez por elemento: cuenta en la primera
+                if rowid in seen:
+                    continue
+                seen.add(rowid)
+                doc = bson.decode(data)
+                if not matches(doc, query):
+                    continue
+                if key != group_key:
+                    yield from self._sorted_group(group, rest)
+                    group, group_key = [], key
+                group.append((rowid, data, doc))
+            if len(rows) < batch:
+                break
+            last, command, batch = (rows[-1][0], rows[-1][1]), "getMore", min(batch * 2, FETCH_SIZE)
+        yield from self._sorted_group(group, rest)
+
+    @staticmethod
+    def _sorted_group(group, rest):
+        if rest and len(group) > 1:
+            by_identity = {id(doc): (rowid, data) for rowid, data, doc in group}
+            for doc in sort_documents([doc for _, _, doc in group], rest):
+                yield (*by_identity[id(doc)], doc)
+        else:
+            yield from group
+
+    def _documents(self, query, sort, skip, limit, batch):
+        rows = self._rows(query, sort, min(batch, skip + limit) if limit else batch)
+        try:
+            for position, (_, _, doc) in enumerate(rows):
+                if position < skip:
+                    continue
+                yield doc
+                if limit and position + 1 >= skip + limit:
+                    return
+        finally:
+            rows.close()
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, sort=None, batch_size=0, session=None, **kwargs):
+        return SQLiteCursor(self, filter, projection, sort, skip, limit, batch_size)
+
+    def find_one(self, filter=None, projection=None, *args, sort=None, session=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        return next(iter(self.find(filter, projection, sort=sort, limit=1)), None)
+
+    def count_documents(self, filter, session=None, limit=0, skip=0, **kwargs):
+        with _command("count"):
+            if not filter and not limit and not skip:
+                return self._connection().execute(f"SELECT count(*) FROM {self._table}").fetchone()[0]
+            return sum(1 for _ in self._documents(filter, None, skip, limit, FETCH_SIZE))
+
+    def estimated_document_count(self, **kwargs):
+        return self.count_documents({})
+
+    def distinct(self, key, filter=None, session=None, **kwargs):
+        values, seen = [], set()
+        for doc in self._documents(filter or {}, None, 0, 0, FETCH_SIZE):
+            for value in _flatten(_resolve(doc, key.split("."))):
+                if not isinstance(value, list) and encode_key(value) not in seen:
+                    seen.add(encode_key(value))
+                    values.append(value)
+        return values
+
+    def aggregate(self, pipeline, session=None, allowDiskUse=None, **kwargs):
+        """Pipeline en Python; un $match inicial usa los índices como find."""
+        stages = list(pipeline)
+        query = stages.pop(0)["$match"] if stages and "$match" in stages[0] else {}
+        with _command("aggregate"):
+            results = list(run_pipeline(self._documents(query, None, 0, 0, FETCH_SIZE), stages))
+        return _ListCursor(results)
+
+    # --- Escritura ---
+
+    def _insert(self, conn, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        data = bson.encode(doc)
+        with _savepoint(conn):
+            try:
+                rowid = conn.execute(f"INSERT INTO {self._table} (clave, doc) VALUES (?, ?)",
+                                     (encode_key(doc["_id"]), data)).lastrowid
+            except sqlite3.IntegrityError:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: {{ _id: {doc['_id']!r} }}",
+                    11000, {"index": "_id_", "keyValue": {"_id": doc["_id"]}},
+                )
+            for index in self._indexes:
+                self._insert_entries(conn, index, rowid, index.entries(doc))
+        return doc["_id"]
+
+    def _write(self, conn, rowid, old_doc, old_data, new_doc):
+        """Guarda la nueva versión de un documento y actualiza solo las claves de índice que cambian."""
+        data = bson.encode(new_doc)
+        if data == old_data:
+            return False
+        with _savepoint(conn):
+            conn.execute(f"UPDATE {self._table} SET doc = ? WHERE id = ?", (data, rowid))
+            for index in self._indexes:
+                old, new = index.entries(old_doc), index.entries(new_doc)
+                self._delete_entries(conn, index, rowid, old - new)
+                self._insert_entries(conn, index, rowid, new - old)
+        return True
+
+    def _delete(self, conn, rowid, doc):
+        conn.execute(f"DELETE FROM {self._table} WHERE id = ?", (rowid,))
+        for index in self._indexes:
+            conn.execute(f"DELETE FROM {index.table} WHERE doc = ?", (rowid,))
+
+    def _update(self, conn, query, update, upsert=False, multi=False, replacement=False, sort=None):
+        """Retorna (coincidencias, modificados, _id creado o None, [(antes, después)])."""
+        if replacement and any(key.startswith("$") for key in update):
+            raise ValueError("El documento de reemplazo no puede tener operadores")
+        if not replacement and not all(key.startswith("$") for key in update):
+            raise ValueError("La actualización debe usar operadores ($set, $inc...)")
+        targets = list(itertools.islice(self._rows(query, _normalize_sort(sort)), None if multi else 1))
+        if not targets:
+            if not upsert:
+                return 0, 0, None, []
+            doc = _upsert_document(query, update, replacement)
+            self._insert(conn, doc)
+            return 0, 0, doc["_id"], [(None, doc)]
+        modified, changes = 0, []
+        for rowid, data, doc in targets:
+            before = bson.decode(data)
+            if replacement:
+                if "_id" in update and not _equal(update["_id"], doc["_id"]):
+                    raise OperationFailure("El reemplazo no puede cambiar el _id", 66)
+                after = {"_id": doc["_id"], **{key: value for key, value in update.items() if key != "_id"}}
+            else:
+                after = apply_update(doc, update)
+            modified += self._write(conn, rowid, before, data, after)
+            changes.append((before, after))
+        return len(targets), modified, None, changes
+
+    def insert_one(self, document, session=None, **kwargs):
+        with _command("insert"):
+            conn = self._connection()
+            with _transaction(conn):
+                inserted_id = self._insert(conn, document)
+        return InsertOneResult(inserted_id, True)
+
+    def insert_many(self, documents, ordered=True, session=None, **kwargs):
+        documents = list(documents)
+        result = self.bulk_write([InsertOne(doc) for doc in documents], ordered=ordered, session=session)
+        return InsertManyResult([doc["_id"] for doc in documents], result.acknowledged)
+
+    def _update_result(self, command, query, update, upsert, multi, replacement):
+        with _command(command):
+            conn = self._connection()
+            with _transaction(conn):
+                matched, modified, upserted_id, _ = self._update(conn, query, update, upsert, multi, replacement)
+        raw = {"n": matched or (1 if upserted_id is not None else 0), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False, session=None, **kwargs):
+        return self._update_result("update", filter, update, upsert, False, False)
+
+    def update_many(self, filter, update, upsert=False, session=None, **kwargs):
+        return self._update_result("update", filter, update, upsert, True, False)
+
+    def replace_one(self, filter, replacement, upsert=False, session=None, **kwargs):
+        return self._update_result("update", filter, replacement, upsert, False, True)
+
+    def _find_and_modify(self, query, update, projection, sort, upsert, return_document, replacement):
+        with _command("findAndModify"):
+            conn = self._connection()
+            with _transaction(conn):
+                _, _, _, changes = self._update(conn, query, update, upsert, False, replacement, sort)
+        if not changes:
+            return None
+        before, after = changes[0]
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return None if doc is None else project(bson.decode(bson.encode(doc)), projection)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+        return self._find_and_modify(filter, update, projection, sort, upsert, return_document, False)
+
+    def find_one_and_replace(self, filter, replacement, projection=None, sort=None, upsert=False,
+                             return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+        return self._find_and_modify(filter, replacement, projection, sort, upsert, return_document, True)
+
+    def find_one_and_delete(self, filter, projection=None, sort=None, session=None, **kwargs):
+        with _command("findAndModify"):
+            conn = self._connection()
+            with _transaction(conn):
+                for rowid, _, doc in itertools.islice(self._rows(filter, _normalize_sort(sort)), 1):
+                    self._delete(conn, rowid, doc)
+                    return project(doc, projection)
+        return None
+
+    def _delete_matching(self, query, multi):
+        with _command("delete"):
+            conn = self._connection()
+            with _transaction(conn):
+                targets = list(itertools.islice(self._rows(query), None if multi else 1))
+                for rowid, _, doc in targets:
+                    self._delete(conn, rowid, doc)
+        return len(targets)
+
+    def delete_one(self, filter, session=None, **kwargs):
+        return DeleteResult({"n": self._delete_matching(filter, False)}, True)
+
+    def delete_many(self, filter, session=None, **kwargs):
+        return DeleteResult({"n": self._delete_matching(filter, True)}, True)
+
+    def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        """
+        Todas las operaciones en una transacción. Como en MongoDB, un error no
+        deshace las anteriores: con ordered se detiene y sin ordered sigue, y al
+        final se lanza BulkWriteError con los errores y lo que sí se escribió.
+        """
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        with _command("bulkWrite"):
+            conn = self._connection()
+            with _transaction(conn):
+                for position, request in enumerate(requests):
+                    try:
+                        self._bulk_operation(conn, request, position, result)
+                    except (DuplicateKeyError, OperationFailure) as e:
+                        result["writeErrors"].append({
+                            "index": position, "code": e.code, "errmsg": str(e),
+                            "op": getattr(request, "_doc", None),
+                        })
+                        if ordered:
+                            break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def _bulk_operation(self, conn, request, position, result):
+        if isinstance(request, InsertOne):
+            self._insert(conn, request._doc)
+            result["nInserted"] += 1
+        elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+            matched, modified, upserted_id, _ = self._update(
+                conn, request._filter, request._doc, request._upsert,
+                isinstance(request, UpdateMany), isinstance(request, ReplaceOne),
+            )
+            result["nMatched"] += matched
+            result["nModified"] += modified
+            if upserted_id is not None:
+                result["nUpserted"] += 1
+                result["upserted"].append({"index": position, "_id": upserted_id})
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            for rowid, _, doc in list(itertools.islice(self._rows(request._filter),
+                                                       None if isinstance(request, DeleteMany) else 1)):
+                self._delete(conn, rowid, doc)
+                result["nRemoved"] += 1
+        else:
+            raise TypeError(f"Operación no soportada en bulk_write: {request!r}")
+
+
+class _ListCursor:
+    """Resultado de aggregate, ya calculado."""
+
+    def __init__(self, docs):
+        self._docs = iter(docs)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._docs)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
@@ -2,7 +2,12 @@
 
 # Importa la instancia 'app' de tu archivo app.py
 # Gunicorn buscará la variable 'app' aquí para ejecutar tu aplicación FastAPI.
-from app.app import app 
+from app.app import app
+from app.controlador.PatientValidator import preload_models
+
+# Con preload_app (gunicorn.conf.py) este módulo se importa una sola vez en el
+# maestro: el modelo Patient queda cargado antes del fork y los workers lo
+# comparten (copy-on-write) en lugar de importarlo cada uno al arrancar.
+preload_models()
 
-# NO DEBE HABER NADA MÁS AQUÍ.
 # El bloque if __name__ == "__main__": con uvicorn.run() pertenece a app.py.
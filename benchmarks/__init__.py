@@ -0,0 +1,23 @@
+# Los benchmarks y las pruebas (tests/) usan mongomock como MongoDB en memoria.
+# pymongo 4.9+ pasa `sort` a cada operación de una bulk_write y el
+# BulkOperationBuilder de mongomock no lo admite (TypeError antes de escribir
+# nada): se descarta aquí, al importar el paquete, y no en la aplicación.
+import inspect
+
+import mongomock.collection
+
+
+def patch_mongomock():
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ("add_update", "add_replace", "add_delete"):
+        method = getattr(builder, name)
+        if "sort" in inspect.signature(method).parameters:
+            continue
+
+        def without_sort(self, *args, _method=method, sort=None, **kwargs):
+            return _method(self, *args, **kwargs)
+
+        setattr(builder, name, without_sort)
+
+
+patch_mongomock()
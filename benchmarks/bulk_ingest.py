@@ -0,0 +1,45 @@
+# benchmarks/bulk_ingest.py
+#
+# Throughput de ingesta: un insert_one por paciente (un POST /api/patients por
+# registro) frente a bulk_create_patients (Bundle batch / $import), contra
+# mongomock con una latencia de red simulada por operación.
+#
+# Uso: python -m benchmarks.bulk_ingest --n 2000 --rtt-ms 5
+
+import argparse
+import time
+
+import mongomock
+
+from app.controlador.PatientCrud import PatientCrud
+from benchmarks.datos import synthetic_patient
+from benchmarks.load_async import LatencyCollection
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=2000)
+    parser.add_argument("--rtt-ms", type=float, default=5.0)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    payloads = [synthetic_patient(i) for i in range(args.n)]
+    rtt = args.rtt_ms / 1000
+
+    single = PatientCrud(collection=LatencyCollection(mongomock.MongoClient().db.patients, rtt))
+    start = time.perf_counter()
+    for payload in payloads:
+        single.create_or_update_patient_fhir_resource(payload)
+    single_rate = args.n / (time.perf_counter() - start)
+
+    bulk = PatientCrud(collection=LatencyCollection(mongomock.MongoClient().db.patients, rtt))
+    start = time.perf_counter()
+    bulk.bulk_create_patients(payloads, chunk_size=args.chunk_size)
+    bulk_rate = args.n / (time.perf_counter() - start)
+
+    print(f"insert_one por paciente: {single_rate:10.0f} pacientes/s")
+    print(f"bulk_write por bloques:  {bulk_rate:10.0f} pacientes/s  (x{bulk_rate / single_rate:.1f})")
+
+
+if __name__ == "__main__":
+    main()
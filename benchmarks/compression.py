@@ -0,0 +1,99 @@
+# benchmarks/compression.py
+#
+# Compresión de respuestas (CompressionMiddleware) y revalidación de listados,
+# con la API en el mismo proceso (httpx.ASGITransport, como benchmarks/suite.py).
+# Para cada listado y codificación (sin comprimir, gzip, br, zstd) mide los
+# bytes enviados, el tiempo del servidor y el de descompresión en el cliente,
+# y estima la latencia extremo a extremo con un ancho de banda dado:
+#   servidor + bytes / ancho de banda + descompresión.
+# Mide también la revalidación con If-None-Match (304, sin cuerpo).
+#
+# Uso: python -m benchmarks.compression --size 5000 --mbps 20
+
+import argparse
+import asyncio
+import gzip
+import time
+
+import httpx
+
+from app.controlador.compresion import ENCODERS
+from benchmarks.suite import Backend, install, percentile, seed
+
+ENDPOINTS = {
+    "página _count=50": "/api/patients?_count=50",
+    "página _count=1000": "/api/patients?_count=1000",
+    "resumen _count=1000": "/api/patients/summary?_count=1000",
+    "ndjson completo": "/api/patients?_stream=ndjson",
+}
+
+
+def decoder(encoding):
+    if encoding == "gzip":
+        return gzip.decompress
+    if encoding == "br":
+        import brotli
+        return brotli.decompress
+    if encoding == "zstd":
+        import zstandard
+        return lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return lambda data: data
+
+
+async def fetch(client, path, headers):
+    start = time.perf_counter()
+    async with client.stream("GET", path, headers=headers) as response:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    return time.perf_counter() - start, response, body
+
+
+async def run(app, args):
+    transport = httpx.ASGITransport(app=app)
+    encodings = ["identity"] + [e for e in ("gzip", "br", "zstd") if e in ENCODERS]
+    bandwidth = args.mbps * 1_000_000 / 8
+    print(f"{'listado':<22} {'codificación':<9} {'bytes':>10} {'servidor ms':>12} {'descompr. ms':>13}"
+          f" {'e2e ms':>9}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, path in ENDPOINTS.items():
+            for encoding in encodings:
+                headers = {"accept-encoding": encoding}
+                await fetch(client, path, headers)
+                server, decode, size = [], [], 0
+                for _ in range(args.repeat):
+                    elapsed, response, body = await fetch(client, path, headers)
+                    start = time.perf_counter()
+                    decoder(response.headers.get("content-encoding"))(body)
+                    decode.append(time.perf_counter() - start)
+                    server.append(elapsed)
+                    size = len(body)
+                server.sort()
+                decode.sort()
+                server_ms, decode_ms = percentile(server, 50) * 1000, percentile(decode, 50) * 1000
+                e2e = server_ms + size / bandwidth * 1000 + decode_ms
+                print(f"{name:<22} {encoding:<9} {size:>10} {server_ms:>12.2f} {decode_ms:>13.2f} {e2e:>9.1f}")
+
+        path = ENDPOINTS["página _count=1000"]
+        _, response, _ = await fetch(client, path, {})
+        etag = response.headers["etag"]
+        samples = sorted([(await fetch(client, path, {"if-none-match": etag}))[0] for _ in range(args.repeat)])
+        print(f"\nrevalidación 304 de '{path}': {percentile(samples, 50) * 1000:.2f} ms, sin cuerpo")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=5000, help="pacientes sembrados")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--mbps", type=float, default=20.0, help="ancho de banda supuesto hasta el cliente")
+    parser.add_argument("--mongo-uri", default="", help="mongod desechable en lugar de mongomock")
+    args = parser.parse_args()
+
+    backend = Backend(args.mongo_uri or None)
+    try:
+        seed(backend, args.size)
+        asyncio.run(run(install(backend), args))
+    finally:
+        backend.drop()
+
+
+if __name__ == "__main__":
+    main()
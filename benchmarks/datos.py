@@ -0,0 +1,75 @@
+# benchmarks/datos.py
+#
+# Pacientes FHIR sintéticos con la misma forma que el ejemplo de
+# oldFiles/validatePatient.py, para los benchmarks.
+
+import copy
+import random
+
+SAMPLE_PATIENT = {
+    "resourceType": "Patient",
+    "identifier": [
+        {
+            "use": "official",
+            "type": {
+                "coding": [{"system": "http://terminology.hl7.org/CodeSystem/v2-0203", "code": "ID"}],
+                "text": "Cédula de Ciudadanía",
+            },
+            "value": "1020713756",
+        },
+        {
+            "use": "usual",
+            "type": {
+                "coding": [{"system": "http://terminology.hl7.org/CodeSystem/v2-0203", "code": "PPN"}],
+                "text": "Pasaporte",
+            },
+            "value": "AQ123456789",
+        },
+    ],
+    "name": [
+        {
+            "use": "official",
+            "text": "Mario Enrique Duarte",
+            "family": "Duarte",
+            "given": ["Mario", "Enrique"],
+        }
+    ],
+    "telecom": [
+        {"system": "phone", "value": "3142279487", "use": "mobile"},
+        {"system": "email", "value": "mardugo@gmail.com", "use": "home"},
+    ],
+    "gender": "male",
+    "birthDate": "1986-02-25",
+    "address": [
+        {
+            "use": "home",
+            "line": ["Cra 55A # 167A - 30"],
+            "city": "Bogotá",
+            "state": "Cundinamarca",
+            "postalCode": "11156",
+            "country": "COL",
+        }
+    ],
+}
+
+FAMILIES = ["Duarte", "Pérez", "Gómez", "Rodríguez", "Martínez", "López", "García", "Hernández", "Ruiz", "Díaz"]
+GIVEN = ["Mario", "Carlos", "Ana", "Laura", "Juan", "María", "Andrés", "Sofía", "Diego", "Valentina"]
+CITIES = ["Bogotá", "Medellín", "Cali", "Barranquilla", "Cartagena", "Bucaramanga"]
+GENDERS = ["male", "female", "other", "unknown"]
+
+
+def synthetic_patient(i, rng=None):
+    """Genera el paciente número `i`, con identificadores únicos y datos variados."""
+    rng = rng or random.Random(i)
+    patient = copy.deepcopy(SAMPLE_PATIENT)
+    family = rng.choice(FAMILIES)
+    given = [rng.choice(GIVEN), rng.choice(GIVEN)]
+    patient["identifier"][0]["value"] = str(1000000000 + i)
+    patient["identifier"][1]["value"] = f"AQ{i:09d}"
+    patient["name"][0].update({"family": family, "given": given, "text": f"{' '.join(given)} {family}"})
+    patient["telecom"][0]["value"] = f"3{rng.randrange(10**9):09d}"
+    patient["telecom"][1]["value"] = f"paciente{i}@example.com"
+    patient["gender"] = rng.choice(GENDERS)
+    patient["birthDate"] = f"{rng.randint(1930, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    patient["address"][0]["city"] = rng.choice(CITIES)
+    return patient
@@ -0,0 +1,95 @@
+# benchmarks/events.py
+#
+# Reparto de notificaciones (app/controlador/EventBus.py) en un worker: un único
+# vigilante (consulta periódica sobre mongomock, como un mongod sin replica set)
+# entrega cada alta a --subscribers clientes suscritos. Mide el tiempo desde la
+# escritura hasta que el último cliente la recibe y cuántas consultas hizo el
+# vigilante: no crecen con el número de clientes, cada cambio se lee y se
+# serializa una sola vez. Las altas llegan de golpe: con más de EVENT_QUEUE_SIZE
+# (256) pendientes un cliente recibe "resync" en lugar de los eventos.
+#
+# Uso: python -m benchmarks.events --subscribers 1000 --events 200
+
+import argparse
+import asyncio
+import os
+import time
+
+import mongomock
+
+# Consulta frecuente y sin retraso: se mide el reparto, no la espera
+os.environ.setdefault("EVENT_POLL_INTERVAL", "0.05")
+os.environ.setdefault("EVENT_POLL_LAG_MS", "0")
+
+from app.controlador.EventBus import RESYNC, EventBus
+from app.controlador.fechas import now_instant
+from benchmarks.datos import synthetic_patient
+
+
+class CountingCollection:
+    """La colección, contando las consultas que hace el vigilante."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.queries = 0
+
+    def find(self, *args, **kwargs):
+        self.queries += 1
+        return self._collection.find(*args, **kwargs)
+
+    def find_one(self, *args, **kwargs):
+        self.queries += 1
+        return self._collection.find_one(*args, **kwargs)
+
+
+async def consume(subscription, expected, received):
+    count = 0
+    async for event in subscription.events(heartbeat=60):
+        if event is RESYNC:
+            return
+        count += 1
+        if count == expected:
+            received.append(time.perf_counter())
+            return
+
+
+async def run(args):
+    collection = mongomock.MongoClient().db.patients
+    counting = CountingCollection(collection)
+    bus = EventBus({"Patient": (lambda: counting, lambda doc: doc)}, source="polling",
+                   max_subscribers=args.subscribers)
+    subscriptions = [bus.subscribe({"Patient"}) for _ in range(args.subscribers)]
+    received = []
+    consumers = [asyncio.create_task(consume(s, args.events, received)) for s in subscriptions]
+    await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    for n in range(args.events):
+        patient = synthetic_patient(n)
+        patient["meta"] = {"lastUpdated": now_instant(), "versionId": "1"}
+        collection.insert_one(patient)
+    written = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*consumers), 60)
+    bus.close()
+    if len(received) < args.subscribers:
+        print(f"{args.subscribers - len(received)} clientes se quedaron atrás (resync): reduzca --events")
+        return
+
+    deliveries = args.events * args.subscribers
+    print(f"{args.subscribers} clientes, {args.events} altas: {deliveries:,} entregas")
+    print(f"  escritura de la última alta -> recibida por todos: {(max(received) - written) * 1000:.0f} ms "
+          f"(incluye el intervalo de la consulta periódica)")
+    print(f"  entregas por segundo: {deliveries / (max(received) - start):,.0f}")
+    print(f"  consultas del vigilante: {counting.queries} (independiente del número de clientes)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
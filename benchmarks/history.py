@@ -0,0 +1,110 @@
+# benchmarks/history.py
+#
+# Historial de versiones de pacientes (PatientHistory) contra mongomock: aplica
+# cientos de revisiones pequeñas a unos pacientes y mide
+#   - bytes BSON por versión en patients_history frente a guardar el recurso
+#     completo en cada versión;
+#   - latencia de vread según la distancia a la última instantánea (cuántos
+#     parches hay que aplicar) y de una página de _history.
+#
+# Uso: python -m benchmarks.history --patients 20 --revisions 300
+
+import argparse
+import copy
+import random
+import time
+
+import bson
+import mongomock
+from bson.objectid import ObjectId
+
+from app.controlador.PatientCrud import PatientCrud, public_resource
+from app.controlador.PatientHistory import HISTORY_SNAPSHOT_INTERVAL
+from benchmarks.datos import CITIES, FAMILIES, synthetic_patient
+from benchmarks.suite import percentile
+
+
+def revise(patient, rng):
+    """Un cambio pequeño y realista: teléfono, correo, dirección o apellido."""
+    patient = copy.deepcopy(patient)
+    patient.pop("meta", None)
+    change = rng.randrange(4)
+    if change == 0:
+        patient["telecom"][0]["value"] = f"31{rng.randrange(10**8):08d}"
+    elif change == 1:
+        patient["telecom"][1]["value"] = f"usuario{rng.randrange(10**6)}@correo.com"
+    elif change == 2:
+        patient["address"][0]["line"] = [f"Calle {rng.randrange(200)} # {rng.randrange(100)} - {rng.randrange(100)}"]
+        patient["address"][0]["city"] = rng.choice(CITIES)
+    else:
+        patient["name"][0]["family"] = rng.choice(FAMILIES)
+    return patient
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return percentile(samples, 50) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--revisions", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    db = mongomock.MongoClient().db
+    crud = PatientCrud(collection=db.patients, history_collection=db.patients_history)
+    crud.ensure_indexes()
+    rng = random.Random(1)
+
+    def stored_size(patient_id):
+        return len(bson.encode(public_resource(db.patients.find_one({"_id": ObjectId(patient_id)}))))
+
+    full_bytes = 0
+    ids = []
+    start = time.perf_counter()
+    for n in range(args.patients):
+        patient = synthetic_patient(n)
+        status, patient_id = crud.upsert_patient(patient)
+        assert status == "created", status
+        ids.append(patient_id)
+        full_bytes += stored_size(patient_id)
+        for _ in range(args.revisions):
+            patient = revise(patient, rng)
+            status, _ = crud.update_patient(patient_id, patient)
+            assert status == "updated", status
+            full_bytes += stored_size(patient_id)
+    elapsed = time.perf_counter() - start
+
+    versions = args.patients * (args.revisions + 1)
+    history_bytes = sum(len(bson.encode(entry)) for entry in db.patients_history.find())
+    snapshots = db.patients_history.count_documents({"tipo": "instantanea"})
+    print(f"{versions} versiones ({snapshots} instantáneas, intervalo {HISTORY_SNAPSHOT_INTERVAL})"
+          f" escritas en {elapsed:.1f}s ({elapsed / versions * 1000:.2f} ms/versión)")
+    print(f"bytes por versión: historial {history_bytes / versions:.0f}"
+          f" | recurso completo {full_bytes / versions:.0f}"
+          f" ({history_bytes / full_bytes:.1%})")
+
+    patient_id = ids[0]
+    print(f"\n{'parches a aplicar':>18} {'vread p50 ms':>13}")
+    for distance in sorted({0, 1, HISTORY_SNAPSHOT_INTERVAL // 2, HISTORY_SNAPSHOT_INTERVAL - 1}):
+        version = HISTORY_SNAPSHOT_INTERVAL + 1 + distance
+        if version > args.revisions + 1:
+            continue
+        ms = timed(lambda: crud.get_patient_version(patient_id, version), args.repeat)
+        print(f"{distance:>18} {ms:>13.2f}")
+
+    print(f"\n{'_history _count':>18} {'p50 ms':>13}")
+    for count in (10, 50, 100):
+        ms = timed(lambda: crud.get_patient_history(patient_id, count), args.repeat)
+        print(f"{count:>18} {ms:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/hl7_parser.py
+#
+# Rendimiento del parser HL7 v2 (app/controlador/hl7v2.py) en un solo núcleo,
+# con mensajes sintéticos ADT^A04 y ORM^O01 construidos a partir de los
+# pacientes de benchmarks/datos.py. Mide mensajes por segundo de:
+#   - parse: separar mensajes y segmentos de un flujo leído en trozos de 64 KiB
+#   - mllp: lo mismo, pero desde tramas MLLP (MLLPDecoder + parse)
+#   - parse + mapeo: además, Patient FHIR y citas de cada mensaje (sin validar)
+# El objetivo es del orden de decenas de miles de mensajes por segundo.
+#
+# Uso: python -m benchmarks.hl7_parser --n 50000
+
+import argparse
+import time
+
+from app.controlador.HL7Ingest import map_message
+from app.controlador.MLLPServer import MLLPDecoder, frame
+from app.controlador.hl7v2 import escape, iter_messages
+from benchmarks.datos import synthetic_patient
+
+CHUNK = 64 * 1024
+_SEX = {"male": "M", "female": "F", "other": "O", "unknown": "U"}
+
+
+def pid_segment(n):
+    patient = synthetic_patient(n)
+    name = patient["name"][0]
+    address = patient["address"][0]
+    phone = next(t["value"] for t in patient["telecom"] if t["system"] == "phone")
+    email = next(t["value"] for t in patient["telecom"] if t["system"] == "email")
+    return (
+        f"PID|1||{patient['identifier'][0]['value']}^^^HOSP^MR~{patient['identifier'][1]['value']}^^^MINREL^PPN||"
+        f"{escape(name['family'])}^{escape(name['given'][0])}^{escape(name['given'][1])}^^^^L||"
+        f"{patient['birthDate'].replace('-', '')}|{_SEX[patient['gender']]}|||"
+        f"{escape(address['line'][0])}^^{address['city']}^{address['state']}^{address['postalCode']}^{address['country']}^H"
+        f"||{phone}^PRN^PH~^NET^Internet^{email}"
+    )
+
+
+def message(n):
+    header = f"MSH|^~\\&|HIS|HOSP|LIS|LAB|20240105101500||{{}}|MSG{n}|P|2.5.1\r"
+    if n % 2:
+        return (header.format("ORM^O01") + pid_segment(n) + "\r"
+                f"ORC|NW|ORD{n}^HIS|||||^^^20240110083000\r"
+                f"OBR|1|ORD{n}^HIS||GLU^Glucosa^L|||20240109\r"
+                f"OBR|2|ORD{n}^HIS||HB^Hemograma completo^L|||20240109\r")
+    return header.format("ADT^A04") + f"EVN|A04|20240105101500\r{pid_segment(n)}\rPV1|1|O\r"
+
+
+def rate(label, n, seconds):
+    print(f"{label:<16} {n / seconds:>12,.0f} mensajes/s  ({seconds * 1e6 / n:.1f} µs/mensaje)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=50000)
+    args = parser.parse_args()
+
+    messages = [message(n) for n in range(args.n)]
+    stream = "".join(messages).encode()
+    chunks = [stream[i:i + CHUNK] for i in range(0, len(stream), CHUNK)]
+    framed = b"".join(frame(m.encode()) for m in messages)
+    framed_chunks = [framed[i:i + CHUNK] for i in range(0, len(framed), CHUNK)]
+    print(f"{args.n} mensajes, {len(stream) / args.n:.0f} bytes de media\n")
+
+    # Los mensajes no se conservan, como en la ingesta: retenerlos todos haría
+    # que el recolector de ciclos recorriera cada vez más objetos
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_messages(chunks))
+    rate("parse", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    decoder, count = MLLPDecoder(), 0
+    for chunk in framed_chunks:
+        for payload in decoder.feed(chunk):
+            count += sum(1 for _ in iter_messages([payload]))
+    rate("mllp", count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    count = sum(1 for m in iter_messages(chunks) if map_message(m))
+    rate("parse + mapeo", count, time.perf_counter() - start)
+    assert count == args.n
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/load_async.py
+#
+# Prueba de carga de la capa de datos async (AsyncCrud) contra mongomock.
+# mongomock responde en microsegundos, así que cada operación se envuelve con
+# una latencia simulada (--rtt-ms) que representa el viaje de ida y vuelta a Atlas.
+#
+# Compara, para N peticiones en vuelo:
+#   - "bloqueante": la llamada síncrona directa dentro de la corrutina (lo que
+#     hacían las rutas antes), que serializa todo el worker.
+#   - "async": la misma llamada a través de AsyncCrud.
+#
+# Uso: python -m benchmarks.load_async --requests 400 --rtt-ms 5
+
+import argparse
+import asyncio
+import time
+
+import mongomock
+
+from app.controlador.AsyncCrud import AsyncCrud
+from app.controlador.PatientCrud import PatientCrud
+
+
+class LatencyCollection:
+    """Proxy de colección que añade una latencia fija a cada operación."""
+
+    def __init__(self, collection, rtt):
+        self._collection = collection
+        self._rtt = rtt
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._rtt)
+            return attr(*args, **kwargs)
+        return call
+
+
+def build_crud(rtt):
+    collection = mongomock.MongoClient().db.patients
+    ids = [str(collection.insert_one({"resourceType": "Patient", "gender": "female"}).inserted_id) for _ in range(50)]
+    return PatientCrud(collection=LatencyCollection(collection, rtt)), ids
+
+
+async def run_blocking(crud, ids, total, in_flight):
+    sem = asyncio.Semaphore(in_flight)
+
+    async def one(i):
+        async with sem:
+            crud.get_patient_by_object_id(ids[i % len(ids)])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def run_async(crud, ids, total, in_flight):
+    async_crud = AsyncCrud(crud)
+    sem = asyncio.Semaphore(in_flight)
+
+    async def one(i):
+        async with sem:
+            await async_crud.get_patient_by_object_id(ids[i % len(ids)])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rtt-ms", type=float, default=5.0)
+    parser.add_argument("--in-flight", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    crud, ids = build_crud(args.rtt_ms / 1000)
+    print(f"{'en vuelo':>9} {'bloqueante req/s':>18} {'async req/s':>12}")
+    for in_flight in (int(n) for n in args.in_flight.split(",")):
+        blocking = asyncio.run(run_blocking(crud, ids, args.requests, in_flight))
+        non_blocking = asyncio.run(run_async(crud, ids, args.requests, in_flight))
+        print(f"{in_flight:>9} {blocking:>18.1f} {non_blocking:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
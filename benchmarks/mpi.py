@@ -0,0 +1,105 @@
+# benchmarks/mpi.py
+#
+# Índice maestro de pacientes (app/controlador/PatientMatch.py y PatientDedup.py)
+# con pacientes sintéticos de benchmarks/datos.py y un --dup-rate de duplicados
+# con errores típicos de digitación: una letra del apellido cambiada, sin
+# segundo nombre, otro identificador, día y mes intercambiados...
+#   - puntuación: pares por segundo al puntuar con numpy todos los pares de un bloque
+#   - coincidencias al escribir: latencia de PatientMatcher.find_matches (consulta + puntuación)
+#   - deduplicación: PatientDedup en línea sobre mongomock, con precisión y
+#     exhaustividad frente a los duplicados introducidos
+#
+# Uso: python -m benchmarks.mpi --n 20000 --dup-rate 0.1
+
+import argparse
+import copy
+import random
+import time
+
+import mongomock
+
+from app.controlador.PatientDedup import PatientDedup
+from app.controlador.PatientMatch import MATCH_FIELD, MatchFeatures, PatientMatcher, match_fields, match_pairs
+from benchmarks.datos import synthetic_patient
+
+
+def misspell(rng, word):
+    position = rng.randrange(len(word))
+    return word[:position] + rng.choice("aeiousznbv") + word[position + 1:]
+
+
+def duplicate(rng, patient):
+    """El mismo paciente registrado otra vez, con uno o dos errores."""
+    dup = copy.deepcopy(patient)
+    name = dup["name"][0]
+    for change in rng.sample(["family", "given", "identifier", "birth", "telecom"], 2):
+        if change == "family":
+            name["family"] = misspell(rng, name["family"])
+        elif change == "given":
+            name["given"] = name["given"][:1]
+        elif change == "identifier":
+            dup["identifier"] = [{"system": "urn:otro-sistema", "value": f"X{rng.randrange(10**8)}"}]
+        elif change == "birth":
+            year, month, day = dup["birthDate"].split("-")
+            if int(day) <= 12:
+                dup["birthDate"] = f"{year}-{day}-{month}"
+        else:
+            dup["telecom"] = [t for t in dup["telecom"] if t["system"] != "phone"]
+    name["text"] = " ".join(name["given"] + [name["family"]])
+    return dup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dup-rate", type=float, default=0.1)
+    parser.add_argument("--block", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    patients, truth = [], set()
+    for i in range(args.n):
+        patient = synthetic_patient(i)
+        patient["_id"] = i
+        patients.append(patient)
+        if rng.random() < args.dup_rate:
+            dup = duplicate(rng, patient)
+            dup["_id"] = args.n + len(truth)
+            truth.add((i, dup["_id"]))
+            patients.append(dup)
+
+    docs = [{"_id": p["_id"], MATCH_FIELD: match_fields(p)} for p in patients[:args.block]]
+    start, rounds = time.perf_counter(), 0
+    while time.perf_counter() - start < 2:
+        match_pairs(MatchFeatures.from_documents(docs))
+        rounds += 1
+    seconds = (time.perf_counter() - start) / rounds
+    pairs = args.block * (args.block - 1) // 2
+    print(f"puntuación: bloque de {args.block}: {seconds * 1000:.1f} ms, {pairs / seconds:,.0f} pares/s")
+
+    collection = mongomock.MongoClient().db.patients
+    # Con `_mpi` ya calculado, como los guarda la API: mongomock actualiza
+    # recorriendo la colección y el relleno dominaría la medida
+    collection.insert_many([{**p, MATCH_FIELD: match_fields(p)} for p in patients])
+    dedup = PatientDedup(collection=collection, processes=0)
+    summary = dedup.run()
+    found = {
+        tuple(sorted(int(p) for p in link["pacientes"]))
+        for link in dedup.matcher.collection.find({"grado": {"$in": ["certain", "probable"]}})
+    }
+    true_positives = len(found & truth)
+    print(f"deduplicación: {len(patients)} pacientes, {len(truth)} duplicados, {summary['comparisons']:,} comparaciones "
+          f"en {summary['seconds']} s")
+    print(f"  pares certain+probable: {len(found)}  precisión {true_positives / max(len(found), 1):.3f}  "
+          f"exhaustividad {true_positives / max(len(truth), 1):.3f}  (possible: {summary['pairs']['possible']})")
+
+    matcher = PatientMatcher(patients_collection=collection)
+    sample = [duplicate(rng, patients[i]) for i in range(0, min(args.n, 2000), 10)]
+    start = time.perf_counter()
+    for patient in sample:
+        matcher.find_matches(patient)
+    print(f"coincidencias al escribir: {(time.perf_counter() - start) * 1000 / len(sample):.2f} ms por paciente (mongomock)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/overload.py
+#
+# Prueba de sobrecarga del control de admisión (app/controlador/admision.py),
+# con la API en el mismo proceso (httpx.ASGITransport) y mongomock con una
+# latencia simulada por operación. Los hilos de AsyncCrud (--db-threads) hacen
+# de pool de conexiones: caben unas db-threads / rtt operaciones por segundo
+# (una búsqueda puede hacer más de una).
+#
+# Carga en bucle abierto: las peticiones llegan a ritmo fijo (--overload veces
+# la capacidad) durante --seconds, con o sin control de admisión, repartidas
+# entre --clients IPs (X-Forwarded-For). Sin admisión la cola crece y la
+# latencia con ella; con admisión lo que no cabe se rechaza con 503 y la
+# latencia de las peticiones atendidas queda acotada por la espera máxima.
+#
+# Uso: python -m benchmarks.overload --rtt-ms 50 --db-threads 8 --overload 2
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+# Sin admisión casi todas las peticiones son lentas: no registrarlas una a una
+os.environ.setdefault("SLOW_REQUEST_MS", "600000")
+# Los clientes simulados se distinguen por X-Forwarded-For, como detrás de Render
+os.environ.setdefault("TRUST_FORWARDED_FOR", "1")
+
+import httpx
+
+from app.controlador import AsyncCrud as async_crud
+from app.controlador import admision
+from app.controlador.admision import ConcurrencyLimit, admission
+from benchmarks.suite import Backend, install, percentile, seed
+
+
+async def offered_load(client, paths, rate, seconds, clients):
+    """
+    Lanza rate * seconds peticiones a ritmo fijo. Retorna [(status, segundos)]
+    y el tiempo hasta que termina la última.
+    """
+    rng = random.Random(0)
+    results = []
+
+    async def one(path, ip):
+        start = time.perf_counter()
+        response = await client.get(path, headers={"x-forwarded-for": ip})
+        results.append((response.status_code, time.perf_counter() - start))
+
+    tasks = []
+    start = time.perf_counter()
+    for n in range(int(rate * seconds)):
+        delay = start + n / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(rng.choice(paths), f"10.0.{n % clients // 256}.{n % clients % 256}")))
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def report(name, results, seconds, elapsed):
+    ok = sorted(latency for status, latency in results if status == 200)
+    everything = sorted(latency for _, latency in results)
+    shed = sum(1 for status, _ in results if status in (429, 503))
+    ok_p50, ok_p99 = (percentile(ok, 50) * 1000, percentile(ok, 99) * 1000) if ok else (0, 0)
+    print(f"{name:<14} {len(results) / seconds:>9.0f} {len(ok) / elapsed:>8.0f} {shed / len(results):>9.1%}"
+          f" {ok_p50:>9.0f} {ok_p99:>9.0f} {percentile(everything, 99) * 1000:>10.0f}"
+          f" {everything[-1] * 1000:>9.0f}")
+
+
+async def run(app, ids, args):
+    rtt = args.rtt_ms / 1000
+    capacity = args.db_threads / rtt
+    rate = capacity * args.overload
+    paths = [f"/api/patients?identifier={i}" for i in ids]
+    transport = httpx.ASGITransport(app=app)
+    print(f"{capacity:.0f} operaciones/s de base de datos, carga ofrecida {rate:.0f} req/s durante {args.seconds:.0f} s\n")
+    print(f"{'':<14} {'ofrecidas':>9} {'200/s':>8} {'rechazo':>9} {'p50 200':>9} {'p99 200':>9}"
+          f" {'p99 todas':>10} {'máx':>9}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for enabled in (False, True):
+            admision.ADMISSION_ENABLED = enabled
+            admission._limits = {
+                "read": ConcurrencyLimit(
+                    args.db_threads, int(args.db_threads * args.queue_factor), args.queue_timeout_ms / 1000
+                ),
+            }
+            results, elapsed = await offered_load(client, paths, rate, args.seconds, args.clients)
+            report("con admisión" if enabled else "sin admisión", results, args.seconds, elapsed)
+            # Que la cola del escenario anterior no afecte al siguiente
+            await asyncio.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=50, help="pacientes sembrados (mongomock recorre la colección en cada búsqueda)")
+    parser.add_argument("--rtt-ms", type=float, default=50.0)
+    parser.add_argument("--db-threads", type=int, default=8, help="hilos de AsyncCrud (pool de conexiones)")
+    parser.add_argument("--overload", type=float, default=2.0, help="carga ofrecida / capacidad")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--queue-factor", type=float, default=admision.ADMISSION_QUEUE_FACTOR)
+    parser.add_argument("--queue-timeout-ms", type=float, default=admision.ADMISSION_QUEUE_TIMEOUT_MS)
+    args = parser.parse_args()
+
+    # Antes de la primera llamada: el pool de hilos se crea en el primer uso
+    async_crud.DB_THREADS = args.db_threads
+    backend = Backend(rtt=args.rtt_ms / 1000)
+    try:
+        ids = seed(backend, args.size)
+        asyncio.run(run(install(backend), ids, args))
+    finally:
+        backend.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/search_explain.py
+#
+# Comprueba con explain() que cada parámetro de búsqueda de Patient se resuelve
+# con un índice (IXSCAN) y no recorriendo la colección (COLLSCAN).
+# Necesita un mongod real (mongomock no implementa explain):
+#
+#   MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.search_explain
+
+import sys
+
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.PatientSearch import build_query
+from benchmarks.datos import synthetic_patient
+from connection import get_db
+
+QUERIES = {
+    "name": [("name", "dua")],
+    "family": [("family", "gomez")],
+    "given": [("given", "ana")],
+    "birthdate": [("birthdate", "ge1990-01-01")],
+    "gender": [("gender", "female")],
+    "telecom": [("telecom", "paciente3@example.com")],
+    "address-city": [("address-city", "bogota")],
+    "identifier": [("identifier", "1000000005")],
+    "_lastUpdated": [("_lastUpdated", "gt2020-01-01")],
+}
+
+
+def stages(plan):
+    yield plan.get("stage")
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from stages(child)
+
+
+def main():
+    collection = get_db()["patients_explain"]
+    collection.drop()
+    crud = PatientCrud(collection=collection)
+    crud.ensure_indexes()
+    crud.bulk_create_patients([synthetic_patient(i) for i in range(2000)])
+
+    failures = 0
+    for name, params in QUERIES.items():
+        plan = collection.find(build_query(params)).explain()["queryPlanner"]["winningPlan"]
+        plan = plan.get("queryPlan", plan)
+        found = set(stages(plan))
+        ok = "IXSCAN" in found and "COLLSCAN" not in found
+        failures += not ok
+        print(f"{'OK ' if ok else 'FALLA'} {name:<14} {sorted(s for s in found if s)}")
+    collection.drop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# benchmarks/serialization.py
+#
+# Bytes/s de JSON producidos para una respuesta de un paciente y para un
+# listado, comparando:
+#   - anterior: Patient(**doc).dict() / bucle de _id + jsonable_encoder + json.dumps
+#   - actual: documento de MongoDB serializado directamente con orjson
+#
+# Uso: python -m benchmarks.serialization --list-size 1000
+
+import argparse
+import json
+import time
+
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fhir.resources.patient import Patient
+
+from app.controlador.serializacion import dumps
+from benchmarks.datos import synthetic_patient
+
+
+def throughput(fn, repeat):
+    size = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        size += len(fn())
+    return size / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--list-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    docs = [dict(synthetic_patient(i), _id=ObjectId()) for i in range(args.list_size)]
+
+    def single_before():
+        doc = dict(docs[0])
+        doc["id"] = str(doc.pop("_id"))
+        return json.dumps(jsonable_encoder(Patient(**doc).dict())).encode()
+
+    def single_after():
+        doc = dict(docs[0])
+        doc["id"] = str(doc.pop("_id"))
+        return dumps(doc)
+
+    def list_before():
+        patients = []
+        for doc in docs:
+            doc = dict(doc)
+            doc["id"] = str(doc["_id"])
+            del doc["_id"]
+            patients.append(doc)
+        return json.dumps(jsonable_encoder(patients)).encode()
+
+    def list_after():
+        patients = []
+        for doc in docs:
+            doc = dict(doc)
+            doc["id"] = str(doc.pop("_id"))
+            patients.append(doc)
+        return dumps(patients)
+
+    rows = [
+        ("un paciente", throughput(single_before, args.repeat * 50), throughput(single_after, args.repeat * 50)),
+        (f"listado de {args.list_size}", throughput(list_before, args.repeat), throughput(list_after, args.repeat)),
+    ]
+    print(f"{'respuesta':<20} {'anterior MB/s':>14} {'orjson MB/s':>12} {'mejora':>8}")
+    for name, before, after in rows:
+        print(f"{name:<20} {before / 1e6:>14.2f} {after / 1e6:>12.2f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# benchmarks/startup.py
+#
+# Tiempo de arranque de los workers, en dos escenarios:
+#   - "sin preload": cada worker es un proceso nuevo que importa la app (como
+#     gunicorn sin preload_app).
+#   - "preload": un maestro importa app/wsgi.py (que precarga el modelo
+#     Patient) y hace fork de los workers (gunicorn con preload_app = True).
+#
+# Por worker se mide: importación de la app, listo para responder (lifespan
+# + primera petición a /) y primera validación de un Patient. MongoDB no se
+# toca: los índices se crean en segundo plano y no retrasan el arranque.
+#
+# Uso: python -m benchmarks.startup --workers 4 [--importtime]
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Sin red: el arranque no debe depender de que Atlas responda
+ENV = dict(os.environ, MONGODB_URI="mongodb://127.0.0.1:1", MONGODB_SERVER_SELECTION_TIMEOUT_MS="500")
+
+
+def ready_and_validate(app):
+    import httpx
+
+    from app.controlador.PatientCrud import PatientCrud
+    from benchmarks.datos import SAMPLE_PATIENT
+
+    async def first_request():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+                response = await client.get("/")
+                response.raise_for_status()
+
+    start = time.perf_counter()
+    asyncio.run(first_request())
+    ready = time.perf_counter() - start
+
+    start = time.perf_counter()
+    PatientCrud(collection=object()).validator.validate(SAMPLE_PATIENT)
+    first_validation = time.perf_counter() - start
+    return ready, first_validation
+
+
+def report(**values):
+    line = json.dumps({key: round(value * 1000, 1) if isinstance(value, float) else value
+                       for key, value in values.items()})
+    # Una sola escritura por línea: los workers del fork comparten la salida
+    os.write(sys.stdout.fileno(), (line + "\n").encode())
+
+
+def worker_cold():
+    start = time.perf_counter()
+    from app.app import app
+    imported = time.perf_counter() - start
+    ready, first_validation = ready_and_validate(app)
+    report(pid=os.getpid(), import_ms=imported, ready_ms=imported + ready, first_validation_ms=first_validation)
+    os._exit(0)
+
+
+def master_preload(workers):
+    start = time.perf_counter()
+    from app.wsgi import app
+    report(master_import_ms=time.perf_counter() - start)
+
+    children = []
+    for _ in range(workers):
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            forked = time.perf_counter() - start
+            ready, first_validation = ready_and_validate(app)
+            report(pid=os.getpid(), import_ms=0.0, ready_ms=forked + ready, first_validation_ms=first_validation)
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def run(args):
+    return subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", *args], cwd=ROOT, env=ENV, capture_output=True, text=True,
+    )
+
+
+def parse(output):
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+
+def import_profile(top):
+    """Módulos más lentos de importar en frío (python -X importtime)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.app"], cwd=ROOT, env=ENV, capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    # Por paquete de primer nivel (la primera vez que se importa), sin la propia app
+    packages = {}
+    for us, name in rows:
+        name = name.strip()
+        if "." not in name and name != "app":
+            packages[name] = max(packages.get(name, 0), us)
+    for name, us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{us / 1000:>10.1f} ms  {name}")
+
+
+def summarize(label, rows):
+    for key in ("import_ms", "ready_ms", "first_validation_ms"):
+        values = [row[key] for row in rows]
+        print(f"{label:<12} {key:<22} media {sum(values) / len(values):>8.1f}  máx {max(values):>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--master", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker_cold()
+    if args.master:
+        master_preload(args.workers)
+        return
+
+    # Sin preload: los workers arrancan a la vez, como tras un reinicio de gunicorn
+    processes = [
+        subprocess.Popen([sys.executable, "-m", "benchmarks.startup", "--worker"], cwd=ROOT, env=ENV,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for _ in range(args.workers)
+    ]
+    cold = []
+    for process in processes:
+        output, _ = process.communicate()
+        cold.extend(parse(output))
+    summarize("sin preload", cold)
+
+    result = parse(run(["--master", "--workers", str(args.workers)]).stdout)
+    print(f"{'preload':<12} {'master_import_ms':<22} {result[0]['master_import_ms']:>14.1f}")
+    summarize("preload", result[1:])
+
+    if args.importtime:
+        print("\nImportaciones más lentas (en frío):")
+        import_profile(15)
+
+
+if __name__ == "__main__":
+    main()
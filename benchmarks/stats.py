@@ -0,0 +1,124 @@
+# benchmarks/stats.py
+#
+# Estadísticas del panel (app/controlador/DashboardStats.py): lo que hacía el
+# panel del LIS (descargar todas las citas y pacientes con get_all_* y contarlos)
+# frente a GET .../$stats, que lee los contadores. Mide también la reconstrucción
+# de los contadores y lo que añade su $inc a cada alta de una cita.
+#
+# Los documentos se siembran directamente (sin validar) y los contadores se
+# construyen con DashboardStats.rebuild. Con --sqlite se usa el almacenamiento
+# local en lugar de mongomock.
+#
+# Uso: python -m benchmarks.stats --n 20000 --reads 50
+
+import argparse
+import os
+import random
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import mongomock
+from bson.objectid import ObjectId
+
+from app.controlador.AppointmentCrud import AppointmentCrud
+from app.controlador.DashboardStats import age_bands
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.sqlite_store import SQLiteClient
+from benchmarks.suite import percentile, seed_document
+
+SERVICES = ["laboratorio", "rayos_x", "ecografia", "toma_muestras"]
+STATES = ["Pendiente", "Confirmada", "Atendida", "Cancelada"]
+
+
+def synthetic_appointment(rng, start):
+    return {
+        "_id": ObjectId(),
+        "idPacienteFHIR": str(ObjectId()),
+        "tipoServicio": rng.choice(SERVICES),
+        "fechaCita": start + timedelta(days=rng.randrange(365), minutes=15 * rng.randrange(40)),
+        "estadoCita": rng.choice(STATES),
+        "examenesSolicitados": [],
+    }
+
+
+def download_counts(appointment_crud, patient_crud):
+    """Lo que hacía el panel: todas las citas y pacientes, contados en Python."""
+    appointments = appointment_crud.get_all_appointments()
+    patients = patient_crud.get_all_patients()
+    return {
+        "tipoServicio": Counter(doc.get("tipoServicio") for doc in appointments),
+        "estadoCita": Counter(doc.get("estadoCita") for doc in appointments),
+        "dias": Counter(doc["fechaCita"].date().isoformat() for doc in appointments),
+        "genero": Counter(doc.get("gender") for doc in patients),
+        "edad": age_bands(Counter((doc.get("birthDate") or "")[:4] or "desconocido" for doc in patients)),
+    }
+
+
+def stats_counts(appointment_crud, patient_crud):
+    return appointment_crud.get_stats(), patient_crud.get_stats()
+
+
+def measure(operation, reads):
+    latencies = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000, help="citas y pacientes sembrados")
+    parser.add_argument("--reads", type=int, default=20)
+    parser.add_argument("--sqlite", default="", metavar="RUTA", help="fichero SQLite en lugar de mongomock")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        database = SQLiteClient(args.sqlite)[f"bench_{os.getpid()}"]
+    else:
+        database = mongomock.MongoClient().bench
+    rng = random.Random(11)
+    start_day = datetime.combine(date.today(), datetime.min.time()).replace(hour=7)
+    patient_crud = PatientCrud(collection=database["patients"])
+    appointment_crud = AppointmentCrud(collection=database["appointments"], slots_collection=database["appointment_slots"])
+    patient_crud.stats.ensure_indexes()
+
+    for first in range(0, args.n, 5000):
+        size = min(5000, args.n - first)
+        database["patients"].insert_many([seed_document(i) for i in range(first, first + size)])
+        database["appointments"].insert_many([synthetic_appointment(rng, start_day) for _ in range(size)])
+    print(f"{args.n} citas y {args.n} pacientes ({'sqlite' if args.sqlite else 'mongomock'})")
+
+    start = time.perf_counter()
+    summary = {"citas": appointment_crud.stats.rebuild(), "pacientes": patient_crud.stats.rebuild()}
+    print(f"reconstrucción: {time.perf_counter() - start:.2f}s, contadores {summary}")
+
+    appointments, patients = stats_counts(appointment_crud, patient_crud)
+    expected = download_counts(appointment_crud, patient_crud)
+    same = (appointments["estadoCita"] == dict(expected["estadoCita"])
+            and appointments["dias"] == dict(expected["dias"])
+            and patients["edad"] == expected["edad"])
+    print(f"{'OK ' if same else 'FALLA'} los contadores coinciden con los documentos")
+
+    print(f"\n{'':<22} {'p50 ms':>10} {'p95 ms':>10}")
+    for label, operation, reads in (
+        ("descarga y conteo", lambda: download_counts(appointment_crud, patient_crud), max(1, args.reads // 10)),
+        ("$stats (contadores)", lambda: stats_counts(appointment_crud, patient_crud), args.reads),
+    ):
+        p50, p95 = measure(operation, reads)
+        print(f"{label:<22} {p50:>10.2f} {p95:>10.2f}")
+
+    # Coste en escritura: insert_appointments ya incluye el $inc de los contadores
+    appointments = [synthetic_appointment(rng, start_day) for _ in range(args.reads)]
+    raw = iter([dict(doc, _id=ObjectId()) for doc in appointments])
+    counted = iter(appointments)
+    p50_raw, _ = measure(lambda: database["appointments"].insert_one(next(raw)), args.reads)
+    p50_counted, _ = measure(lambda: appointment_crud.insert_appointments([next(counted)]), args.reads)
+    print(f"\nalta de una cita: {p50_raw:.3f} ms sin contadores, {p50_counted:.3f} ms con ellos (p50)")
+
+
+if __name__ == "__main__":
+    main()
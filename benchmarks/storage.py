@@ -0,0 +1,98 @@
+# benchmarks/storage.py
+#
+# Almacenamiento local (app/controlador/sqlite_store.py, STORAGE_BACKEND=sqlite): latencia de
+# las lecturas más frecuentes de la API a través de PatientCrud, sin HTTP:
+#   - por id: get_patient_by_object_id (find_one por _id)
+#   - identificador: search_patients con identifier=valor (índice de _search)
+#   - familia: search_patients con family=apellido, 20 por página
+#   - página: get_patients_page, recorriendo la colección por _id
+# y la siembra con bulk_create_patients. El objetivo para SQLite es por debajo
+# de 1 ms en p50 para las lecturas por id y por identificador. Con --mongomock
+# se repite contra mongomock como referencia.
+#
+# Uso: python -m benchmarks.storage --n 20000 --reads 2000 --path /tmp/bench.sqlite3
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import mongomock
+
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.PatientSearch import build_query
+from app.controlador.sqlite_store import SQLiteClient
+from benchmarks.datos import FAMILIES, synthetic_patient
+from benchmarks.suite import percentile
+
+SEED_CHUNK = 1000
+
+
+def measure(operation, arguments):
+    latencies = []
+    for argument in arguments:
+        start = time.perf_counter()
+        operation(argument)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000
+
+
+def run(name, collection, n, reads, rng):
+    crud = PatientCrud(collection=collection)
+    crud.ensure_indexes()
+    start = time.perf_counter()
+    for first in range(0, n, SEED_CHUNK):
+        crud.bulk_create_patients([synthetic_patient(i) for i in range(first, min(n, first + SEED_CHUNK))])
+    seeded = time.perf_counter() - start
+    ids = [str(doc["_id"]) for doc in collection.find({}, {"_id": 1})]
+    print(f"\n{name}: {n} pacientes sembrados en {seeded:.1f}s ({n / seeded:.0f}/s)")
+
+    def page_walk(count):
+        after = None
+        for _ in range(reads // 10 or 1):
+            _, after = crud.get_patients_page(count, after)
+            if after is None:
+                break
+
+    samples = [rng.randrange(n) for _ in range(reads)]
+    operations = {
+        "por id": (crud.get_patient_by_object_id, [ids[i] for i in samples]),
+        "identificador": (lambda value: crud.search_patients(build_query([("identifier", value)]), 20),
+                          [str(1000000000 + i) for i in samples]),
+        "familia": (lambda family: crud.search_patients(build_query([("family", family)]), 20),
+                    [rng.choice(FAMILIES) for _ in range(reads // 10 or 1)]),
+    }
+    print(f"{'operación':<15} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, (operation, arguments) in operations.items():
+        p50, p95, p99 = measure(operation, arguments)
+        print(f"{label:<15} {p50:>8.3f} {p95:>8.3f} {p99:>8.3f}")
+    start = time.perf_counter()
+    page_walk(50)
+    print(f"{'página (50)':<15} {(time.perf_counter() - start) * 1000 / (reads // 10 or 1):>8.3f}   (media)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--path", default="", help="fichero SQLite (por defecto uno temporal)")
+    parser.add_argument("--mongomock", action="store_true", help="repetir contra mongomock")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    path = args.path or os.path.join(tempfile.mkdtemp(), "storage.sqlite3")
+    client = SQLiteClient(path)
+    database = f"bench_{os.getpid()}"
+    try:
+        run(f"sqlite ({path})", client[database]["patients"], args.n, args.reads, rng)
+    finally:
+        client.drop_database(database)
+        client.close()
+    if args.mongomock:
+        run("mongomock", mongomock.MongoClient().bench.patients, args.n, args.reads, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+# benchmarks/suite.py
+#
+# Benchmark de la API completa (app/app.py) ejecutada en el mismo proceso con
+# httpx.ASGITransport, sin red ni uvicorn. La base de datos es mongomock por
+# defecto, un mongod desechable (--mongo-uri) o un fichero SQLite
+# (--sqlite, el almacenamiento de app/controlador/sqlite_store.py); en los dos últimos casos
+# se usa una base de datos temporal que se borra al terminar.
+#
+# Para cada tamaño de colección (--sizes) se siembran pacientes sintéticos
+# (benchmarks/datos.py) y se mide cada endpoint a distintas concurrencias:
+# latencia p50/p95/p99 y throughput. Los resultados se escriben en JSON en
+# benchmarks/resultados/<commit>.json para poder compararlos entre commits:
+#
+#   python -m benchmarks.suite --sizes 1000,10000 --concurrency 1,8,32
+#   python -m benchmarks.suite --mongo-uri mongodb://localhost:27017 --sizes 100000,1000000
+#   python -m benchmarks.suite --sqlite /tmp/bench.sqlite3 --sizes 100000
+#   python -m benchmarks.suite --compare resultados/abc123.json resultados/def456.json
+#
+# mongomock recorre la colección en Python en cada consulta sin índice
+# equivalente, así que para 100k-1M pacientes conviene un mongod real. Además
+# no es seguro entre hilos: con concurrencia alta algún listado puede fallar
+# (columna "errores"); con mongod esos errores sí indican un problema.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import httpx
+import mongomock
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+
+from app.controlador.AppointmentCrud import AppointmentCrud
+from app.controlador.AsyncCrud import AsyncCrud
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.PatientMatch import MATCH_FIELD, match_fields
+from app.controlador.PatientSearch import SEARCH_FIELDS, search_fields
+from app.controlador.PatientSummary import SUMMARY_FIELD, summary_fields
+from app.controlador.PatientValidator import VALIDATION_MARKER, VALIDATION_VERSION
+from app.controlador.SlotCalendar import CLOSING_MINUTE, OPENING_MINUTE, SLOT_MINUTES
+from app.controlador.fechas import now_instant
+from app.controlador.sqlite_store import SQLiteClient
+from benchmarks.datos import FAMILIES, synthetic_patient
+from benchmarks.load_async import LatencyCollection
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+SEED_BATCH = 10000
+SLOTS_PER_DAY = (CLOSING_MINUTE - OPENING_MINUTE) // SLOT_MINUTES
+
+
+def seed_document(i):
+    """
+    Documento tal como lo guarda PatientCrud._prepare_patient. Los pacientes
+    sintéticos son válidos por construcción; validarlos uno a uno dominaría el
+    tiempo de siembra con 1M de documentos.
+    """
+    doc = synthetic_patient(i)
+    doc["meta"] = {"lastUpdated": now_instant(), "versionId": "1"}
+    doc[VALIDATION_MARKER] = VALIDATION_VERSION
+    doc[SEARCH_FIELDS] = search_fields(doc)
+    doc[SUMMARY_FIELD] = summary_fields(doc)
+    doc[MATCH_FIELD] = match_fields(doc)
+    doc["_id"] = ObjectId()
+    return doc
+
+
+class Backend:
+    """Colecciones de pacientes y citas para un tamaño de la prueba."""
+
+    def __init__(self, mongo_uri=None, rtt=0.0, sqlite_path=None):
+        if mongo_uri:
+            self.client = MongoClient(mongo_uri)
+            self.db_name = f"bench_{os.getpid()}_{int(time.time())}"
+        elif sqlite_path:
+            self.client = SQLiteClient(sqlite_path)
+            self.db_name = f"bench_{os.getpid()}_{int(time.time())}"
+        else:
+            self.client = mongomock.MongoClient()
+            self.db_name = "bench"
+        self.rtt = rtt
+
+    def collection(self, name):
+        collection = self.client[self.db_name][name]
+        return LatencyCollection(collection, self.rtt) if self.rtt else collection
+
+    def drop(self):
+        self.client.drop_database(self.db_name)
+
+
+def seed(backend, size):
+    collection = backend.client[backend.db_name]["patients"]
+    ids = []
+    for start in range(0, size, SEED_BATCH):
+        docs = [seed_document(i) for i in range(start, min(size, start + SEED_BATCH))]
+        collection.insert_many(docs, ordered=False)
+        ids.extend(str(doc["_id"]) for doc in docs)
+    return ids
+
+
+def install(backend):
+    """Sustituye los CRUD globales de la app por unos sobre las colecciones de prueba."""
+    from app import app as servicio
+
+    patient_crud = PatientCrud(collection=backend.collection("patients"))
+    appointment_crud = AppointmentCrud(
+        collection=backend.collection("appointments"),
+        slots_collection=backend.collection("appointment_slots"),
+    )
+    patient_crud.ensure_indexes()
+    appointment_crud.ensure_indexes()
+    servicio.patient_crud = AsyncCrud(patient_crud)
+    servicio.appointment_crud = AsyncCrud(appointment_crud)
+    return servicio.app
+
+
+# --- Escenarios: cada uno devuelve (método, ruta, kwargs de httpx) para la petición n ---
+
+def scenarios(ids, size):
+    rng = random.Random(size)
+    first_day = date.today() + timedelta(days=1)
+
+    def patient_read(n):
+        return "GET", f"/api/patients/{rng.choice(ids)}", {}
+
+    def patient_search_family(n):
+        return "GET", "/api/patients", {"params": {"family": rng.choice(FAMILIES)[:3], "_count": 50}}
+
+    def patient_search_identifier(n):
+        return "GET", "/api/patients", {"params": {"identifier": str(1000000000 + rng.randrange(size))}}
+
+    def patient_page(n):
+        return "GET", "/api/patients", {"params": {"_count": 50}}
+
+    def patient_create(n):
+        # Identificadores por encima de los sembrados para no pisar pacientes existentes
+        return "POST", "/api/patients", {"json": synthetic_patient(size + n + rng.randrange(10**8))}
+
+    def appointment_slots(n):
+        desde = first_day + timedelta(days=rng.randrange(30))
+        params = {"tipoServicio": "lab", "desde": desde.isoformat(), "hasta": (desde + timedelta(days=6)).isoformat()}
+        return "GET", "/api/appointments/slots", {"params": params}
+
+    reservations = itertools.count()
+
+    def appointment_create(n):
+        # Una franja distinta por petición: se mide la reserva, no los conflictos
+        n = next(reservations)
+        day = first_day + timedelta(days=n // SLOTS_PER_DAY)
+        minute = OPENING_MINUTE + (n % SLOTS_PER_DAY) * SLOT_MINUTES
+        return "POST", "/api/appointments", {"json": {
+            "idPacienteFHIR": rng.choice(ids),
+            "tipoServicio": "lab",
+            "fechaCita": day.isoformat(),
+            "horaCita": f"{minute // 60:02d}:{minute % 60:02d}:00",
+        }}
+
+    return {
+        "GET /api/patients/{id}": patient_read,
+        "GET /api/patients?family": patient_search_family,
+        "GET /api/patients?identifier": patient_search_identifier,
+        "GET /api/patients?_count": patient_page,
+        "POST /api/patients": patient_create,
+        "GET /api/appointments/slots": appointment_slots,
+        "POST /api/appointments": appointment_create,
+    }
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def measure(client, scenario, total, concurrency):
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def worker():
+        for n in counter:
+            method, path, kwargs = scenario(n)
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "errors": sum(count for code, count in statuses.items() if code >= 400),
+        "status": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+async def run_size(app, ids, size, args, endpoints):
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, scenario in scenarios(ids, size).items():
+            if endpoints and name not in endpoints:
+                continue
+            # Calentamiento: primeras validaciones, cachés y planes de consulta
+            await measure(client, scenario, min(args.warmup, args.requests), 1)
+            for concurrency in args.concurrency:
+                row = await measure(client, scenario, args.requests, concurrency)
+                row.update({"endpoint": name, "size": size})
+                results.append(row)
+                print(f"{size:>9} {name:<30} {concurrency:>4} {row['throughput']:>10.1f} "
+                      f"{row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['errors']:>6}")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "sin-git"
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = {(r["endpoint"], r["size"], r["concurrency"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+
+    print(f"{'tamaño':>9} {'endpoint':<30} {'conc':>4} {'req/s':>16} {'p95 ms':>20}")
+    for row in new:
+        old = base.get((row["endpoint"], row["size"], row["concurrency"]))
+        if old is None:
+            continue
+        throughput = (row["throughput"] / old["throughput"] - 1) * 100
+        p95 = (row["p95_ms"] / old["p95_ms"] - 1) * 100 if old["p95_ms"] else 0.0
+        print(f"{row['size']:>9} {row['endpoint']:<30} {row['concurrency']:>4} "
+              f"{row['throughput']:>9.1f} {throughput:>+5.0f}% {row['p95_ms']:>12.2f} {p95:>+5.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=200, help="peticiones por endpoint y concurrencia")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--endpoints", default="", help="lista separada por ';' (por defecto todos)")
+    parser.add_argument("--mongo-uri", default="", help="mongod desechable en lugar de mongomock")
+    parser.add_argument("--sqlite", default="", metavar="RUTA", help="fichero SQLite en lugar de mongomock")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="latencia simulada por operación")
+    parser.add_argument("--output", default="")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NUEVO"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.concurrency = [int(n) for n in args.concurrency.split(",")]
+    sizes = [int(n) for n in args.sizes.split(",")]
+    endpoints = {name.strip() for name in args.endpoints.split(";") if name.strip()}
+    commit = git_commit()
+
+    results = []
+    print(f"{'tamaño':>9} {'endpoint':<30} {'conc':>4} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errores':>6}")
+    for size in sizes:
+        backend = Backend(args.mongo_uri, args.rtt_ms / 1000, args.sqlite)
+        try:
+            start = time.perf_counter()
+            ids = seed(backend, size)
+            print(f"# {size} pacientes sembrados en {time.perf_counter() - start:.1f}s")
+            app = install(backend)
+            results.extend(asyncio.run(run_size(app, ids, size, args, endpoints)))
+        finally:
+            backend.drop()
+
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "backend": "mongod" if args.mongo_uri else "sqlite" if args.sqlite else "mongomock",
+        "rtt_ms": args.rtt_ms,
+        "requests": args.requests,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"# resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
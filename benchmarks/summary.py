@@ -0,0 +1,86 @@
+# benchmarks/summary.py
+#
+# Listado resumido (GET /api/patients/summary) frente a la página completa
+# (GET /api/patients?_count=N): bytes de la respuesta y latencia p50 de leer y
+# serializar una página, recorriendo la colección entera página a página.
+#
+# Con --explain comprueba además contra un mongod real que la consulta del
+# resumen está cubierta por el índice (sin FETCH y 0 documentos examinados):
+#
+#   MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.summary --explain
+#
+# Uso: python -m benchmarks.summary --n 20000 --count 50
+
+import argparse
+import sys
+import time
+
+import mongomock
+
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.PatientSummary import SUMMARY_PROJECTION
+from app.controlador.serializacion import dumps
+from benchmarks.datos import synthetic_patient
+from benchmarks.search_explain import stages
+from benchmarks.suite import percentile
+
+
+def walk(page, count):
+    """Recorre todas las páginas; retorna (latencias por página, bytes por página)."""
+    latencies, sizes, after = [], [], None
+    while True:
+        start = time.perf_counter()
+        items, after = page(count, after)
+        body = dumps(items)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(body))
+        if after is None:
+            return latencies, sizes
+
+
+def explain(n):
+    from connection import get_db
+
+    collection = get_db()["patients_summary_explain"]
+    collection.drop()
+    crud = PatientCrud(collection=collection)
+    crud.ensure_indexes()
+    crud.bulk_create_patients([synthetic_patient(i) for i in range(n)])
+    result = collection.find({}, SUMMARY_PROJECTION).sort("_id", 1).limit(50).explain()
+    plan = result["queryPlanner"]["winningPlan"]
+    found = set(stages(plan.get("queryPlan", plan))) - {None}
+    examined = result.get("executionStats", {}).get("totalDocsExamined")
+    collection.drop()
+    covered = "FETCH" not in found and "COLLSCAN" not in found
+    print(f"{'OK ' if covered else 'FALLA'} consulta cubierta: etapas {sorted(found)}, documentos examinados {examined}")
+    return covered
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--explain", action="store_true", help="verificar la consulta cubierta en un mongod")
+    args = parser.parse_args()
+
+    if args.explain:
+        sys.exit(0 if explain(min(args.n, 5000)) else 1)
+
+    crud = PatientCrud(collection=mongomock.MongoClient().db.patients)
+    crud.ensure_indexes()
+    crud.bulk_create_patients([synthetic_patient(i) for i in range(args.n)])
+
+    print(f"{args.n} pacientes, páginas de {args.count}")
+    print(f"{'':<10} {'bytes/página':>13} {'p50 ms':>8} {'p95 ms':>8}")
+    results = {}
+    for name, page in (("completo", crud.get_patients_page), ("resumen", crud.get_patient_summaries)):
+        latencies, sizes = walk(page, args.count)
+        latencies.sort()
+        results[name] = (sum(sizes) / len(sizes), percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000)
+        print(f"{name:<10} {results[name][0]:>13.0f} {results[name][1]:>8.2f} {results[name][2]:>8.2f}")
+    full, summary = results["completo"], results["resumen"]
+    print(f"\nresumen: {summary[0] / full[0]:.1%} de los bytes, {full[1] / summary[1]:.1f}x más rápido (p50)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# benchmarks/validation.py
+#
+# Validaciones por segundo del Patient FHIR:
+#   - actual: Patient(**data).dict(), como hacía PatientCrud.
+#   - validador sin caché: PatientValidator con payloads siempre distintos.
+#   - validador con caché: el mismo payload repetido (reintentos, reenvíos).
+#   - lectura marcada: un documento con marcador de validación no se revalida.
+#
+# Uso: python -m benchmarks.validation --n 2000
+
+import argparse
+import time
+
+from fhir.resources.patient import Patient
+
+from app.controlador.PatientValidator import PatientValidator, VALIDATION_MARKER, VALIDATION_VERSION, is_validated
+from benchmarks.datos import synthetic_patient
+
+
+def rate(fn, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        fn(payload)
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = [synthetic_patient(i) for i in range(args.n)]
+    validator = PatientValidator(cache_size=args.n)
+    stored = dict(payloads[0], **{VALIDATION_MARKER: VALIDATION_VERSION})
+
+    results = {
+        "actual (Patient(**data).dict())": rate(lambda d: Patient(**d).dict(), payloads),
+        "validador sin caché": rate(validator.validate, payloads),
+        "validador con caché": rate(validator.validate, payloads),
+        "lectura marcada": rate(lambda d: is_validated(d) or Patient(**d).dict(), [stored] * args.n),
+    }
+    for name, value in results.items():
+        print(f"{name:<34} {value:>12.0f} val/s")
+
+
+if __name__ == "__main__":
+    main()
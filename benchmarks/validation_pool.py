@@ -0,0 +1,67 @@
+# benchmarks/validation_pool.py
+#
+# Validación de lotes de pacientes con ValidationPool según el número de
+# procesos (0 = en línea, en el propio proceso), con pacientes siempre
+# distintos para que no intervenga la caché. Mide también lo que cuesta
+# enviar un solo paciente al pool frente a validarlo en línea, que es lo que
+# fija VALIDATION_INLINE_MAX_BYTES.
+#
+# Uso: python -m benchmarks.validation_pool --n 20000 --processes 0,1,2,4,8
+
+import argparse
+import os
+import time
+
+import orjson
+
+from app.controlador.PatientValidator import PatientValidator, preload_models
+from app.controlador.ValidationPool import ValidationPool
+from benchmarks.datos import synthetic_patient
+from benchmarks.suite import percentile
+
+
+def single_latency(pool, payloads):
+    samples = []
+    for payload in payloads:
+        start = time.perf_counter()
+        pool.validate(payload)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return percentile(samples, 50) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500, help="pacientes por llamada (como BULK_CHUNK_SIZE)")
+    parser.add_argument("--processes", default=f"0,1,2,4,{os.cpu_count()}")
+    args = parser.parse_args()
+
+    preload_models()
+    payloads = [orjson.dumps(synthetic_patient(i)) for i in range(args.n)]
+    print(f"{os.cpu_count()} núcleos, {args.n} pacientes en lotes de {args.batch}")
+    print(f"{'procesos':>9} {'pacientes/s':>12} {'aceleración':>12}")
+    baseline = None
+    for processes in sorted({int(p) for p in args.processes.split(",")}):
+        pool = ValidationPool(PatientValidator(cache_size=0), processes=processes, inline_max_bytes=0)
+        # Arranque de los procesos y carga del modelo fuera de la medida
+        pool.validate_many([orjson.dumps(synthetic_patient(-1 - i)) for i in range(max(processes, 1) * 4)])
+        start = time.perf_counter()
+        for offset in range(0, args.n, args.batch):
+            pool.validate_many(payloads[offset:offset + args.batch])
+        rate = args.n / (time.perf_counter() - start)
+        baseline = baseline or rate
+        print(f"{processes:>9} {rate:>12.0f} {rate / baseline:>11.2f}x")
+        pool.shutdown()
+
+    single = payloads[:200]
+    inline = ValidationPool(PatientValidator(cache_size=0), processes=0)
+    pooled = ValidationPool(PatientValidator(cache_size=0), processes=1, inline_max_bytes=0)
+    pooled.validate_many(payloads[-10:])
+    print(f"\nun paciente ({len(single[0])} bytes), p50: en línea {single_latency(inline, single):.3f} ms"
+          f" | en el pool {single_latency(pooled, single):.3f} ms")
+    pooled.shutdown()
+
+
+if __name__ == "__main__":
+    main()
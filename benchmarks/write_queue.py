@@ -0,0 +1,129 @@
+# benchmarks/write_queue.py
+#
+# Altas individuales de pacientes y citas: camino directo (una escritura por
+# petición) frente a la cola de escrituras (WriteQueue), contra mongomock con
+# una latencia de red simulada por operación. Mide throughput y la latencia
+# p50/p95 que ve cada petición, para distintas peticiones en vuelo.
+# --pool-size limita las operaciones simultáneas contra la base de datos, como
+# el pool de conexiones de cada worker (MONGODB_MAX_POOL_SIZE).
+#
+# Uso: python -m benchmarks.write_queue --requests 1000 --rtt-ms 5
+
+import argparse
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mongomock
+
+from app.controlador.AppointmentCrud import AppointmentCrud
+from app.controlador.AsyncCrud import AsyncCrud
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.SlotCalendar import OPENING_MINUTE, SLOT_MINUTES
+from app.controlador.WriteQueue import WriteQueue
+from benchmarks.datos import synthetic_patient
+from benchmarks.load_async import LatencyCollection
+from benchmarks.suite import SLOTS_PER_DAY, percentile
+
+
+class PooledLatencyCollection(LatencyCollection):
+    """LatencyCollection con un número limitado de conexiones compartidas."""
+
+    def __init__(self, collection, rtt, pool):
+        super().__init__(collection, rtt)
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._pool:
+                time.sleep(self._rtt)
+                return attr(*args, **kwargs)
+        return call
+
+
+def appointment(n):
+    day = datetime(2030, 1, 1) + timedelta(days=n // SLOTS_PER_DAY)
+    return {
+        "idPacienteFHIR": str(n),
+        "tipoServicio": "lab",
+        "fechaCita": day + timedelta(minutes=OPENING_MINUTE + (n % SLOTS_PER_DAY) * SLOT_MINUTES),
+        "horaCita": "00:00:00",
+        "createdAt": datetime.utcnow(),
+        "estadoCita": "Pendiente",
+    }
+
+
+async def run(write, total, in_flight):
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for n in counter:
+            start = time.perf_counter()
+            status, _ = await write(n)
+            latencies.append(time.perf_counter() - start)
+            assert status == "success", status
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(in_flight)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return total / elapsed, percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000
+
+
+def scenarios(rtt, args):
+    pool = threading.BoundedSemaphore(args.pool_size)
+
+    def collection(name):
+        return PooledLatencyCollection(mongomock.MongoClient().db[name], rtt, pool)
+
+    def patients():
+        crud = AsyncCrud(PatientCrud(collection=collection("patients")))
+        queue = WriteQueue(crud.bulk_create_patients, args.batch_size, args.delay_ms)
+        direct = lambda n: crud.create_or_update_patient_fhir_resource(synthetic_patient(n))
+        queued = lambda n: queue.submit(synthetic_patient(n))
+        return direct, queued
+
+    def appointments():
+        crud = AsyncCrud(AppointmentCrud(collection=collection("appointments"), slots_collection=collection("slots")))
+        queue = WriteQueue(crud.insert_appointments, args.batch_size, args.delay_ms)
+
+        async def queued(n):
+            data = appointment(n)
+            status, result = await crud.reserve_appointment_slot(data)
+            return await queue.submit(data) if status == "success" else (status, result)
+        return lambda n: crud.create_appointment(appointment(n)), queued
+
+    return {"pacientes": patients, "citas": appointments}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rtt-ms", type=float, default=5.0)
+    parser.add_argument("--in-flight", default="1,8,32,128")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'':<10} {'en vuelo':>8} {'directo req/s':>14} {'p50':>7} {'p95':>7}"
+          f" {'cola req/s':>11} {'p50':>7} {'p95':>7}")
+    for name, build in scenarios(args.rtt_ms / 1000, args).items():
+        for in_flight in (int(n) for n in args.in_flight.split(",")):
+            # Colecciones nuevas en cada medida: el tamaño no influye
+            direct, queued = build()
+            d_rate, d_p50, d_p95 = asyncio.run(run(direct, args.requests, in_flight))
+            direct, queued = build()
+            q_rate, q_p50, q_p95 = asyncio.run(run(queued, args.requests, in_flight))
+            print(f"{name:<10} {in_flight:>8} {d_rate:>14.0f} {d_p50:>7.1f} {d_p95:>7.1f}"
+                  f" {q_rate:>11.0f} {q_p50:>7.1f} {q_p95:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
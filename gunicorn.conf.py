@@ -1,9 +1,27 @@
 # gunicorn.conf.py
 
+import os
+import tempfile
+
 bind = "0.0.0.0:8000"
-workers = 4
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+# La app reparte los núcleos entre los workers (p. ej. los procesos de validación)
+os.environ["WEB_CONCURRENCY"] = str(workers)
 worker_class = "uvicorn.workers.UvicornWorker"
 timeout = 120
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+# Importa la app (y el modelo Patient, ver app/wsgi.py) una vez en el maestro;
+# los workers arrancan con un fork copy-on-write. El cliente de MongoDB y los
+# pools de hilos se crean después, en cada worker.
+preload_app = True
+# Directorio de métricas común a los workers de este maestro (/metrics los
+# suma). Se fija aquí, antes de que preload_app importe la app.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"lis-metrics-{os.getpid()}"))
+
+
+def on_starting(server):
+    # Ficheros de una ejecución anterior con el mismo METRICS_DIR
+    from app.controlador.metricas import clear_metrics_dir
+    clear_metrics_dir()
@@ -4,9 +4,13 @@
 # Asumiendo que connection.py está en un nivel accesible para este script.
 from connection import connect_to_mongodb
 from pymongo.errors import PyMongoError # Para un manejo de errores más específico de PyMongo
-from fhir.resources.patient import Patient # Para la validación del modelo FHIR Patient
+from app.controlador.PatientValidator import PatientValidator, PatientValidationError
+from app.controlador.ValidationPool import ValidationPool # Valida en procesos aparte los pacientes grandes
 import json # Necesario para parsear el JSON de ejemplo y para imprimir legiblemente
 
+# Pool de validación compartido por las llamadas a save_patient_to_mongodb
+validation_pool = ValidationPool(PatientValidator())
+
 # --- La función original 'connect_to_mongodb' se elimina de aquí ---
 # --- porque ahora la importamos desde connection.py ---
 
@@ -30,23 +34,19 @@ def save_patient_to_mongodb(patient_data_dict: dict, collection):
         return None
 
     try:
-        # 1. Validar el diccionario contra el modelo FHIR Patient
-        # Esto asegura que los datos cumplen con la estructura FHIR
-        pat = Patient.model_validate(patient_data_dict)
-    except Exception as e:
+        # 1. Validar el diccionario contra el modelo FHIR Patient y normalizarlo
+        # (nombres de campo FHIR, sin campos vacíos). Si el paciente es grande
+        # se valida en el pool de procesos; si no, aquí mismo.
+        validated_patient_for_db = validation_pool.validate(patient_data_dict)
+    except PatientValidationError as e:
         print(f"Error de validación FHIR para el paciente: {e}")
         return None # Retorna None si la validación falla
 
     try:
-        # 2. Convertir el objeto FHIR validado de nuevo a un diccionario
-        # 'by_alias=True' asegura que los nombres de los campos FHIR (ej. 'resourceType')
-        # se usen tal cual en la DB. 'exclude_unset=True' excluye campos que no fueron provistos.
-        validated_patient_for_db = pat.model_dump(by_alias=True, exclude_unset=True)
-
-        # 3. Insertar el documento validado en la colección
+        # 2. Insertar el documento validado en la colección
         result = collection.insert_one(validated_patient_for_db)
 
-        # 4. Retornar el ID del documento insertado por MongoDB como string
+        # 3. Retornar el ID del documento insertado por MongoDB como string
         if result.inserted_id:
             return str(result.inserted_id)
         else:
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Las pruebas validan en el propio proceso y se ejecutan desde la raíz del repositorio
+os.environ.setdefault("VALIDATION_PROCESSES", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Mismo parche de mongomock que los benchmarks (benchmarks/__init__.py)
+import benchmarks  # noqa: E402,F401
@@ -0,0 +1,21 @@
+from app.controlador import admision
+
+
+def scope(*forwarded, client=("10.0.0.1", 5000)):
+    return {"type": "http", "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded], "client": client}
+
+
+def test_forwarded_for_ignored_by_default():
+    assert admision.client_key(scope("1.1.1.1")) == "10.0.0.1"
+
+
+def test_forwarded_for_uses_address_added_by_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(admision, "TRUST_FORWARDED_FOR", True)
+    # Lo que hay a la izquierda lo escribe el cliente
+    assert admision.client_key(scope("6.6.6.6, 2.2.2.2")) == "2.2.2.2"
+    assert admision.client_key(scope("6.6.6.6", "2.2.2.2")) == "2.2.2.2"
+    monkeypatch.setattr(admision, "TRUSTED_PROXY_HOPS", 2)
+    assert admision.client_key(scope("6.6.6.6, 2.2.2.2, 3.3.3.3")) == "2.2.2.2"
+    # Menos entradas que proxies: la IP de la conexión
+    assert admision.client_key(scope("3.3.3.3")) == "10.0.0.1"
+    assert admision.client_key(scope()) == "10.0.0.1"
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+from app.controlador.compresion import CompressionMiddleware
+
+LARGE = b'{"valor": "' + b"x" * 4096 + b'"}'
+
+
+@pytest.fixture
+def client():
+    api = FastAPI()
+    api.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @api.api_route("/grande", methods=["GET", "HEAD"])
+    def large():
+        return Response(LARGE, media_type="application/json")
+
+    @api.get("/pequeno")
+    def small():
+        return Response(b"{}", media_type="application/json")
+
+    @api.get("/sin-cambios")
+    def not_modified():
+        return Response(status_code=304)
+
+    @api.get("/binario")
+    def binary():
+        return Response(b"\0" * 4096, media_type="application/octet-stream")
+
+    return TestClient(api)
+
+
+@pytest.mark.parametrize("path", ["/grande", "/pequeno", "/sin-cambios"])
+@pytest.mark.parametrize("accept", ["gzip", "identity"])
+def test_vary_on_every_response_that_depends_on_accept_encoding(client, path, accept):
+    response = client.get(path, headers={"accept-encoding": accept})
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_head_and_compressed_responses(client):
+    head = client.head("/grande", headers={"accept-encoding": "gzip"})
+    assert head.status_code == 200 and head.headers["vary"] == "Accept-Encoding"
+    response = client.get("/grande", headers={"accept-encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip" and response.content == LARGE
+
+
+def test_no_vary_for_types_that_are_never_compressed(client):
+    assert "vary" not in client.get("/binario", headers={"accept-encoding": "gzip"}).headers
@@ -0,0 +1,63 @@
+# Contadores del panel (DashboardStats) con las escrituras de PatientCrud y
+# AppointmentCrud sobre mongomock: se ajustan en cada alta y cambio, y un fallo
+# al ajustarlos no hace fallar la escritura.
+
+from datetime import datetime
+
+import mongomock
+import pytest
+
+from app.controlador.AppointmentCrud import AppointmentCrud
+from app.controlador.PatientCrud import PatientCrud
+from benchmarks.datos import synthetic_patient
+
+
+def patient(i):
+    patient = synthetic_patient(i)
+    patient["identifier"][0]["system"] = "urn:test"
+    return patient
+
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient().test
+
+
+def test_patient_writes_update_counters(database):
+    crud = PatientCrud(collection=database["patients"])
+    created = patient(1)
+    status, _ = crud.upsert_patient(created)
+    assert status == "created"
+    assert crud.get_stats()["genero"] == {created["gender"]: 1}
+
+    other = "female" if created["gender"] == "male" else "male"
+    status, _ = crud.upsert_patient(dict(created, gender=other))
+    assert status == "updated"
+    assert crud.get_stats()["genero"] == {other: 1}
+
+    before = crud.get_stats()
+    crud.stats.rebuild()
+    assert crud.get_stats() == before
+
+
+def test_create_appointment_updates_counters(database):
+    crud = AppointmentCrud(collection=database["appointments"], slots_collection=database["appointment_slots"])
+    status, _ = crud.create_appointment({
+        "idPacienteFHIR": "p1", "tipoServicio": "laboratorio", "fechaCita": datetime(2026, 1, 5, 9),
+    })
+    assert status == "success"
+    stats = crud.get_stats()
+    assert stats["tipoServicio"] == {"laboratorio": 1}
+    assert stats["dias"] == {"2026-01-05": 1}
+
+
+def test_recorder_failures_do_not_fail_the_write(database, monkeypatch):
+    crud = PatientCrud(collection=database["patients"])
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("contadores no disponibles")
+
+    monkeypatch.setattr(crud.stats, "record", broken)
+    monkeypatch.setattr(crud.matcher, "record", broken)
+    status, _ = crud.upsert_patient(patient(2))
+    assert status == "created"
@@ -0,0 +1,21 @@
+import os
+
+import orjson
+
+from app.controlador import metricas
+
+
+def test_metrics_dir_is_read_when_used(tmp_path, monkeypatch):
+    # Con preload_app la app se importa antes de que gunicorn fije METRICS_DIR
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path))
+    (tmp_path / "1.json").write_bytes(orjson.dumps({"counters": [["pruebas_total", [["worker", "1"]], 3]], "histograms": []}))
+    counters, _ = metricas.collect()
+    assert counters[("pruebas_total", (("worker", "1"),))] == 3
+    assert os.path.exists(tmp_path / f"{os.getpid()}.json")
+    metricas.clear_metrics_dir()
+    assert os.listdir(tmp_path) == []
+
+
+def test_default_metrics_dir_without_env(monkeypatch):
+    monkeypatch.delenv("METRICS_DIR", raising=False)
+    assert metricas.metrics_dir() == metricas._DEFAULT_METRICS_DIR
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from app.controlador.MLLPServer import MLLPServer
+from app.controlador.WriteQueue import WriteQueueFull
+
+ADT = ("MSH|^~\\&|HIS|HOSP|LIS|LAB|20240105101500||ADT^A04^ADT_A01|MSG001|P|2.5.1\r"
+       "PID|1||12345^^^HOSP^MR||Duarte^Mario||19860225|M\r")
+
+
+def acknowledge(status, result="detalle"):
+    async def submit(message):
+        if status is WriteQueueFull:
+            raise WriteQueueFull("cola llena")
+        return status, result
+
+    server = MLLPServer(submit, port=0)
+    ack = asyncio.run(server.acknowledge(ADT.encode())).decode()
+    msa = next(segment for segment in ack.split("\r") if segment.startswith("MSA|"))
+    return msa.split("|")[1], server.stats()["acks"]
+
+
+@pytest.mark.parametrize("status, code", [
+    ("success", "AA"),
+    ("invalid", "AR"),
+    ("duplicate", "AR"),
+    ("conflict", "AR"),
+    ("error", "AE"),
+    (WriteQueueFull, "AE"),
+])
+def test_ack_code_by_ingest_status(status, code):
+    msa_code, acks = acknowledge(status)
+    assert msa_code == code
+    assert acks[code] == 1 and sum(acks.values()) == 1
+
+
+def test_unparseable_frame_is_rejected():
+    server = MLLPServer(None, port=0)
+    ack = asyncio.run(server.acknowledge(b"no es HL7")).decode()
+    assert "MSA|AR|" in ack
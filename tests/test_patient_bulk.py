@@ -0,0 +1,66 @@
+# Escrituras por lotes de PatientCrud (Bundles batch, $import, cola de
+# escrituras) sobre el almacenamiento SQLite, que admite bulk_write con reemplazos.
+
+import pytest
+from bson.objectid import ObjectId
+
+from app.controlador import PatientCrud as patient_crud
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.sqlite_store import SQLiteClient
+from benchmarks.datos import synthetic_patient
+
+
+def patient(i, **changes):
+    patient = synthetic_patient(i)
+    patient["identifier"][0]["system"] = "urn:test"
+    patient.update(changes)
+    return patient
+
+
+@pytest.fixture
+def crud(tmp_path):
+    client = SQLiteClient(str(tmp_path / "test.sqlite3"))
+    crud = PatientCrud(collection=client["test"]["patients"])
+    crud.ensure_indexes()
+    yield crud
+    client.close()
+
+
+def test_bulk_replace_increments_version(crud):
+    [(status, patient_id)] = crud.bulk_create_patients([patient(1)])
+    assert status == "success"
+    assert crud.bulk_create_patients([patient(1, gender="other")]) == [("success", patient_id)]
+    stored = crud.collection.find_one({})
+    assert (stored["gender"], stored["meta"]["versionId"]) == ("other", "2")
+
+
+def test_bulk_replace_reports_concurrent_change_as_conflict(crud, monkeypatch):
+    crud.bulk_create_patients([patient(1)])
+    resolve = crud._resolve_existing_ids
+
+    def resolve_then_concurrent_write(indexed_docs, session=None):
+        result = resolve(indexed_docs, session=session)
+        crud.collection.update_one({}, {"$set": {"meta.versionId": "2", "gender": "unknown"}})
+        return result
+
+    monkeypatch.setattr(crud, "_resolve_existing_ids", resolve_then_concurrent_write)
+    [(status, _)] = crud.bulk_create_patients([patient(1, gender="other")])
+    assert status == "conflict"
+    stored = crud.collection.find_one({})
+    assert (stored["gender"], stored["meta"]["versionId"]) == ("unknown", "2")
+    assert crud.get_stats()["genero"] == {synthetic_patient(1)["gender"]: 1}
+
+
+def test_bulk_applies_upsert_rules_per_item(crud, monkeypatch):
+    monkeypatch.setattr(patient_crud, "MPI_ON_WRITE", "reject")
+    [(_, first_id)] = crud.bulk_create_patients([patient(1)])
+    twin = patient(1)
+    twin["identifier"][0]["value"] = "otro"
+    shared = patient(2)
+    # El identificador no es único: dos pacientes pueden compartirlo
+    crud.collection.insert_many([dict(crud._prepare_patient(patient(2)), _id=ObjectId()) for _ in range(2)])
+    outcomes = crud.bulk_create_patients([twin, shared, patient(3)])
+    assert outcomes[0][0] == "duplicate" and f"Patient/{first_id}" in outcomes[0][1]
+    assert outcomes[1] == ("conflict", "Varios pacientes coinciden con el identificador.")
+    assert outcomes[2][0] == "success"
+    assert crud.collection.count_documents({}) == 4
@@ -0,0 +1,122 @@
+# Historial de versiones de pacientes: parches JSON entre versiones, vread,
+# _history y la actualización condicionada con If-Match.
+
+import copy
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.app as api
+from app.controlador import PatientHistory as patient_history
+from app.controlador import parches
+from app.controlador.AsyncCrud import AsyncCrud
+from app.controlador.PatientCrud import PatientCrud
+from app.controlador.sqlite_store import SQLiteClient
+from benchmarks.datos import synthetic_patient
+
+
+def patient(i, **changes):
+    patient = synthetic_patient(i)
+    patient["identifier"][0]["system"] = "urn:test"
+    patient.update(changes)
+    return patient
+
+
+@pytest.fixture
+def crud(tmp_path, monkeypatch):
+    # Instantánea cada 3 versiones: 1 instantánea, 2-3 parches, 4 instantánea
+    monkeypatch.setattr(patient_history, "HISTORY_SNAPSHOT_INTERVAL", 3)
+    client = SQLiteClient(str(tmp_path / "test.sqlite3"))
+    crud = PatientCrud(collection=client["test"]["patients"])
+    crud.ensure_indexes()
+    yield crud
+    client.close()
+
+
+@pytest.fixture
+def versions(crud):
+    """Un paciente con cuatro versiones; retorna su id y el recurso enviado en cada una."""
+    sent = [patient(1), patient(1, gender="other"), patient(1, birthDate="1990-01-01"), patient(1, gender="unknown")]
+    status, patient_id = crud.create_or_update_patient_fhir_resource(sent[0])
+    assert status == "success"
+    for version, resource in enumerate(sent[1:], start=2):
+        assert crud.update_patient(patient_id, resource) == ("updated", str(version))
+    return patient_id, sent
+
+
+@pytest.mark.parametrize("old, new", [
+    ({"a": 1, "b": {"c": [1, 2]}}, {"a": 2, "b": {"c": [1, 3]}, "d": None}),
+    ({"a/b": 1, "m~n": [1]}, {"a/b": 2, "m~n": [1, 2]}),
+    ({"name": [{"given": ["Ana"]}], "gone": True}, {"name": [{"given": ["Ana", "María"]}]}),
+    ({"a": [1, 2, 3]}, {"a": []}),
+    ({"a": {"b": 1}}, {"a": "texto"}),
+])
+def test_patch_round_trip(old, new):
+    original = copy.deepcopy(old)
+    assert parches.apply(old, parches.diff(old, new)) == new
+    assert old == original
+    assert parches.diff(new, new) == []
+
+
+def test_history_stores_snapshots_and_patches(crud, versions):
+    patient_id, _ = versions
+    entries = {entry["version"]: entry for entry in crud.history.collection.find({"paciente": patient_id})}
+    assert {version: entry["tipo"] for version, entry in entries.items()} == {
+        1: "instantanea", 2: "parche", 3: "parche", 4: "instantanea",
+    }
+    assert [op["path"] for op in entries[2]["parche"]] == ["/gender"]
+
+
+def test_vread_rebuilds_older_versions(crud, versions):
+    patient_id, sent = versions
+    for version, resource in enumerate(sent, start=1):
+        status, stored = crud.get_patient_version(patient_id, str(version))
+        assert status == "success"
+        assert stored["meta"]["versionId"] == str(version)
+        assert (stored["gender"], stored.get("birthDate")) == (resource["gender"], resource.get("birthDate"))
+    assert crud.get_patient_version(patient_id, "5") == ("notFound", None)
+
+
+def test_if_match_with_stale_version_fails(crud, versions):
+    patient_id, _ = versions
+    status, _ = crud.update_patient(patient_id, patient(1, gender="female"), if_match="3")
+    assert status == "preconditionFailed"
+    assert crud.collection.find_one({})["meta"]["versionId"] == "4"
+    assert crud.update_patient(patient_id, patient(1, gender="female"), if_match="4") == ("updated", "5")
+
+
+@pytest.fixture
+def client(crud, monkeypatch):
+    monkeypatch.setattr(api, "patient_crud", AsyncCrud(crud))
+    # Sin `with`: no arranca el lifespan (MongoDB, servidor MLLP)
+    return TestClient(api.app)
+
+
+def test_history_endpoint_pages_from_newest(client, versions):
+    patient_id, sent = versions
+    bundle = client.get(f"/api/patients/{patient_id}/_history", params={"_count": 3}).json()
+    assert bundle["type"] == "history"
+    assert [entry["response"]["etag"] for entry in bundle["entry"]] == ['W/"4"', 'W/"3"', 'W/"2"']
+    assert [entry["resource"]["gender"] for entry in bundle["entry"]] == [r["gender"] for r in sent[:0:-1]]
+    [next_link] = [link["url"] for link in bundle["link"] if link["relation"] == "next"]
+    older = client.get(next_link).json()
+    assert [(entry["request"]["method"], entry["response"]["status"]) for entry in older["entry"]] == [("POST", "201 Created")]
+    assert all(link["relation"] != "next" for link in older["link"])
+
+
+def test_vread_endpoint(client, versions):
+    patient_id, sent = versions
+    response = client.get(f"/api/patients/{patient_id}/_history/2")
+    assert response.status_code == 200
+    assert response.headers["etag"] == 'W/"2"'
+    assert response.json()["gender"] == sent[1]["gender"]
+    assert client.get(f"/api/patients/{patient_id}/_history/9").status_code == 404
+
+
+def test_put_with_stale_if_match_returns_412(client, versions):
+    patient_id, _ = versions
+    url = f"/api/patients/{patient_id}"
+    assert client.put(url, json=patient(1, gender="female"), headers={"If-Match": 'W/"2"'}).status_code == 412
+    response = client.put(url, json=patient(1, gender="female"), headers={"If-Match": 'W/"4"'})
+    assert response.status_code == 200
+    assert response.headers["etag"] == 'W/"5"'
@@ -0,0 +1,47 @@
+import mongomock
+import numpy as np
+
+from app.controlador import PatientMatch
+from app.controlador.PatientMatch import MATCH_FIELD, MatchFeatures, PatientMatcher, match_fields
+from benchmarks.datos import synthetic_patient
+
+
+def stored(patients):
+    collection = mongomock.MongoClient().test.patients
+    collection.insert_many([{**patient, MATCH_FIELD: match_fields(patient)} for patient in patients])
+    return collection
+
+
+def test_batch_scores_each_patient_against_its_own_blocks():
+    first, second = synthetic_patient(1), synthetic_patient(2)
+    collection = stored([first, second])
+    ids = {doc["identifier"][0]["value"]: str(doc["_id"]) for doc in collection.find()}
+    results = PatientMatcher(patients_collection=collection).find_matches_many([first, second])
+    assert [[match[0] for match in matches] for matches in results] == [
+        [ids[first["identifier"][0]["value"]]], [ids[second["identifier"][0]["value"]]],
+    ]
+
+
+def test_batch_candidates_are_capped(monkeypatch):
+    patients = [synthetic_patient(i) for i in range(20)]
+    collection = stored(patients)
+    monkeypatch.setattr(PatientMatch, "MPI_MAX_BATCH_CANDIDATES", 3)
+    limits = []
+    find = collection.find
+
+    def recording_find(*args, **kwargs):
+        cursor = find(*args, **kwargs)
+        limit = cursor.limit
+        cursor.limit = lambda n: limits.append(n) or limit(n)
+        return cursor
+
+    monkeypatch.setattr(collection, "find", recording_find)
+    PatientMatcher(patients_collection=collection).find_matches_many(patients)
+    assert limits == [3]
+
+
+def test_take_keeps_scores():
+    docs = [{"_id": i, MATCH_FIELD: match_fields(synthetic_patient(i))} for i in range(6)]
+    features = MatchFeatures.from_documents(docs)
+    scores = features.scores(features)
+    assert np.allclose(features.take([4]).scores(features.take([1, 4, 5])), scores[[4]][:, [1, 4, 5]])
@@ -0,0 +1,153 @@
+# Traducción de los parámetros de búsqueda de Patient (PatientSearch) a
+# filtros y proyecciones sobre los campos derivados `_busqueda`, y paginación.
+
+import pytest
+from bson.objectid import ObjectId
+
+from app.controlador.PatientCrud import PUBLIC_PROJECTION, PatientCrud, public_projection
+from app.controlador.PatientSearch import (
+    MANDATORY_ELEMENTS, SUMMARY_ELEMENTS, SearchParameterError, build_projection, build_query,
+    is_search, search_fields,
+)
+from app.controlador.sqlite_store import SQLiteClient
+from benchmarks.datos import synthetic_patient
+
+
+def test_search_fields_are_folded_tokens():
+    fields = search_fields({
+        "name": [{"text": "José Ángel Núñez", "family": "Núñez Peña", "given": ["José", "Ángel"]}],
+        "address": [{"city": "Bogotá"}, {"line": ["sin ciudad"]}],
+    })
+    assert fields == {
+        "nombres": ["angel", "jose", "nunez", "pena"],
+        "familias": ["nunez", "nunez pena", "pena"],
+        "dados": ["angel", "jose"],
+        "ciudades": ["bogota"],
+    }
+
+
+@pytest.mark.parametrize("name, value, expected", [
+    ("name", "Jos", {"_busqueda.nombres": {"$regex": "^jos"}}),
+    ("family", "NÚÑEZ", {"_busqueda.familias": {"$regex": "^nunez"}}),
+    ("given:exact", "José", {"_busqueda.dados": {"$regex": "^jose$"}}),
+    ("address-city:contains", "got", {"_busqueda.ciudades": {"$regex": "got"}}),
+    ("name", "a.b", {"_busqueda.nombres": {"$regex": "^a\\.b"}}),
+])
+def test_string_params_use_search_fields(name, value, expected):
+    assert build_query([(name, value)]) == expected
+
+
+@pytest.mark.parametrize("value, condition", [
+    ("1986-02-25", {"$gte": "1986-02-25", "$lt": "1986-02-26"}),
+    ("eq1986", {"$gte": "1986", "$lt": "1987"}),
+    # ap se trata como eq: mismo intervalo que la precisión indicada
+    ("ap1986-02", {"$gte": "1986-02", "$lt": "1986-03"}),
+    ("ap1986-12", {"$gte": "1986-12", "$lt": "1987-01"}),
+    ("ne1986-02", {"$not": {"$gte": "1986-02", "$lt": "1986-03"}}),
+    ("gt1986-02", {"$gte": "1986-03"}),
+    ("sa1986-02", {"$gte": "1986-03"}),
+    ("lt1986-02", {"$lt": "1986-02"}),
+    ("eb1986-02", {"$lt": "1986-02"}),
+    ("ge1986-02-28", {"$gte": "1986-02-28"}),
+    ("le1986-02-28", {"$lt": "1986-03-01"}),
+])
+def test_birthdate_prefixes(value, condition):
+    assert build_query([("birthdate", value)]) == {"birthDate": condition}
+
+
+def test_last_updated_instant_bounds():
+    assert build_query([("_lastUpdated", "ge2024-01-05T10:15:00Z")]) == {
+        "meta.lastUpdated": {"$gte": "2024-01-05T10:15:00.000Z"},
+    }
+    assert build_query([("_lastUpdated", "2024-01-05T10:15:00.250Z")]) == {
+        "meta.lastUpdated": {"$gte": "2024-01-05T10:15:00.250Z", "$lt": "2024-01-05T10:15:00.251Z"},
+    }
+
+
+@pytest.mark.parametrize("value", ["1986-13", "1986-02-30", "86", "ge", "2024-01-05Tx"])
+def test_invalid_dates(value):
+    with pytest.raises(SearchParameterError):
+        build_query([("birthdate", value)])
+
+
+def test_repeated_params_and_commas():
+    assert build_query([("gender", "male,female"), ("birthdate", "ge1980"), ("birthdate", "lt1990")]) == {"$and": [
+        {"$or": [{"gender": "male"}, {"gender": "female"}]},
+        {"birthDate": {"$gte": "1980"}},
+        {"birthDate": {"$lt": "1990"}},
+    ]}
+
+
+def test_token_params():
+    assert build_query([("identifier", "urn:cc|123")]) == {"identifier": {"$elemMatch": {"system": "urn:cc", "value": "123"}}}
+    assert build_query([("identifier", "|123")]) == {"identifier": {"$elemMatch": {"system": {"$exists": False}, "value": "123"}}}
+    assert build_query([("identifier", "urn:cc|")]) == {"identifier.system": "urn:cc"}
+    assert build_query([("telecom", "phone|555")]) == {"telecom": {"$elemMatch": {"system": "phone", "value": "555"}}}
+    object_id = ObjectId()
+    assert build_query([("_id", str(object_id))]) == {"_id": object_id}
+
+
+@pytest.mark.parametrize("params", [
+    [("gender:exact", "male")], [("name:sounds", "x")], [("color", "rojo")], [("_id", "no")], [("gender", ",")],
+])
+def test_rejected_params(params):
+    with pytest.raises(SearchParameterError):
+        build_query(params)
+
+
+def test_control_params_do_not_filter():
+    params = [("_count", "10"), ("after", "abc"), ("_elements", "name"), ("_summary", "true")]
+    assert build_query(params) == {}
+    assert not is_search(params)
+    assert is_search(params + [("name:exact", "ana")])
+
+
+def test_elements_and_summary_projections():
+    assert build_projection(elements="name, birthDate,") == {"name": 1, "birthDate": 1, **dict.fromkeys(MANDATORY_ELEMENTS, 1)}
+    # _elements tiene prioridad sobre _summary
+    assert build_projection("true", "gender") == {"gender": 1, "resourceType": 1, "meta": 1}
+    assert build_projection("true") == dict.fromkeys(SUMMARY_ELEMENTS + MANDATORY_ELEMENTS, 1)
+    assert build_projection("false") is None and build_projection() is None
+    assert build_projection("data") == {"text": 0}
+    with pytest.raises(SearchParameterError):
+        build_projection("count")
+
+
+def test_public_projection_hides_internal_fields():
+    assert public_projection(None) == PUBLIC_PROJECTION
+    assert public_projection({"text": 0}) == {"text": 0, **PUBLIC_PROJECTION}
+    # Una proyección de inclusión ya deja fuera los campos internos
+    assert public_projection({"name": 1}) == {"name": 1}
+
+
+@pytest.fixture
+def crud(tmp_path):
+    client = SQLiteClient(str(tmp_path / "test.sqlite3"))
+    crud = PatientCrud(collection=client["test"]["patients"])
+    crud.ensure_indexes()
+    for i in range(1, 8):
+        patient = synthetic_patient(i)
+        patient["identifier"][0]["system"] = "urn:test"
+        patient["name"][0]["family"] = "Núñez" if i % 2 else "Pérez"
+        assert crud.create_or_update_patient_fhir_resource(patient)[0] == "success"
+    yield crud
+    client.close()
+
+
+def test_search_pages_by_id(crud):
+    filters = build_query([("family", "nunez")])
+    projection = build_projection(elements="name")
+    pages, after = [], None
+    while True:
+        page, after = crud.search_patients(filters, 2, after, projection)
+        pages.append(page)
+        if after is None:
+            break
+    assert [len(page) for page in pages] == [2, 2]
+    ids = [patient["id"] for page in pages for patient in page]
+    assert ids == sorted(ids) and len(set(ids)) == 4
+    for patient in pages[0]:
+        assert set(patient) == {"resourceType", "id", "meta", "name"}
+        assert patient["name"][0]["family"] == "Núñez"
+    assert crud.count_patients(filters) == 4
+    assert crud.count_patients(build_query([("family:exact", "pérez"), ("gender", "male,female,other,unknown")])) == 3
@@ -0,0 +1,38 @@
+from datetime import date, datetime
+
+import mongomock
+
+from app.controlador.AppointmentCrud import AppointmentCrud
+from app.controlador.SlotCalendar import SlotCalendar
+
+DAY = date(2026, 1, 5)
+NINE = 9 * 60
+
+
+def appointment(service="laboratorio"):
+    return {"idPacienteFHIR": "p1", "tipoServicio": service, "fechaCita": datetime(2026, 1, 5, 9)}
+
+
+def test_full_day_expires_after_ttl():
+    loads = []
+    calendar = SlotCalendar(lambda service, day: loads.append(day) or [(NINE, 1)], capacity=1, ttl=0)
+    calendar.day("laboratorio", DAY)
+    assert not calendar.is_full("laboratorio", DAY, NINE)
+    assert calendar.day("laboratorio", DAY) and len(loads) == 2
+
+
+def test_days_are_bounded():
+    calendar = SlotCalendar(lambda service, day: [], max_days=3)
+    for i in range(10):
+        calendar.day(f"servicio-{i}", DAY)
+    assert list(calendar._days) == [(f"servicio-{i}", DAY) for i in (7, 8, 9)]
+
+
+def test_released_slot_can_be_booked_again():
+    database = mongomock.MongoClient().test
+    crud = AppointmentCrud(collection=database["appointments"], slots_collection=database["appointment_slots"])
+    crud.get_free_slots("laboratorio", DAY, DAY)
+    assert crud.reserve_appointment_slot(appointment()) == ("success", None)
+    assert crud.reserve_appointment_slot(appointment())[0] == "conflict"
+    crud.release_appointment_slot(appointment())
+    assert crud.reserve_appointment_slot(appointment()) == ("success", None)
@@ -0,0 +1,370 @@
+# Operaciones de pymongo que implementa el almacenamiento SQLite
+# (STORAGE_BACKEND=sqlite), con el resultado que daría MongoDB: los filtros se
+# comparan con mongomock, con y sin índices.
+
+from datetime import datetime
+
+import mongomock
+import pytest
+from pymongo import ASCENDING, DESCENDING, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from app.controlador.sqlite_store import SQLiteClient
+
+
+@pytest.fixture
+def collection(tmp_path):
+    client = SQLiteClient(str(tmp_path / "test.sqlite3"))
+    yield client["test"]["docs"]
+    client.close()
+
+
+def test_bulk_write_with_upserts(collection):
+    collection.insert_one({"_id": "a", "total": 1})
+    result = collection.bulk_write([
+        UpdateOne({"_id": "a"}, {"$inc": {"total": 2}}, upsert=True),
+        UpdateOne({"_id": "b"}, {"$inc": {"total": 5}, "$setOnInsert": {"nuevo": True}}, upsert=True),
+        ReplaceOne({"_id": "c"}, {"valor": "x"}, upsert=True),
+        ReplaceOne({"_id": "zz"}, {"valor": "y"}),
+    ], ordered=False)
+    assert (result.matched_count, result.modified_count, result.upserted_count) == (1, 1, 2)
+    assert result.upserted_ids == {1: "b", 2: "c"}
+    assert list(collection.find({}, sort=[("_id", ASCENDING)])) == [
+        {"_id": "a", "total": 3},
+        {"_id": "b", "total": 5, "nuevo": True},
+        {"_id": "c", "valor": "x"},
+    ]
+
+
+def test_bulk_write_unordered_reports_each_error(collection):
+    collection.create_index([("clave", ASCENDING)], unique=True)
+    collection.insert_one({"clave": 1})
+    with pytest.raises(BulkWriteError) as error:
+        collection.bulk_write([InsertOne({"clave": 1}), InsertOne({"clave": 2}), InsertOne({"clave": 1})], ordered=False)
+    assert [err["index"] for err in error.value.details["writeErrors"]] == [0, 2]
+    assert error.value.details["nInserted"] == 1
+    assert sorted(doc["clave"] for doc in collection.find()) == [1, 2]
+
+
+def test_find_one_and_update(collection):
+    collection.insert_many([{"_id": i, "grupo": "a", "orden": i, "cupos": 1} for i in range(3)])
+    before = collection.find_one_and_update(
+        {"grupo": "a", "cupos": {"$gt": 0}}, {"$inc": {"cupos": -1}}, sort=[("orden", DESCENDING)],
+    )
+    assert before == {"_id": 2, "grupo": "a", "orden": 2, "cupos": 1}
+    after = collection.find_one_and_update(
+        {"_id": 1}, {"$inc": {"cupos": -1}}, projection={"cupos": 1, "_id": 0}, return_document=ReturnDocument.AFTER,
+    )
+    assert after == {"cupos": 0}
+    assert collection.find_one_and_update({"_id": 9}, {"$set": {"cupos": 1}}) is None
+    created = collection.find_one_and_update(
+        {"_id": 9, "grupo": "b"}, {"$inc": {"cupos": 3}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    assert created == {"_id": 9, "grupo": "b", "cupos": 3}
+
+
+def test_find_one_and_update_respects_unique_indexes(collection):
+    collection.create_index([("clave", ASCENDING)], unique=True)
+    collection.insert_many([{"_id": 1, "clave": "x"}, {"_id": 2, "clave": "y"}])
+    with pytest.raises(DuplicateKeyError):
+        collection.find_one_and_update({"_id": 2}, {"$set": {"clave": "x"}})
+    assert collection.find_one({"_id": 2})["clave"] == "y"
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_sort_skip_and_limit(collection, indexed):
+    if indexed:
+        collection.create_index([("grupo", ASCENDING), ("valor", ASCENDING)])
+    docs = [{"_id": i, "grupo": i % 3, "valor": (i * 7) % 10} for i in range(30)]
+    collection.insert_many(docs)
+    expected = sorted((doc for doc in docs if doc["grupo"] == 1), key=lambda doc: (-doc["valor"], doc["_id"]))
+    cursor = collection.find({"grupo": 1}).sort([("valor", DESCENDING), ("_id", ASCENDING)]).skip(2).limit(4)
+    assert list(cursor) == expected[2:6]
+    first = collection.find({}, {"_id": 1}).sort("_id", DESCENDING).limit(3)
+    assert [doc["_id"] for doc in first] == [29, 28, 27]
+
+
+def test_sort_orders_mixed_types_like_mongodb(collection):
+    collection.insert_many([{"_id": 1, "v": "texto"}, {"_id": 2, "v": 10}, {"_id": 3}, {"_id": 4, "v": 2.5}])
+    assert [doc["_id"] for doc in collection.find().sort("v", ASCENDING)] == [3, 4, 2, 1]
+
+
+# --- Filtros: mismo resultado que MongoDB (mongomock) con y sin índices ---
+
+DOCS = [
+    {"_id": 1, "nombre": "Ana", "edad": 30, "tags": ["a", "b"], "dir": {"ciudad": "Bogotá", "cp": "11001"},
+     "identifier": [{"system": "cc", "value": "1"}, {"system": "pp", "value": "X1"}]},
+    {"_id": 2, "nombre": "ana maría", "edad": 25, "tags": ["b"], "dir": {"ciudad": "Cali"},
+     "identifier": [{"system": "cc", "value": "2"}]},
+    {"_id": 3, "nombre": "Beto", "edad": 41.5, "tags": [], "identifier": [{"value": "3"}]},
+    {"_id": 4, "nombre": "Carla", "edad": None, "dir": {"ciudad": "Bogotá"}},
+    {"_id": 5, "edad": "40", "tags": ["c", "a"]},
+    {"_id": 6, "nombre": "Diego", "edad": 18, "tags": [["a"]], "meta": {"versionId": "2"}},
+]
+
+QUERIES = [
+    {},
+    {"nombre": "Ana"},
+    {"edad": {"$gt": 25}},
+    {"edad": {"$gte": 25, "$lt": 41.5}},
+    {"edad": {"$lte": 18}},
+    {"edad": None},
+    {"edad": {"$ne": None}},
+    {"edad": {"$in": [18, "40", None]}},
+    {"edad": {"$nin": [30, 25]}},
+    {"nombre": {"$exists": False}},
+    {"dir.cp": {"$exists": True}},
+    {"dir.ciudad": "Bogotá"},
+    {"tags": "a"},
+    {"tags": ["a"]},
+    {"tags": {"$size": 0}},
+    {"tags": {"$all": ["a", "b"]}},
+    {"tags": {"$in": ["c", "z"]}},
+    {"tags.0": "b"},
+    {"nombre": {"$regex": "^an", "$options": "i"}},
+    {"nombre": {"$regex": "a$"}},
+    {"nombre": {"$not": {"$regex": "^A"}}},
+    {"edad": {"$not": {"$gt": 20}}},
+    {"identifier.value": "X1"},
+    {"identifier": {"$elemMatch": {"system": "cc", "value": "2"}}},
+    {"identifier": {"$elemMatch": {"system": {"$exists": False}, "value": "3"}}},
+    {"identifier": {"system": "cc", "value": "1"}},
+    {"$or": [{"nombre": "Beto"}, {"dir.ciudad": "Cali"}]},
+    {"$or": [{"_id": 5}, {"edad": {"$gt": 40}}]},
+    {"$and": [{"edad": {"$gte": 18}}, {"$or": [{"tags": "a"}, {"tags": "b"}]}]},
+    {"$nor": [{"tags": "a"}, {"edad": None}]},
+    {"_id": {"$in": [2, 4, 9]}},
+    {"_id": {"$gt": 4}},
+    {"meta.versionId": {"$eq": "2"}},
+]
+
+
+@pytest.fixture(params=["sin índices", "con índices"])
+def docs(collection, request):
+    if request.param == "con índices":
+        collection.create_index([("nombre", ASCENDING)])
+        collection.create_index([("edad", ASCENDING)])
+        collection.create_index([("tags", ASCENDING)])
+        collection.create_index([("dir.ciudad", ASCENDING), ("edad", ASCENDING)])
+        collection.create_index([("identifier.system", ASCENDING), ("identifier.value", ASCENDING)])
+        collection.create_index([("identifier.value", ASCENDING)])
+    collection.insert_many([dict(doc) for doc in DOCS])
+    reference = mongomock.MongoClient().test.docs
+    reference.insert_many([dict(doc) for doc in DOCS])
+    return collection, reference
+
+
+@pytest.mark.parametrize("query", QUERIES, ids=[repr(query) for query in QUERIES])
+def test_query_operators_like_mongodb(docs, query):
+    collection, reference = docs
+    expected = [doc["_id"] for doc in reference.find(query).sort("_id", ASCENDING)]
+    assert [doc["_id"] for doc in collection.find(query).sort("_id", ASCENDING)] == expected
+    assert collection.count_documents(query) == len(expected)
+
+
+def test_projection_distinct_and_count(docs):
+    collection, _ = docs
+    assert collection.find_one({"_id": 1}, {"dir.ciudad": 1, "identifier.value": 1, "_id": 0}) == {
+        "dir": {"ciudad": "Bogotá"}, "identifier": [{"value": "1"}, {"value": "X1"}],
+    }
+    assert collection.find_one({"_id": 2}, {"tags": 0, "identifier": 0, "dir": 0}) == {"_id": 2, "nombre": "ana maría", "edad": 25}
+    assert sorted(collection.distinct("tags")) == ["a", "b", "c"]
+    assert sorted(collection.distinct("dir.ciudad", {"edad": {"$gte": 30}})) == ["Bogotá"]
+    assert collection.count_documents({"tags": "a"}, skip=1, limit=1) == 1
+    assert collection.estimated_document_count() == len(DOCS)
+
+
+# --- Operadores de actualización ---
+
+def test_update_operators(collection):
+    collection.insert_one({"_id": 1, "n": 5, "lista": [1, 2, 2], "a": {"b": 1, "c": 2}, "vieja": True})
+    result = collection.update_one({"_id": 1}, {
+        "$set": {"a.b": 10, "nuevo.campo": "x"},
+        "$unset": {"vieja": ""},
+        "$inc": {"n": 2, "contador": 1},
+        "$min": {"a.c": 1},
+        "$max": {"n2": 3},
+        "$push": {"lista": {"$each": [3, 4]}},
+        "$addToSet": {"set": 1},
+        "$setOnInsert": {"ignorado": True},
+    })
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    assert collection.find_one({"_id": 1}) == {
+        "_id": 1, "n": 7, "lista": [1, 2, 2, 3, 4], "a": {"b": 10, "c": 1},
+        "nuevo": {"campo": "x"}, "contador": 1, "n2": 3, "set": [1],
+    }
+    collection.update_one({"_id": 1}, {"$pull": {"lista": 2}, "$addToSet": {"set": {"$each": [1, 2]}}})
+    doc = collection.find_one({"_id": 1})
+    assert (doc["lista"], doc["set"]) == ([1, 3, 4], [1, 2])
+    # Sin cambios: coincide pero no modifica
+    assert collection.update_one({"_id": 1}, {"$set": {"n": 7}}).modified_count == 0
+    with pytest.raises(ValueError):
+        collection.update_one({"_id": 1}, {"n": 8})
+
+
+def test_upsert_builds_document_from_equalities(collection):
+    result = collection.update_one(
+        {"clave": "k", "meta.version": {"$eq": 1}, "$and": [{"tipo": "t"}], "edad": {"$gt": 3}},
+        {"$set": {"valor": 1}, "$setOnInsert": {"creado": True}}, upsert=True,
+    )
+    assert result.upserted_id is not None
+    doc = collection.find_one({"_id": result.upserted_id}, {"_id": 0})
+    assert doc == {"clave": "k", "meta": {"version": 1}, "tipo": "t", "valor": 1, "creado": True}
+    result = collection.update_many({"clave": "k"}, {"$inc": {"valor": 1}}, upsert=True)
+    assert (result.matched_count, result.upserted_id) == (1, None)
+
+
+def test_update_many_and_deletes(collection):
+    collection.insert_many([{"_id": i, "par": i % 2 == 0} for i in range(6)])
+    assert collection.update_many({"par": True}, {"$set": {"visto": 1}}).modified_count == 3
+    assert collection.count_documents({"visto": 1}) == 3
+    assert collection.delete_one({"par": False}).deleted_count == 1
+    assert collection.delete_many({"par": False}).deleted_count == 2
+    assert [doc["_id"] for doc in collection.find()] == [0, 2, 4]
+
+
+# --- find_one_and_* ---
+
+def test_find_one_and_replace(collection):
+    collection.insert_many([{"_id": 1, "grupo": "a", "v": 1}, {"_id": 2, "grupo": "a", "v": 2}])
+    before = collection.find_one_and_replace({"grupo": "a"}, {"grupo": "a", "v": 20}, sort=[("v", DESCENDING)])
+    assert before == {"_id": 2, "grupo": "a", "v": 2}
+    assert collection.find_one({"_id": 2}) == {"_id": 2, "grupo": "a", "v": 20}
+    after = collection.find_one_and_replace(
+        {"grupo": "b"}, {"grupo": "b", "v": 3}, upsert=True, return_document=ReturnDocument.AFTER, projection={"_id": 0},
+    )
+    assert after == {"grupo": "b", "v": 3}
+    assert collection.find_one_and_replace({"grupo": "c"}, {"v": 4}, upsert=True) is None
+    assert collection.count_documents({}) == 4
+    with pytest.raises(ValueError):
+        collection.find_one_and_replace({"_id": 1}, {"$set": {"v": 5}})
+    with pytest.raises(OperationFailure):
+        collection.find_one_and_replace({"_id": 1}, {"_id": 99, "v": 5})
+
+
+def test_find_one_and_delete(collection):
+    collection.insert_many([{"_id": i, "cola": "x", "prioridad": i % 3} for i in range(5)])
+    taken = collection.find_one_and_delete({"cola": "x"}, sort=[("prioridad", DESCENDING), ("_id", ASCENDING)])
+    assert taken == {"_id": 2, "cola": "x", "prioridad": 2}
+    last = collection.find_one_and_delete({"cola": "x", "prioridad": 1}, projection={"prioridad": 1}, sort=[("_id", DESCENDING)])
+    assert last == {"_id": 4, "prioridad": 1}
+    assert collection.find_one_and_delete({"cola": "y"}) is None
+    assert sorted(doc["_id"] for doc in collection.find()) == [0, 1, 3]
+    assert collection.find_one_and_delete({}, sort=[("_id", ASCENDING)]) == {"_id": 0, "cola": "x", "prioridad": 0}
+
+
+# --- Agregación ---
+
+def test_aggregate_group_and_expressions(collection):
+    collection.insert_many([
+        {"_id": 1, "servicio": "lab", "fecha": datetime(2024, 1, 5, 8, 30), "total": 10, "examenes": ["GLU", "HB"]},
+        {"_id": 2, "servicio": "lab", "fecha": datetime(2024, 1, 5, 9, 0), "total": 5, "examenes": ["GLU"]},
+        {"_id": 3, "servicio": "rx", "fecha": datetime(2024, 2, 1, 7, 0), "total": "x", "examenes": []},
+        {"_id": 4, "servicio": "rx", "fecha": datetime(2024, 2, 3, 7, 0)},
+    ])
+    by_month = list(collection.aggregate([
+        {"$match": {"fecha": {"$gte": datetime(2024, 1, 1)}}},
+        {"$group": {
+            "_id": {"servicio": "$servicio", "mes": {"$substr": [{"$dateToString": {"date": "$fecha", "format": "%Y-%m-%d"}}, 0, 7]}},
+            "total": {"$sum": "$total"}, "citas": {"$sum": 1}, "n": {"$count": {}},
+            "promedio": {"$avg": "$total"}, "primera": {"$min": "$fecha"}, "ultima": {"$max": "$fecha"},
+            "ids": {"$push": "$_id"}, "servicios": {"$addToSet": "$servicio"},
+        }},
+        {"$sort": {"_id.servicio": 1}},
+    ]))
+    assert by_month == [
+        {"_id": {"servicio": "lab", "mes": "2024-01"}, "total": 15, "citas": 2, "n": 2, "promedio": 7.5,
+         "primera": datetime(2024, 1, 5, 8, 30), "ultima": datetime(2024, 1, 5, 9, 0), "ids": [1, 2], "servicios": ["lab"]},
+        {"_id": {"servicio": "rx", "mes": "2024-02"}, "total": 0, "citas": 2, "n": 2, "promedio": None,
+         "primera": datetime(2024, 2, 1, 7, 0), "ultima": datetime(2024, 2, 3, 7, 0), "ids": [3, 4], "servicios": ["rx"]},
+    ]
+    exams = list(collection.aggregate([
+        {"$unwind": "$examenes"},
+        {"$group": {"_id": "$examenes", "veces": {"$sum": 1}, "ultimo": {"$last": "$_id"}}},
+        {"$sort": {"veces": -1, "_id": 1}},
+        {"$limit": 5},
+    ]))
+    assert exams == [{"_id": "GLU", "veces": 2, "ultimo": 2}, {"_id": "HB", "veces": 1, "ultimo": 1}]
+    kept = list(collection.aggregate([{"$unwind": {"path": "$examenes", "preserveNullAndEmptyArrays": True}}, {"$count": "filas"}]))
+    assert kept == [{"filas": 5}]
+    projected = list(collection.aggregate([
+        {"$match": {"_id": {"$lte": 2}}},
+        {"$project": {"_id": 0, "servicio": 1, "hora": {"$hour": "$fecha"},
+                      "doble": {"$multiply": ["$total", 2]}, "alto": {"$cond": [{"$gte": ["$total", 10]}, "sí", "no"]},
+                      "etiqueta": {"$concat": [{"$toUpper": "$servicio"}, "-", {"$substr": ["$servicio", 1, -1]}]}}},
+        {"$skip": 1},
+    ]))
+    assert projected == [{"servicio": "lab", "hora": 9, "doble": 10, "alto": "no", "etiqueta": "LAB-ab"}]
+    with pytest.raises(OperationFailure):
+        list(collection.aggregate([{"$lookup": {}}]))
+
+
+# --- Índices únicos y parciales ---
+
+def test_partial_unique_index(collection):
+    collection.create_index([("email", ASCENDING)], unique=True, partialFilterExpression={"email": {"$exists": True}})
+    collection.insert_many([{"_id": 1}, {"_id": 2}, {"_id": 3, "email": "a@x.co"}])
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"_id": 4, "email": "a@x.co"})
+    assert collection.index_information()["email_1"]["partialFilterExpression"] == {"email": {"$exists": True}}
+    # El índice parcial no sirve para buscar documentos sin el campo
+    assert [doc["_id"] for doc in collection.find({"email": None}).sort("_id", ASCENDING)] == [1, 2]
+    assert [doc["_id"] for doc in collection.find({"email": {"$in": [None, "a@x.co"]}})] == [1, 2, 3]
+    assert [doc["_id"] for doc in collection.find({"email": {"$exists": True}, "_id": {"$gte": 1}})] == [3]
+    collection.drop_index("email_1")
+    collection.insert_one({"_id": 4, "email": "a@x.co"})
+    assert collection.count_documents({"email": "a@x.co"}) == 2
+
+
+def test_unique_index_on_existing_duplicates_fails(collection):
+    collection.insert_many([{"clave": 1}, {"clave": 1}])
+    with pytest.raises(DuplicateKeyError):
+        collection.create_index([("clave", ASCENDING)], unique=True)
+    assert list(collection.index_information()) == ["_id_"]
+
+
+def test_duplicate_id(collection):
+    collection.insert_one({"_id": "a"})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"_id": "a", "otro": 1})
+    assert collection.find_one("a") == {"_id": "a"}
+
+
+# --- Sesiones ---
+
+def test_session_transaction_commits(tmp_path):
+    client = SQLiteClient(str(tmp_path / "test.sqlite3"))
+    patients, history = client["test"]["patients"], client["test"]["history"]
+
+    def write(session):
+        patients.insert_one({"_id": 1}, session=session)
+        history.insert_many([{"_id": "1/1"}, {"_id": "1/2"}], session=session)
+        return "hecho"
+
+    with client.start_session() as session:
+        assert session.with_transaction(write) == "hecho"
+    assert (patients.count_documents({}), history.count_documents({})) == (1, 2)
+    client.close()
+
+
+def test_session_transaction_rolls_back_on_error(tmp_path):
+    client = SQLiteClient(str(tmp_path / "test.sqlite3"))
+    patients, history = client["test"]["patients"], client["test"]["history"]
+    history.insert_one({"_id": "1/1"})
+
+    def write(session):
+        patients.insert_one({"_id": 1}, session=session)
+        patients.update_one({"_id": 1}, {"$set": {"v": 2}}, session=session)
+        # Un error de un lote dentro de la sesión deshace también lo anterior
+        history.bulk_write([InsertOne({"_id": "1/2"}), InsertOne({"_id": "1/1"})], session=session)
+
+    with client.start_session() as session:
+        with pytest.raises(BulkWriteError):
+            session.with_transaction(write)
+    assert patients.count_documents({}) == 0
+    assert [doc["_id"] for doc in history.find()] == ["1/1"]
+    # La conexión queda lista para la siguiente transacción
+    with client.start_session() as session:
+        session.with_transaction(lambda s: patients.insert_one({"_id": 2}, session=s))
+    assert patients.find_one({}) == {"_id": 2}
+    client.close()
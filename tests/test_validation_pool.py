@@ -0,0 +1,30 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
+
+from app.controlador.PatientValidator import PatientValidationError, PatientValidator
+from app.controlador.ValidationPool import ValidationPool
+from benchmarks.datos import synthetic_patient
+
+
+class BrokenExecutor:
+    def __init__(self):
+        self.shut_down = False
+
+    def map(self, function, tasks):
+        raise BrokenProcessPool("un proceso de validación terminó de forma abrupta")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_broken_pool_falls_back_to_inline_and_is_replaced():
+    pool = ValidationPool(PatientValidator(), processes=2, inline_max_bytes=0)
+    broken = BrokenExecutor()
+    pool._executor, pool._executor_pid = broken, os.getpid()
+    results = pool.validate_many([orjson.dumps(synthetic_patient(1)), b"{no es json"])
+    assert results[0]["resourceType"] == "Patient"
+    assert isinstance(results[1], PatientValidationError)
+    assert broken.shut_down and pool._executor is None
+    assert pool.stats() == {"processes": 2, "inline": 2, "pooled": 0}